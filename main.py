@@ -3,7 +3,6 @@ from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.client.telegram import TelegramAPIServer
 
@@ -11,15 +10,32 @@ from redis.asyncio import Redis
 from log import DebugLogging
 from models.postgres import PostgresInterface
 from models.users import UserManager
+from models.notes import NoteManager
+from models.outbox import OutboxManager
+from models.cache import PageCache
+from models.storage import RedisHashStorage
+from models.partitions import NotePartitions
+from models.querystats import QueryStats
+from reminders.scheduler import ReminderScheduler
+from reminders.delivery import DeliveryEngine
+from reminders.formatting import format_digest
+from reminders.leases import worker_id
+from reminders.outbox import OutboxRelay
+from reminders.catchup import CatchUp
+from reminders.recurrence import next_occurrence
+from reminders.maintenance import PartitionMaintenance
 from typing import Optional
 from middlewares import user_middleware
 from member_watch import MemberWatch
+from webhook import BoundedRequestHandler, webhook_app
 from telethon import TelegramClient
-from pytz import timezone
-from datetime import datetime
+from aiohttp import web
+from datetime import datetime, timedelta, timezone
 
 import plugins
 import asyncio
+import secrets
+import signal
 import sys
 import uvloop
 
@@ -30,14 +46,57 @@ TOKEN = getenv("BOT_TOKEN") or ""
 API_ID = int(getenv("API_ID") or 0)
 API_HASH = getenv("API_HASH") or ""
 log = DebugLogging(getenv("DEBUG") == "true").logger
+# сколько заметок забирается из базы за один запрос
+REMINDER_BATCH_SIZE = int(getenv("REMINDER_BATCH_SIZE") or 100)
+# за сколько минут до назначенного времени присылать напоминание
+REMINDER_LEAD = timedelta(minutes=int(getenv("REMINDER_LEAD_MINUTES") or 0))
+# на сколько часов вперед планировщик держит напоминания в памяти
+REMINDER_HORIZON = timedelta(hours=int(getenv("REMINDER_HORIZON_HOURS") or 6))
+# через сколько секунд аренда заметки упавшим воркером истекает
+REMINDER_LEASE = timedelta(seconds=int(getenv("REMINDER_LEASE_SECONDS") or 300))
+# окно дайджеста: заметки пользователя, которые должны сработать в пределах
+# окна, приходят одним сообщением. 0 - дайджест выключен
+REMINDER_DIGEST = timedelta(seconds=int(getenv("REMINDER_DIGEST_SECONDS") or 0))
+# напоминания, просроченные больше чем на столько часов, после простоя
+# приходят одной сводкой. 0 - присылать все по отдельности
+REMINDER_STALE = timedelta(hours=int(getenv("REMINDER_STALE_HOURS") or 0))
+# число конкурентных отправителей и глобальный лимит сообщений в секунду
+DELIVERY_WORKERS = int(getenv("DELIVERY_WORKERS") or 16)
+DELIVERY_RATE = float(getenv("DELIVERY_RATE") or 30)
+# на сколько месяцев вперед создаются секции notes и через сколько
+# месяцев отработанные секции уходят в архив (схема notes_archive)
+NOTES_PARTITIONS_AHEAD = int(getenv("NOTES_PARTITIONS_AHEAD") or 2)
+NOTES_RETENTION_MONTHS = int(getenv("NOTES_RETENTION_MONTHS") or 3)
+# запросы дольше стольких миллисекунд пишутся в лог. 0 - не писать
+PG_SLOW_QUERY_MS = float(getenv("PG_SLOW_QUERY_MS") or 200)
+
+# Если задан WEBHOOK_URL (адрес, по которому Telegram или локальный
+# bot-api сервер достучится до бота), апдейты принимаются вебхуком на
+# WEBHOOK_HOST:WEBHOOK_PORT вместо long polling
+WEBHOOK_URL = getenv("WEBHOOK_URL") or ""
+WEBHOOK_PATH = getenv("WEBHOOK_PATH") or "/webhook"
+WEBHOOK_HOST = getenv("WEBHOOK_HOST") or "0.0.0.0"
+WEBHOOK_PORT = int(getenv("WEBHOOK_PORT") or 8080)
+WEBHOOK_SECRET = getenv("WEBHOOK_SECRET") or ""
+# сколько соединений держит Telegram, сколько апдейтов обрабатывается
+# одновременно и сколько может ждать, прежде чем вебхук начнет отвечать 503
+WEBHOOK_MAX_CONNECTIONS = int(getenv("WEBHOOK_MAX_CONNECTIONS") or 40)
+WEBHOOK_WORKERS = int(getenv("WEBHOOK_WORKERS") or 64)
+WEBHOOK_BACKLOG = int(getenv("WEBHOOK_BACKLOG") or 1000)
 
 r = Redis(
     host=getenv("REDIS_HOST") or "localhost",
     port=int(getenv("REDIS_PORT") or 6379),
     db=getenv("REDIS_DB") or "0",
 )
-# Редис будет использоваться aiogram для хранилища стейтов
-storage = RedisStorage(redis=r)
+# Редис будет использоваться aiogram для хранилища стейтов: брошенный
+# диалог живет FSM_TTL секунд, прочитанное кэшируется в памяти на
+# FSM_LOCAL_TTL секунд (0 - без кэша)
+storage = RedisHashStorage(
+    redis=r,
+    ttl=int(getenv("FSM_TTL") or 24 * 3600),
+    local_ttl=float(getenv("FSM_LOCAL_TTL") or 1),
+)
 
 client = TelegramClient("bot_session", API_ID, API_HASH)
 
@@ -53,51 +112,148 @@ async def check_pending_notes(payload: dict) -> None:
         print("Unable to fetch bot instance.")
         sys.exit(1)
 
+    note_manager: Optional[NoteManager] = payload.get("note_manager")
+    if not note_manager:
+        print("Unable to fetch the note manager.")
+        sys.exit(1)
+
+    note_pages: Optional[PageCache] = payload.get("note_pages")
+    if not note_pages:
+        print("Unable to fetch the note page cache.")
+        sys.exit(1)
+
     async with client:
         await client.start(bot_token=TOKEN) # type: ignore
-        while True:
-            await asyncio.sleep(60)
-            # проверка каждую минуту
-
-            # вытягиваем записи где дата <= текущая+10мин
-            query = """
-            SELECT * FROM notes WHERE reminder_time <= (now()::timestamp + INTERVAL '10 min')::timestamp;
-            """
-
-            res = await sql.fetch(query)
-            if not res:
-                continue
-            for record in res:
-                serialized = dict(record)
-                if serialized['processed']:
-                    continue
-                uid = serialized["user_id"]
-
-                user_query = "SELECT * FROM users WHERE id = $1"
-                user = await sql.fetchrow(user_query, uid)
-                if not user:
-                    continue
-                user = dict(user)
-                chat_id: int = user["telegram_id"]
-                reminder_time: datetime = serialized["reminder_time"]
-                to_timezone = reminder_time.astimezone(timezone("Europe/Moscow"))
-                text: str = serialized["text"]
-
-                result_text = f"Напоминание о заметке назначенной на {to_timezone}. Текст Вашей заметки: {text}"
-
-                await client.send_message(chat_id, result_text)
-                # здесь я отошел от поставленных требований и добавил лишнее bool поле в таблицу notes.
-                # заявка помечается как обработанная, таким образом уведомление никогда не придет дважды.
-                set_processed_query = "UPDATE notes SET processed = true WHERE id = $1"
-                await sql.exec(set_processed_query, serialized['id'])
+
+        owner = worker_id()
+        outbox = OutboxManager(sql, log.debug)
+        # outbox переживает рестарты и ошибки Telegram: сообщение удаляется
+        # из него только после успешной отправки
+        relay = OutboxRelay(outbox, log, owner, lease_ttl=REMINDER_LEASE)
+
+        # отправка идет пулом воркеров с учетом лимитов Telegram
+        engine = DeliveryEngine(
+            client.send_message,
+            log,
+            workers=DELIVERY_WORKERS,
+            rate=DELIVERY_RATE,
+            # дольше аренды сообщение в движке не ждет, а уходит на повтор
+            max_delay=REMINDER_LEASE.total_seconds() / 2,
+            on_sent=relay.on_sent,
+            on_failed=relay.on_failed,
+        )
+        engine.start()
+        asyncio.create_task(relay.run(engine))
+
+        async def deliver(records) -> None:
+            if not REMINDER_DIGEST:
+                # format_digest с одной заметкой режет длинный текст на части
+                messages = [
+                    (r["telegram_id"], text, note_ids)
+                    for r in records
+                    for text, note_ids in format_digest([r])
+                ]
+            else:
+                # дайджест: все заметки пользователя одним сообщением
+                by_chat: dict[int, list] = {}
+                for record in records:
+                    by_chat.setdefault(record["telegram_id"], []).append(record)
+                messages = [
+                    (chat_id, text, note_ids)
+                    for chat_id, chat_records in by_chat.items()
+                    for text, note_ids in format_digest(chat_records)
+                ]
+            # повторяющиеся заметки переносятся на следующий повтор
+            now = datetime.now(timezone.utc)
+            reschedule = {
+                r["id"]: next_time
+                for r in records
+                if r["recurrence"]
+                and (next_time := next_occurrence(r["recurrence"], r["reminder_time"], now))
+            }
+            await outbox.enqueue_notes(messages, owner, reschedule)
+            relay.wake()
+            await note_pages.bump(*{r["telegram_id"] for r in records})
+
+        async def send_summary(chat_id: int, text: str) -> None:
+            await outbox.enqueue([(chat_id, text)])
+            relay.wake()
+
+        # хвост, накопившийся пока бот был выключен
+        catch_up = CatchUp(
+            note_manager,
+            deliver,
+            send_summary,
+            log,
+            owner,
+            REMINDER_LEASE,
+            chunk=REMINDER_BATCH_SIZE,
+            stale_after=REMINDER_STALE,
+        )
+
+        # планировщик спит до ближайшего напоминания,
+        # новые заметки приходят к нему через LISTEN/NOTIFY
+        scheduler = ReminderScheduler(
+            sql,
+            note_manager,
+            deliver,
+            log,
+            owner,
+            lead=REMINDER_LEAD,
+            horizon=REMINDER_HORIZON,
+            batch_size=REMINDER_BATCH_SIZE,
+            lease_ttl=REMINDER_LEASE,
+            digest_window=REMINDER_DIGEST,
+            catch_up=catch_up,
+        )
+        await scheduler.run()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    # секрет нужен только нам и Telegram, поэтому без него генерируется случайный
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    handler = BoundedRequestHandler(
+        dp,
+        bot,
+        log,
+        secret_token=secret,
+        workers=WEBHOOK_WORKERS,
+        backlog=WEBHOOK_BACKLOG,
+    )
+    runner = web.AppRunner(webhook_app(handler, WEBHOOK_PATH))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    try:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True,
+        )
+        log.info("Listening for webhook updates on %s:%d%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 
 async def main() -> None:
-    sql = PostgresInterface(log.debug)
+    sql = PostgresInterface(log.debug, QueryStats(log, PG_SLOW_QUERY_MS))
     await sql.init_db()
+    # kill -USR1 <pid> пишет статистику запросов в лог, kill -USR2 сбрасывает ее
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(
+        signal.SIGUSR1, lambda: log.info("Query stats:\n%s", sql.stats.dump())
+    )
+    loop.add_signal_handler(signal.SIGUSR2, sql.stats.reset)
 
     # UserManager это обертка вокруг таблицы с пользователями в базе данных
-    user_manager = UserManager(sql, log.debug)
+    # и кэш пользователей в памяти и Redis перед ней
+    user_manager = UserManager(sql, log.debug, r)
     await user_manager.create()
+    note_manager = NoteManager(sql, log.debug)
+    # кэш готовых страниц /mynotes
+    note_pages = PageCache(r, "notes")
 
     # бот может использовать локальный bot-api сервер если LOCAL_API=1
     if getenv("LOCAL_API"):
@@ -137,14 +293,27 @@ async def main() -> None:
         "redis": r,
         "prefix": prefix,
         "user_manager": user_manager,
+        "note_manager": note_manager,
+        "note_pages": note_pages,
     }
     plugin_list = plugins.init_plugins(payload)
 
     asyncio.create_task(check_pending_notes(payload))
+    # новые секции notes и архивирование старых
+    maintenance = PartitionMaintenance(
+        NotePartitions(sql, log.debug),
+        log,
+        ahead=NOTES_PARTITIONS_AHEAD,
+        retention=NOTES_RETENTION_MONTHS,
+    )
+    asyncio.create_task(maintenance.run())
     dp.include_router(watcher.router)
 
-    await bot.delete_webhook(True)
-    await dp.start_polling(bot, skip_updates=True)
+    if WEBHOOK_URL:
+        await run_webhook(dp, bot)
+    else:
+        await bot.delete_webhook(True)
+        await dp.start_polling(bot, skip_updates=True)
 
 
 if __name__ == "__main__":
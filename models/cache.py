@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+from redis.asyncio import Redis
+import json
+import time
+
+
+class TTLCache:
+    """Небольшой LRU кэш в памяти процесса с ограничением времени жизни записей"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+
+
+class PageCache:
+    """
+    Кэш отрендеренных страниц в Redis.
+
+    У каждого владельца есть версия, страницы лежат под ключом с этой
+    версией. При изменении данных версия меняется и старые страницы
+    просто перестают читаться, а затем истекают по TTL.
+
+    Реплика для чтения может отставать, поэтому bump еще и помечает
+    владельца как недавно изменившегося на `fresh_ttl` секунд: в это
+    время страницы читаются с основной базы, и под новой версией не
+    закэшируется снимок реплики без только что записанной заметки.
+
+    Версия - время изменения в наносекундах, а не счетчик: истекший или
+    вытесненный ключ версии не может вернуть версию, под которой еще
+    лежит старая страница. Поэтому ключ живет вдвое дольше страниц и не
+    остается в Redis навсегда для каждого получателя напоминаний.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        prefix: str,
+        ttl: int = 600,
+        fresh_ttl: int = 10,
+        max_entry: int = 16 * 1024,
+    ):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+        self.fresh_ttl = fresh_ttl
+        # страницы крупнее этого не кэшируются
+        self.max_entry = max_entry
+
+    def _version_key(self, owner: int) -> str:
+        return f"{self.prefix}_ver:{owner}"
+
+    def _fresh_key(self, owner: int) -> str:
+        return f"{self.prefix}_fresh:{owner}"
+
+    def _page_key(self, owner: int, version: int, key: str) -> str:
+        return f"{self.prefix}_page:{owner}:{version}:{key}"
+
+    async def version(self, owner: int) -> int:
+        return int(await self.redis.get(self._version_key(owner)) or 0)
+
+    async def recently_changed(self, owner: int) -> bool:
+        # True: реплика может еще не видеть последних изменений владельца
+        return bool(await self.redis.exists(self._fresh_key(owner)))
+
+    async def bump(self, *owners: int):
+        if not owners:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for owner in owners:
+                pipe.set(self._version_key(owner), time.time_ns(), ex=self.ttl * 2)
+                pipe.set(self._fresh_key(owner), 1, ex=self.fresh_ttl)
+            await pipe.execute()
+
+    async def get(self, owner: int, version: int, key: str) -> Optional[Any]:
+        raw = await self.redis.get(self._page_key(owner, version, key))
+        return json.loads(raw) if raw else None
+
+    async def set(self, owner: int, version: int, key: str, value: Any):
+        raw = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+        if len(raw) > self.max_entry:
+            return
+        await self.redis.set(self._page_key(owner, version, key), raw, ex=self.ttl)
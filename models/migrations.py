@@ -0,0 +1,351 @@
+from .postgres import PostgresInterface, Session
+from typing import Callable, NamedTuple
+import asyncio
+import asyncpg
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: tuple[str, ...]
+    # CREATE/DROP INDEX CONCURRENTLY нельзя выполнять в транзакции: такие
+    # миграции выполняются по одному оператору и должны быть идемпотентны,
+    # потому что после падения посередине они начнутся заново. Прерванный
+    # CREATE INDEX CONCURRENTLY оставляет невалидный индекс, поэтому перед
+    # ним ставится DROP INDEX CONCURRENTLY IF EXISTS того же индекса.
+    transactional: bool = True
+
+
+MIGRATIONS: tuple[Migration, ...] = (
+    # Исходная схема. Все операторы идемпотентны, поэтому она безопасно
+    # применяется и к базам, созданным до появления schema_version.
+    Migration(
+        1,
+        "baseline",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id                  SERIAL PRIMARY KEY,
+                telegram_id         BIGINT NOT NULL UNIQUE,
+                username            VARCHAR DEFAULT '',
+                name                VARCHAR(255),
+                email               VARCHAR(255)
+            );
+
+            -- notes до секционирования: освобождаем имена и переносим ниже
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM pg_class
+                    WHERE oid = to_regclass('notes') AND relkind = 'r'
+                ) THEN
+                    ALTER TABLE notes
+                        ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(255),
+                        ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP WITH TIME ZONE,
+                        ADD COLUMN IF NOT EXISTS recurrence VARCHAR(64);
+                    DROP INDEX IF EXISTS i_notes, i_notes_prefix, i_notes_text_tsv;
+                    ALTER INDEX notes_pkey RENAME TO notes_unpartitioned_pkey;
+                    ALTER SEQUENCE notes_id_seq OWNED BY NONE;
+                    ALTER TABLE notes RENAME TO notes_unpartitioned;
+                END IF;
+            END $$;
+
+            CREATE SEQUENCE IF NOT EXISTS notes_id_seq AS INTEGER;
+
+            -- Секции по месяцам reminder_time. Отработанные месяцы целиком
+            -- уходят в архив, и индексы горячего пути не растут с историей.
+            CREATE TABLE IF NOT EXISTS notes (
+                id                  INTEGER NOT NULL DEFAULT nextval('notes_id_seq'),
+                user_id             INTEGER NOT NULL,
+                text                TEXT,
+                processed           BOOL DEFAULT false,
+                reminder_time       TIMESTAMP WITH TIME ZONE NOT NULL,
+                lease_owner         VARCHAR(255),
+                lease_until         TIMESTAMP WITH TIME ZONE,
+                recurrence          VARCHAR(64),
+                text_tsv            TSVECTOR GENERATED ALWAYS AS (
+                    setweight(to_tsvector('russian', coalesce(text, '')), 'A') ||
+                    setweight(to_tsvector('simple', coalesce(text, '')), 'B')
+                ) STORED,
+                PRIMARY KEY (id, reminder_time),
+                CONSTRAINT notes_user_fk
+                    FOREIGN KEY(user_id)
+                    REFERENCES users(id)
+            ) PARTITION BY RANGE (reminder_time);
+
+            ALTER SEQUENCE notes_id_seq OWNED BY notes.id;
+
+            -- сюда попадают заметки, для месяца которых еще нет секции
+            CREATE TABLE IF NOT EXISTS notes_default PARTITION OF notes DEFAULT;
+
+            CREATE SCHEMA IF NOT EXISTS notes_archive;
+
+            -- Создает секцию на месяц (UTC) и переносит в нее строки этого
+            -- месяца из notes_default. false, если секция уже есть.
+            CREATE OR REPLACE FUNCTION notes_create_partition(month TIMESTAMP)
+            RETURNS BOOLEAN AS $$
+            DECLARE
+                lower_bound TIMESTAMPTZ := date_trunc('month', month) AT TIME ZONE 'UTC';
+                upper_bound TIMESTAMPTZ := (date_trunc('month', month) + INTERVAL '1 month') AT TIME ZONE 'UTC';
+                part TEXT := 'notes_p' || to_char(month, 'YYYYMM');
+                cols TEXT := 'id, user_id, text, processed, reminder_time, lease_owner, lease_until, recurrence';
+            BEGIN
+                -- реплики не должны создавать одну секцию одновременно
+                PERFORM pg_advisory_xact_lock(hashtext('notes_create_partition'));
+                IF to_regclass(part) IS NOT NULL
+                   OR to_regclass('notes_archive.' || part) IS NOT NULL THEN
+                    RETURN false;
+                END IF;
+                EXECUTE format(
+                    'CREATE TABLE %I (LIKE notes INCLUDING DEFAULTS INCLUDING GENERATED)', part
+                );
+                EXECUTE format(
+                    'WITH moved AS (
+                        DELETE FROM notes_default
+                        WHERE reminder_time >= $1 AND reminder_time < $2
+                        RETURNING %s
+                    ) INSERT INTO %I(%s) SELECT * FROM moved',
+                    cols, part, cols
+                ) USING lower_bound, upper_bound;
+                -- с этим ограничением ATTACH не сканирует секцию
+                EXECUTE format(
+                    'ALTER TABLE %I ADD CONSTRAINT %I CHECK (reminder_time >= %L AND reminder_time < %L)',
+                    part, part || '_range', lower_bound, upper_bound
+                );
+                EXECUTE format(
+                    'ALTER TABLE notes ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    part, lower_bound, upper_bound
+                );
+                RETURN true;
+            END $$ LANGUAGE plpgsql;
+
+            -- переносим заметки из старой таблицы, сразу по секциям
+            DO $$
+            BEGIN
+                IF to_regclass('notes_unpartitioned') IS NOT NULL THEN
+                    PERFORM notes_create_partition(m)
+                    FROM (
+                        SELECT DISTINCT date_trunc('month', reminder_time AT TIME ZONE 'UTC') AS m
+                        FROM notes_unpartitioned
+                    ) months;
+                    INSERT INTO notes(
+                        id, user_id, text, processed, reminder_time,
+                        lease_owner, lease_until, recurrence
+                    )
+                    SELECT id, user_id, text, processed, reminder_time,
+                           lease_owner, lease_until, recurrence
+                    FROM notes_unpartitioned;
+                    DROP TABLE notes_unpartitioned;
+                END IF;
+            END $$;
+
+            SELECT notes_create_partition(
+                date_trunc('month', now() AT TIME ZONE 'UTC') + make_interval(months => m)
+            )
+            FROM generate_series(0, 2) AS m;
+
+            CREATE TABLE IF NOT EXISTS reminder_outbox (
+                id                  BIGSERIAL PRIMARY KEY,
+                chat_id             BIGINT NOT NULL,
+                text                TEXT NOT NULL,
+                note_ids            INTEGER[] NOT NULL DEFAULT '{}',
+                attempts            INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at     TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                lease_owner         VARCHAR(255),
+                lease_until         TIMESTAMP WITH TIME ZONE,
+                last_error          TEXT,
+                created_at          TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+            );
+
+            CREATE TABLE IF NOT EXISTS reminder_outbox_dead (
+                id                  BIGINT PRIMARY KEY,
+                chat_id             BIGINT NOT NULL,
+                text                TEXT NOT NULL,
+                note_ids            INTEGER[] NOT NULL,
+                attempts            INTEGER NOT NULL,
+                last_error          TEXT,
+                created_at          TIMESTAMP WITH TIME ZONE NOT NULL,
+                failed_at           TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+            );
+
+            CREATE INDEX IF NOT EXISTS i_reminder_outbox
+            ON reminder_outbox(next_attempt_at);
+
+            CREATE INDEX IF NOT EXISTS i_users
+            ON users(telegram_id, name, email);
+
+            CREATE INDEX IF NOT EXISTS i_notes
+            ON notes(user_id, reminder_time);
+
+            -- рабочий набор планировщика: только неотправленные заметки
+            CREATE INDEX IF NOT EXISTS i_notes_pending
+            ON notes(reminder_time) WHERE processed = false;
+
+            CREATE INDEX IF NOT EXISTS i_notes_prefix
+            ON notes(user_id, lower(text) text_pattern_ops) WHERE processed = false;
+
+            CREATE INDEX IF NOT EXISTS i_notes_text_tsv
+            ON notes USING GIN (text_tsv);
+            """,
+        ),
+    ),
+    # i_users дублирует UNIQUE(telegram_id) и замедляет каждый upsert
+    Migration(
+        2,
+        "drop_i_users",
+        ("DROP INDEX CONCURRENTLY IF EXISTS i_users",),
+        transactional=False,
+    ),
+    Migration(3, "pg_trgm", ("CREATE EXTENSION IF NOT EXISTS pg_trgm",)),
+    # Поиск по username ведется по lower(username). Индексы по
+    # выражению вместо отдельной колонки: добавление колонки переписало бы
+    # всю таблицу users под эксклюзивной блокировкой.
+    Migration(
+        4,
+        "users_username_lookup",
+        (
+            "DROP INDEX CONCURRENTLY IF EXISTS i_users_username",
+            # точное совпадение и поиск по началу: диапазон ~>=~ и ~<~ по префиксу
+            """
+            CREATE INDEX CONCURRENTLY i_users_username
+            ON users (lower(username) text_pattern_ops)
+            """,
+            "DROP INDEX CONCURRENTLY IF EXISTS i_users_username_trgm",
+            # поиск по подстроке: LIKE '%abc%' от трех символов
+            """
+            CREATE INDEX CONCURRENTLY i_users_username_trgm
+            ON users USING gin (lower(username) gin_trgm_ops)
+            """,
+        ),
+        transactional=False,
+    ),
+    # notes_create_partition больше не отказывается создавать секцию для
+    # месяца из архива: иначе новые строки этого месяца навсегда
+    # оставались бы в notes_default
+    Migration(
+        5,
+        "notes_recreate_archived_partitions",
+        (
+            """
+            CREATE OR REPLACE FUNCTION notes_create_partition(month TIMESTAMP)
+            RETURNS BOOLEAN AS $$
+            DECLARE
+                lower_bound TIMESTAMPTZ := date_trunc('month', month) AT TIME ZONE 'UTC';
+                upper_bound TIMESTAMPTZ := (date_trunc('month', month) + INTERVAL '1 month') AT TIME ZONE 'UTC';
+                part TEXT := 'notes_p' || to_char(month, 'YYYYMM');
+                cols TEXT := 'id, user_id, text, processed, reminder_time, lease_owner, lease_until, recurrence';
+            BEGIN
+                -- реплики не должны создавать одну секцию одновременно
+                PERFORM pg_advisory_xact_lock(hashtext('notes_create_partition'));
+                -- секция месяца, уже ушедшего в архив, создается заново:
+                -- NotePartitions.archive потом сольет ее с архивной
+                IF to_regclass(part) IS NOT NULL THEN
+                    RETURN false;
+                END IF;
+                EXECUTE format(
+                    'CREATE TABLE %I (LIKE notes INCLUDING DEFAULTS INCLUDING GENERATED)', part
+                );
+                EXECUTE format(
+                    'WITH moved AS (
+                        DELETE FROM notes_default
+                        WHERE reminder_time >= $1 AND reminder_time < $2
+                        RETURNING %s
+                    ) INSERT INTO %I(%s) SELECT * FROM moved',
+                    cols, part, cols
+                ) USING lower_bound, upper_bound;
+                -- с этим ограничением ATTACH не сканирует секцию
+                EXECUTE format(
+                    'ALTER TABLE %I ADD CONSTRAINT %I CHECK (reminder_time >= %L AND reminder_time < %L)',
+                    part, part || '_range', lower_bound, upper_bound
+                );
+                EXECUTE format(
+                    'ALTER TABLE notes ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    part, lower_bound, upper_bound
+                );
+                RETURN true;
+            END $$ LANGUAGE plpgsql;
+            """,
+        ),
+    ),
+)
+# ключ advisory lock, под которым реплики применяют миграции по очереди
+LOCK_KEY = 0x5C4E4D41
+
+
+class SchemaMigrator:
+    """
+    Применяет миграции из MIGRATIONS, которых еще нет в schema_version.
+
+    Если схема актуальна, при старте выполняется один SELECT. Иначе
+    реплика берет advisory lock, перечитывает версию и применяет
+    недостающие миграции по порядку. Транзакционная миграция и запись о
+    ней в schema_version фиксируются вместе.
+    """
+
+    def __init__(
+        self,
+        sql: PostgresInterface,
+        debug: Callable,
+        migrations: tuple[Migration, ...] = MIGRATIONS,
+        lock_poll: float = 1,
+    ):
+        self.sql = sql
+        self.debug = debug
+        self.migrations = sorted(migrations)
+        self.latest = max((m.version for m in migrations), default=0)
+        self.lock_poll = lock_poll
+
+    async def version(self) -> int:
+        try:
+            res = await self.sql.fetchrow("SELECT max(version) FROM schema_version")
+        except asyncpg.UndefinedTableError:
+            return 0
+        return res[0] or 0
+
+    async def migrate(self) -> int:
+        if await self.version() >= self.latest:
+            return 0
+
+        async with self.sql.connection() as session:
+            # Ждем блокировку опросом, а не pg_advisory_lock: заблокированный
+            # запрос держал бы снимок, и CREATE INDEX CONCURRENTLY другой
+            # реплики ждал бы его вечно.
+            while not await session.fetchval("SELECT pg_try_advisory_lock($1)", LOCK_KEY):
+                await asyncio.sleep(self.lock_poll)
+            try:
+                return await self._migrate(session)
+            finally:
+                await session.exec("SELECT pg_advisory_unlock($1)", LOCK_KEY)
+
+    async def _migrate(self, session: Session) -> int:
+        await session.exec(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version             INTEGER PRIMARY KEY,
+                name                VARCHAR(255) NOT NULL,
+                applied_at          TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+            )
+        """
+        )
+        current = await session.fetchval("SELECT coalesce(max(version), 0) FROM schema_version")
+        applied = 0
+        for migration in self.migrations:
+            if migration.version <= current:
+                continue
+            self.debug("MIGRATE %d %s" % (migration.version, migration.name))
+            if migration.transactional:
+                async with session.conn.transaction():
+                    await self._apply(session, migration)
+            else:
+                await self._apply(session, migration)
+            applied += 1
+        return applied
+
+    async def _apply(self, session: Session, migration: Migration):
+        for statement in migration.statements:
+            await session.exec(statement)
+        await session.exec(
+            "INSERT INTO schema_version(version, name) VALUES ($1, $2)",
+            migration.version,
+            migration.name,
+        )
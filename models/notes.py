@@ -0,0 +1,177 @@
+from .postgres import PostgresInterface
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Callable, Any
+
+# канал LISTEN/NOTIFY, в который сообщается о новых заметках.
+# payload: "<id> <reminder_time в epoch секундах>"
+NOTES_CHANNEL = "notes_new"
+# payload, по которому планировщик перечитывает окно целиком
+# (например после массового импорта)
+NOTES_RELOAD = "reload"
+# колонки, которые заполняются при импорте
+IMPORT_COLUMNS = ("user_id", "text", "processed", "reminder_time", "recurrence")
+
+
+class NoteManager:
+    """
+    Обертка над таблицей notes для рассылки напоминаний.
+
+    Заметка сначала арендуется воркером (lease_owner/lease_until), а
+    processed ставится только после отправки. Если воркер упал, аренда
+    истекает и заметку забирает другой воркер.
+    """
+
+    def __init__(self, sql: PostgresInterface, debug: Callable):
+        self.sql = sql
+        self.debug = debug
+
+    async def upcoming(self, since: datetime, until: datetime) -> list[Any]:
+        # необработанные заметки, которые должны сработать в (since, until]
+        return await self.sql.fetch(
+            """
+            SELECT id, reminder_time FROM notes
+            WHERE processed = false AND reminder_time > $1 AND reminder_time <= $2
+            ORDER BY reminder_time
+        """,
+            since,
+            until,
+        )
+
+    async def stream_overdue(
+        self, since: datetime, until: datetime, chunk: int
+    ) -> AsyncIterator[list[int]]:
+        # Серверный курсор отдает id просроченных заметок пачками, начиная
+        # с самых свежих, так что память не зависит от размера хвоста.
+        async with self.sql.transaction() as session:
+            ids = []
+            async for rec in session.cursor(
+                """
+                SELECT id FROM notes
+                WHERE processed = false
+                  AND reminder_time >= $1 AND reminder_time <= $2
+                ORDER BY reminder_time DESC
+            """,
+                since,
+                until,
+                prefetch=chunk,
+            ):
+                ids.append(rec["id"])
+                if len(ids) >= chunk:
+                    yield ids
+                    ids = []
+            if ids:
+                yield ids
+
+    async def stream_user_notes(
+        self, user_id: int, chunk: int = 1000
+    ) -> AsyncIterator[Any]:
+        # все заметки пользователя через серверный курсор на реплике
+        # чтения, по одной строке
+        async with self.sql.transaction(replica=True, readonly=True) as session:
+            async for rec in session.cursor(
+                """
+                SELECT text, reminder_time, processed, recurrence FROM notes
+                WHERE user_id = $1
+                ORDER BY reminder_time, id
+            """,
+                user_id,
+                prefetch=chunk,
+            ):
+                yield rec
+
+    async def import_notes(self, records: list[tuple]) -> int:
+        # Заметки грузятся через COPY в одной транзакции: либо все, либо
+        # ничего. Вместо NOTIFY на каждую заметку планировщик получает
+        # одно уведомление и перечитывает окно.
+        async with self.sql.transaction() as session:
+            count = await session.copy("notes", records, IMPORT_COLUMNS)
+            await session.exec("SELECT pg_notify($1, $2)", NOTES_CHANNEL, NOTES_RELOAD)
+        self.debug("IMPORTED %d notes" % count)
+        return count
+
+    async def collapse_stale(self, before: datetime) -> list[Any]:
+        # Слишком старые напоминания не рассылаются по одному: они сразу
+        # помечаются обработанными, а наружу отдается сводка по каждому
+        # пользователю (одна строка на пользователя). Повторяющиеся заметки
+        # не гасятся: они сработают один раз и перейдут на следующий повтор.
+        return await self.sql.fetch(
+            """
+            WITH stale AS (
+                SELECT id FROM notes
+                WHERE processed = false AND reminder_time < $1 AND recurrence IS NULL
+                  AND (lease_until IS NULL OR lease_until < now())
+                FOR UPDATE SKIP LOCKED
+            ), done AS (
+                UPDATE notes SET processed = true, lease_owner = NULL, lease_until = NULL
+                FROM stale WHERE notes.id = stale.id
+                RETURNING notes.user_id, notes.reminder_time
+            )
+            SELECT users.telegram_id, count(*) AS missed,
+                   min(done.reminder_time) AS first, max(done.reminder_time) AS last
+            FROM done JOIN users ON users.id = done.user_id
+            GROUP BY users.telegram_id
+        """,
+            before,
+        )
+
+    async def claim(self, ids: list[int], owner: str, ttl: timedelta) -> list[Any]:
+        # Атомарно арендуем заметки. SKIP LOCKED не дает двум воркерам
+        # забрать одну строку, а JOIN с users избавляет от отдельного
+        # запроса на каждую заметку.
+        return await self.sql.fetch(
+            """
+            WITH due AS (
+                SELECT id FROM notes
+                WHERE id = ANY($1::int[]) AND processed = false
+                  AND (lease_until IS NULL OR lease_until < now())
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE notes SET lease_owner = $2, lease_until = now() + $3::interval
+            FROM due, users
+            WHERE notes.id = due.id AND users.id = notes.user_id
+            RETURNING notes.id, notes.user_id, notes.text,
+                      notes.reminder_time, notes.recurrence, users.telegram_id
+        """,
+            ids,
+            owner,
+            ttl,
+        )
+
+    async def claim_due(
+        self, lead: timedelta, limit: int, owner: str, ttl: timedelta
+    ) -> list[Any]:
+        # то же что claim, но по времени: подбирает просроченные аренды
+        # упавших воркеров и все, что планировщик мог пропустить
+        return await self.sql.fetch(
+            """
+            WITH due AS (
+                SELECT id FROM notes
+                WHERE processed = false
+                  AND reminder_time <= now() + $1::interval
+                  AND (lease_until IS NULL OR lease_until < now())
+                ORDER BY reminder_time
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE notes SET lease_owner = $3, lease_until = now() + $4::interval
+            FROM due, users
+            WHERE notes.id = due.id AND users.id = notes.user_id
+            RETURNING notes.id, notes.user_id, notes.text,
+                      notes.reminder_time, notes.recurrence, users.telegram_id
+        """,
+            lead,
+            limit,
+            owner,
+            ttl,
+        )
+
+    async def ack(self, ids: list[int], owner: str):
+        # помечаем отправленные заметки обработанными одним запросом
+        await self.sql.exec(
+            """
+            UPDATE notes SET processed = true, lease_owner = NULL, lease_until = NULL
+            WHERE id = ANY($1::int[]) AND lease_owner = $2
+        """,
+            ids,
+            owner,
+        )
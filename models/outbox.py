@@ -0,0 +1,168 @@
+from .postgres import PostgresInterface
+from .notes import NOTES_CHANNEL
+from datetime import datetime, timedelta
+from typing import Callable, Any, Optional
+
+
+class OutboxManager:
+    """
+    Обертка над таблицей reminder_outbox - очередью исходящих напоминаний.
+
+    Строка живет в outbox пока сообщение не отправлено. Отправитель
+    арендует строки, после отправки удаляет их, при ошибке откладывает
+    следующую попытку, а безнадежные переносит в reminder_outbox_dead.
+    """
+
+    def __init__(self, sql: PostgresInterface, debug: Callable):
+        self.sql = sql
+        self.debug = debug
+
+    async def enqueue_notes(
+        self,
+        messages: list[tuple[int, str, tuple[int, ...]]],
+        owner: str,
+        reschedule: Optional[dict[int, datetime]] = None,
+    ) -> int:
+        # Одним запросом кладем сообщения в outbox и помечаем их заметки
+        # обработанными. Сообщение попадает в outbox только если все его
+        # заметки все еще арендованы нами, иначе их уже забрала другая реплика.
+        # Повторяющиеся заметки из reschedule не гасятся, а переносятся на
+        # следующий повтор, и планировщик узнает об этом через NOTIFY.
+        reschedule = reschedule or {}
+        res = await self.sql.fetchrow(
+            f"""
+            WITH done AS (
+                UPDATE notes SET
+                    processed = f.next_time IS NULL,
+                    reminder_time = coalesce(f.next_time, notes.reminder_time),
+                    lease_owner = NULL,
+                    lease_until = NULL
+                FROM (
+                    SELECT n.id, r.next_time FROM unnest($4::int[]) AS n(id)
+                    LEFT JOIN unnest($6::int[], $7::timestamptz[]) AS r(id, next_time)
+                    ON r.id = n.id
+                ) f
+                WHERE notes.id = f.id AND notes.lease_owner = $5
+                RETURNING notes.id, notes.reminder_time, f.next_time IS NOT NULL AS repeat
+            ), ins AS (
+                INSERT INTO reminder_outbox(chat_id, text, note_ids)
+                SELECT m.chat_id, m.text, string_to_array(m.ids, ',')::int[]
+                FROM unnest($1::bigint[], $2::text[], $3::text[]) AS m(chat_id, text, ids)
+                WHERE string_to_array(m.ids, ',')::int[] <@ (SELECT array_agg(id) FROM done)
+                RETURNING id
+            ), notified AS (
+                SELECT pg_notify('{NOTES_CHANNEL}', id || ' ' || extract(epoch FROM reminder_time))
+                FROM done WHERE repeat
+            )
+            SELECT (SELECT count(*) FROM ins), (SELECT count(*) FROM notified)
+        """,
+            [m[0] for m in messages],
+            [m[1] for m in messages],
+            [",".join(map(str, m[2])) for m in messages],
+            [i for m in messages for i in m[2]],
+            owner,
+            list(reschedule.keys()),
+            list(reschedule.values()),
+        )
+        return res[0]
+
+    async def enqueue(self, messages: list[tuple[int, str]]):
+        # сообщения, не привязанные к заметкам (сводки)
+        await self.sql.exec(
+            """
+            INSERT INTO reminder_outbox(chat_id, text)
+            SELECT * FROM unnest($1::bigint[], $2::text[])
+        """,
+            [m[0] for m in messages],
+            [m[1] for m in messages],
+        )
+
+    async def lease(self, owner: str, ttl: timedelta, limit: int) -> list[Any]:
+        return await self.sql.fetch(
+            """
+            WITH due AS (
+                SELECT id FROM reminder_outbox
+                WHERE next_attempt_at <= now()
+                  AND (lease_until IS NULL OR lease_until < now())
+                ORDER BY next_attempt_at
+                LIMIT $3
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE reminder_outbox o SET lease_owner = $1, lease_until = now() + $2::interval
+            FROM due WHERE o.id = due.id
+            RETURNING o.id, o.chat_id, o.text, o.attempts
+        """,
+            owner,
+            ttl,
+            limit,
+        )
+
+    async def renew(self, ids: list[int], owner: str, ttl: timedelta):
+        # продлевает аренду сообщений, которые еще ждут отправки
+        await self.sql.exec(
+            """
+            UPDATE reminder_outbox SET lease_until = now() + $3::interval
+            WHERE id = ANY($1::bigint[]) AND lease_owner = $2
+        """,
+            ids,
+            owner,
+            ttl,
+        )
+
+    async def next_attempt(self) -> Optional[datetime]:
+        # ближайший момент, когда в outbox появится что отправить
+        res = await self.sql.fetchrow(
+            """
+            SELECT min(greatest(next_attempt_at, coalesce(lease_until, next_attempt_at)))
+            FROM reminder_outbox
+        """
+        )
+        return res[0]
+
+    async def ack(self, ids: list[int], owner: str):
+        await self.sql.exec(
+            "DELETE FROM reminder_outbox WHERE id = ANY($1::bigint[]) AND lease_owner = $2",
+            ids,
+            owner,
+        )
+
+    async def retry(
+        self, ids: list[int], errors: list[str], delays: list[float], owner: str
+    ):
+        await self.sql.exec(
+            """
+            UPDATE reminder_outbox o SET
+                attempts = o.attempts + 1,
+                next_attempt_at = now() + make_interval(secs => f.delay),
+                last_error = f.error,
+                lease_owner = NULL,
+                lease_until = NULL
+            FROM unnest($1::bigint[], $2::text[], $3::float8[]) AS f(id, error, delay)
+            WHERE o.id = f.id AND o.lease_owner = $4
+        """,
+            ids,
+            errors,
+            delays,
+            owner,
+        )
+
+    async def bury(self, ids: list[int], errors: list[str], owner: str):
+        # переносим сообщения, которые не получится доставить, в отдельную таблицу
+        await self.sql.exec(
+            """
+            WITH moved AS (
+                DELETE FROM reminder_outbox o
+                USING unnest($1::bigint[], $2::text[]) AS f(id, error)
+                WHERE o.id = f.id AND o.lease_owner = $3
+                RETURNING o.id, o.chat_id, o.text, o.note_ids,
+                          o.attempts + 1, f.error, o.created_at
+            )
+            INSERT INTO reminder_outbox_dead(
+                id, chat_id, text, note_ids, attempts, last_error, created_at
+            )
+            SELECT * FROM moved
+        """,
+            ids,
+            errors,
+            owner,
+        )
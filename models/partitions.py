@@ -0,0 +1,114 @@
+from .postgres import PostgresInterface
+from datetime import datetime
+from typing import Callable
+import asyncpg
+
+ARCHIVE_SCHEMA = "notes_archive"
+# колонки notes без генерируемой text_tsv
+COLUMNS = "id, user_id, text, processed, reminder_time, lease_owner, lease_until, recurrence"
+
+
+def month_start(when: datetime, shift: int = 0) -> datetime:
+    # начало месяца со сдвигом на shift месяцев (без зоны, в UTC)
+    months = when.year * 12 + when.month - 1 + shift
+    return datetime(months // 12, months % 12 + 1, 1)
+
+
+def partition_month(name: str) -> datetime:
+    # notes_p202408 -> 2024-08-01
+    return datetime.strptime(name.removeprefix("notes_p"), "%Y%m")
+
+
+class NotePartitions:
+    """
+    Обслуживание секций таблицы notes.
+
+    Секции создаются на `ahead` месяцев вперед, а также для месяцев, строки
+    которых уже лежат в notes_default, в том числе уже архивированных.
+    Секции старше `retention` месяцев, в которых не осталось
+    неотправленных заметок, отсоединяются от notes и переносятся в схему
+    notes_archive или дописываются к уже лежащей там секции того же месяца.
+    """
+
+    def __init__(self, sql: PostgresInterface, debug: Callable, lock_timeout: str = "2s"):
+        self.sql = sql
+        self.debug = debug
+        self.lock_timeout = lock_timeout
+
+    async def partitions(self) -> list[str]:
+        records = await self.sql.fetch(
+            """
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'notes'::regclass AND c.relname LIKE 'notes\\_p%'
+            ORDER BY c.relname
+        """
+        )
+        return [r["relname"] for r in records]
+
+    async def create(self, now: datetime, ahead: int) -> list[str]:
+        horizon = month_start(now, ahead + 1)
+        stray = await self.sql.fetch(
+            """
+            SELECT DISTINCT date_trunc('month', reminder_time AT TIME ZONE 'UTC') AS month
+            FROM notes_default WHERE reminder_time < $1::timestamp AT TIME ZONE 'UTC'
+        """,
+            horizon,
+        )
+        months = {month_start(now, shift) for shift in range(ahead + 1)}
+        months.update(r["month"] for r in stray)
+
+        created = []
+        for month in sorted(months):
+            res = await self.sql.fetchrow("SELECT notes_create_partition($1)", month)
+            if res[0]:
+                created.append(f"notes_p{month:%Y%m}")
+        return created
+
+    async def _archive(self, name: str):
+        # DETACH ... CONCURRENTLY при наличии notes_default Postgres не
+        # разрешает, а обычный DETACH берет ACCESS EXCLUSIVE на notes.
+        # Сама операция мгновенная, опасно только ожидание блокировки за
+        # долгим запросом: все новые запросы встали бы в очередь за ней.
+        # Поэтому ждем не дольше lock_timeout и при неудаче уходим.
+        async with self.sql.transaction() as session:
+            await session.exec(f"SET LOCAL lock_timeout = '{self.lock_timeout}'")
+            await session.exec(f'ALTER TABLE notes DETACH PARTITION "{name}"')
+            exists = await session.fetchval("SELECT to_regclass($1)", f"{ARCHIVE_SCHEMA}.{name}")
+            if exists is None:
+                await session.exec(f'ALTER TABLE "{name}" SET SCHEMA {ARCHIVE_SCHEMA}')
+                return
+            # месяц уже был в архиве, а секция создана заново для поздних
+            # строк: дописываем их к архивной
+            await session.exec(
+                f"""
+                INSERT INTO {ARCHIVE_SCHEMA}."{name}"({COLUMNS})
+                SELECT {COLUMNS} FROM "{name}"
+            """
+            )
+            await session.exec(f'DROP TABLE "{name}"')
+
+    async def archive(self, now: datetime, retention: int) -> list[str]:
+        before = month_start(now, -retention)
+        archived = []
+        for name in await self.partitions():
+            if partition_month(name) >= before:
+                continue
+            # заметка могла так и не отправиться: такую секцию не трогаем
+            pending = await self.sql.fetchrow(
+                f'SELECT EXISTS (SELECT 1 FROM "{name}" WHERE processed = false)'
+            )
+            if pending[0]:
+                continue
+            try:
+                await self._archive(name)
+            except asyncpg.LockNotAvailableError:
+                # notes занята долгим запросом: попробуем в следующий раз
+                self.debug("Archiving %s timed out waiting for a lock" % name)
+                continue
+            except asyncpg.PostgresError:
+                # секцию уже отсоединила другая реплика
+                self.debug("Unable to archive %s" % name)
+                continue
+            archived.append(name)
+        return archived
@@ -1,43 +1,295 @@
 import asyncpg
 import traceback
-from typing import Callable, Any
+from .querystats import QueryStats, Truncated
+from time import perf_counter
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Optional, Sequence
 from os import getenv
 
 
+def escape_like(text: str) -> str:
+    # спецсимволы шаблона LIKE становятся обычными символами
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def prefix_range(prefix: str) -> tuple[str, str]:
+    """
+    Границы [от, до) для строк, начинающихся с `prefix`, в побайтовом
+    порядке операторов ~>=~ и ~<~ (индексы с text_pattern_ops).
+
+    LIKE 'abc%' превращается в диапазон по индексу, только если шаблон
+    известен при планировании. asyncpg всегда готовит запросы, и с общим
+    планом параметр $1 в LIKE читает весь индекс, а явный диапазон
+    работает в любом плане.
+    """
+    for i in range(len(prefix) - 1, -1, -1):
+        code = ord(prefix[i]) + 1
+        if 0xD800 <= code < 0xE000:
+            # суррогаты не кодируются в UTF-8
+            code = 0xE000
+        if code <= 0x10FFFF:
+            return prefix, prefix[:i] + chr(code)
+    # префикс из одних U+10FFFF на практике не встречается
+    return prefix, prefix + "\U0010ffff"
+
+
 class PostgresInterface:
 
-    def __init__(self, debug: Callable):
+    def __init__(self, debug: Callable, stats: Optional[QueryStats] = None):
         self.debug = debug
+        # статистика по запросам exec/fetch/fetchrow
+        self.stats = stats or QueryStats()
+        self._read_pool: Optional[asyncpg.Pool] = None
 
-    async def init_db(self):
-        auth = f"{getenv('POSTGRESQL_USERNAME')}:{getenv('POSTGRESQL_PASSWORD')}@{getenv('POSTGRESQL_HOST')}:{getenv('POSTGRESQL_WRITE_PORT')}"
+    @staticmethod
+    def pool_options(prefix: str) -> dict:
+        # настройки пула из env: POSTGRESQL_POOL_MAX, POSTGRESQL_READ_POOL_MAX и т.д.
+        options = {
+            "min_size": int(getenv(f"{prefix}_POOL_MIN") or 10),
+            "max_size": int(getenv(f"{prefix}_POOL_MAX") or 10),
+            "statement_cache_size": int(getenv(f"{prefix}_STATEMENT_CACHE") or 100),
+            # соединение, простоявшее столько секунд, закрывается
+            "max_inactive_connection_lifetime": float(
+                getenv(f"{prefix}_CONN_LIFETIME") or 300
+            ),
+        }
+        # после стольких запросов соединение пересоздается. 0 - никогда
+        max_queries = int(getenv(f"{prefix}_MAX_QUERIES") or 0)
+        if max_queries:
+            options["max_queries"] = max_queries
+        return options
+
+    async def create_pool(self, host: str, port: str, prefix: str) -> asyncpg.Pool:
+        auth = f"{getenv('POSTGRESQL_USERNAME')}:{getenv('POSTGRESQL_PASSWORD')}@{host}:{port}"
         try:
-            self.pool = await asyncpg.create_pool(
-                f"postgresql://{auth}/{getenv('POSTGRESQL_DATABASE')}"
+            pool = await asyncpg.create_pool(
+                f"postgresql://{auth}/{getenv('POSTGRESQL_DATABASE')}",
+                **self.pool_options(prefix),
             )
         except ConnectionRefusedError as e:
             self.debug(traceback.format_exc())
             print(e)
             exit(1)
-        self.debug("PG CONNECT")
+        self.debug("PG CONNECT %s:%s", host, port)
+        return pool  # type: ignore
+
+    async def init_db(self):
+        self.pool = await self.create_pool(
+            getenv("POSTGRESQL_HOST") or "", getenv("POSTGRESQL_WRITE_PORT") or "", "POSTGRESQL"
+        )
+        # Чтение списков можно отдать реплике. Без POSTGRESQL_READ_HOST все
+        # запросы идут в основную базу.
+        read_host = getenv("POSTGRESQL_READ_HOST")
+        if read_host:
+            self._read_pool = await self.create_pool(
+                read_host,
+                getenv("POSTGRESQL_READ_PORT") or getenv("POSTGRESQL_WRITE_PORT") or "",
+                "POSTGRESQL_READ",
+            )
+
+    @property
+    def read_pool(self) -> asyncpg.Pool:
+        return self._read_pool or self.pool
+
+    async def listen(self, channel: str, callback: Callable) -> asyncpg.Connection:
+        # LISTEN требует выделенного соединения, оно не возвращается в пул
+        # пока слушатель жив
+        conn: asyncpg.Connection = await self.pool.acquire()  # type: ignore
+        await conn.add_listener(channel, callback)
+        self.debug("LISTEN %s" % channel)
+        return conn
+
+    async def unlisten(self, conn: asyncpg.Connection, channel: str, callback: Callable):
+        if not conn.is_closed():
+            await conn.remove_listener(channel, callback)
+        await self.pool.release(conn)
+
+    async def _timed(
+        self,
+        method: str,
+        query: str,
+        args: tuple,
+        call: Awaitable,
+        wait: float = 0.0,
+        replica: bool = False,
+    ) -> Any:
+        # отладочная строка собирается логгером, только если DEBUG включен
+        self.debug("%s %s", query, Truncated(args))
+
+        start = perf_counter()
+        rows = 0
+        error = True
+        try:
+            result = await call
+            error = False
+        finally:
+            if not error:
+                rows = self._rows(method, result)
+            self.stats.record(
+                query, perf_counter() - start, wait, rows, error, args, replica
+            )
+        return result
+
+    async def _run(self, method: str, query: str, args: tuple, replica: bool = False) -> Any:
+        async with self.connection(replica) as session:
+            return await session.call(method, query, args)
+
+    @staticmethod
+    def _rows(method: str, result: Any) -> int:
+        if method == "fetch":
+            return len(result)
+        if method == "fetchrow":
+            return result is not None
+        # статус вида "UPDATE 5", "INSERT 0 1" или "COPY 100"
+        count = result.rpartition(" ")[2] if isinstance(result, str) else ""
+        return int(count) if count.isdigit() else 0
+
+    @asynccontextmanager
+    async def connection(self, replica: bool = False) -> AsyncIterator["Session"]:
+        """Одно соединение из пула на несколько запросов подряд"""
+        pool = self.read_pool if replica else self.pool
+        start = perf_counter()
+        conn: asyncpg.Connection
+        async with pool.acquire() as conn:  # type: ignore
+            yield Session(self, conn, perf_counter() - start, replica)
+
+    @asynccontextmanager
+    async def transaction(self, replica: bool = False, **options) -> AsyncIterator["Session"]:
+        """
+        Запросы в одной транзакции на одном соединении. options передаются
+        в asyncpg Connection.transaction (isolation, readonly, deferrable).
+        """
+        async with self.connection(replica) as session:
+            async with session.conn.transaction(**options):
+                yield session
+
+    def pipeline(self) -> "Pipeline":
+        return Pipeline(self)
 
     async def exec(self, query, *args):
-        self.debug("%s %s" % (query, str(args)[:600]))
+        await self._run("execute", query, args)
 
-        conn: asyncpg.pool.Pool
-        async with self.pool.acquire() as conn:  # type: ignore
-            await conn.execute(query, *args)
+    # replica=True отправляет запрос в пул чтения. Только для чтений, которым
+    # не нужна только что записанная этим же пользователем строка.
+    async def fetch(self, query, *args, replica: bool = False) -> list[Any]:
+        return await self._run("fetch", query, args, replica)
 
-    async def fetch(self, query, *args) -> list[Any]:
-        self.debug("%s %s" % (query, str(args)[:600]))
+    async def fetchrow(self, query, *args, replica: bool = False) -> Any:
+        return await self._run("fetchrow", query, args, replica)
 
-        conn: asyncpg.pool.Pool
-        async with self.pool.acquire() as conn:  # type: ignore
-            return await conn.fetch(query, *args)
+    async def fetchval(self, query, *args, replica: bool = False) -> Any:
+        return await self._run("fetchval", query, args, replica)
+
+    async def executemany(self, query: str, args: Iterable[Sequence]):
+        async with self.connection() as session:
+            await session.executemany(query, args)
+
+    async def copy(self, table: str, records: Iterable[Sequence], columns: Sequence[str]) -> int:
+        async with self.connection() as session:
+            return await session.copy(table, records, columns)
+
+
+class Session:
+    """
+    Запросы на закрепленном соединении, см. PostgresInterface.connection и
+    PostgresInterface.transaction. Статистика пишется так же, как для
+    запросов через пул.
+    """
+
+    def __init__(
+        self, sql: PostgresInterface, conn: asyncpg.Connection, wait: float, replica: bool
+    ):
+        self.sql = sql
+        self.conn = conn
+        self.replica = replica
+        # время ожидания пула записывается на первый запрос
+        self._wait = wait
+
+    async def call(
+        self, method: str, query: str, args: tuple, call: Optional[Awaitable] = None
+    ) -> Any:
+        wait, self._wait = self._wait, 0.0
+        if call is None:
+            call = getattr(self.conn, method)(query, *args)
+        return await self.sql._timed(method, query, args, call, wait, self.replica)
+
+    async def exec(self, query, *args):
+        await self.call("execute", query, args)
+
+    async def fetch(self, query, *args) -> list[Any]:
+        return await self.call("fetch", query, args)
 
     async def fetchrow(self, query, *args) -> Any:
-        self.debug("%s %s" % (query, str(args)[:600]))
+        return await self.call("fetchrow", query, args)
+
+    async def fetchval(self, query, *args) -> Any:
+        return await self.call("fetchval", query, args)
+
+    async def executemany(self, query: str, args: Iterable[Sequence]):
+        # asyncpg отправляет все наборы аргументов одним конвейером
+        args = list(args)
+        await self.call(
+            "executemany", query, (len(args),), self.conn.executemany(query, args)
+        )
+
+    async def copy(self, table: str, records: Iterable[Sequence], columns: Sequence[str]) -> int:
+        # COPY ... FROM STDIN, самый быстрый способ загрузить много строк
+        status = await self.call(
+            "copy",
+            f"COPY {table}",
+            (),
+            self.conn.copy_records_to_table(table, records=records, columns=list(columns)),
+        )
+        return self.sql._rows("copy", status)
+
+    def cursor(self, query: str, *args, prefetch: int = 100) -> Any:
+        # серверный курсор, работает только внутри transaction()
+        self.sql.debug("CURSOR %s %s", query, Truncated(args))
+        return self.conn.cursor(query, *args, prefetch=prefetch)
+
+
+class Pipeline:
+    """
+    Накопитель запросов, которые выполняются вместе при выходе из
+    `async with sql.pipeline() as p`: на одном соединении и в одной
+    транзакции. Подряд идущие одинаковые запросы уходят одним executemany,
+    то есть одним конвейером без ожидания ответа на каждую строку.
+    """
+
+    def __init__(self, sql: PostgresInterface):
+        self.sql = sql
+        self._queue: list[tuple[str, tuple]] = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, query: str, *args):
+        self._queue.append((query, args))
+
+    def batches(self) -> list[tuple[str, list[tuple]]]:
+        batches: list[tuple[str, list[tuple]]] = []
+        for query, args in self._queue:
+            if batches and batches[-1][0] == query:
+                batches[-1][1].append(args)
+            else:
+                batches.append((query, [args]))
+        return batches
+
+    async def run(self):
+        batches = self.batches()
+        self._queue = []
+        if not batches:
+            return
+        async with self.sql.transaction() as session:
+            for query, args in batches:
+                if len(args) == 1:
+                    await session.exec(query, *args[0])
+                else:
+                    await session.executemany(query, args)
+
+    async def __aenter__(self) -> "Pipeline":
+        return self
 
-        conn: asyncpg.pool.Pool
-        async with self.pool.acquire() as conn:  # type: ignore
-            return await conn.fetchrow(query, *args)
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.run()
@@ -0,0 +1,154 @@
+from bisect import bisect_left
+from functools import lru_cache
+from logging import Logger
+from typing import Optional
+import re
+
+# верхние границы корзин гистограммы латентности, мс
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# строковые и числовые литералы, но не параметры $1
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![$\w])\d+\b")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(query: str) -> str:
+    # запросы одного вида с разными литералами попадают в одну строку
+    # статистики
+    return _LITERALS.sub("?", " ".join(query.split()))
+
+
+class QueryCounters:
+    __slots__ = ("calls", "errors", "rows", "total", "max", "wait", "max_wait", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.wait = 0.0
+        self.max_wait = 0.0
+        # последняя корзина - все, что дольше BUCKETS[-1]
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def percentile(self, q: float) -> float:
+        # верхняя граница корзины, в которую попадает q-й перцентиль
+        rank = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return 0.0
+
+
+class QueryStats:
+    """
+    Статистика запросов PostgresInterface по отпечаткам запросов: число
+    вызовов и ошибок, возвращенные строки, гистограмма времени выполнения
+    и время ожидания соединения из пула.
+
+    Запросы дольше `slow_threshold` мс пишутся в лог предупреждением.
+    Текст запроса форматируется только для этого лога.
+    """
+
+    def __init__(self, log: Optional[Logger] = None, slow_threshold: float = 0):
+        self.log = log
+        self.slow_threshold = slow_threshold
+        self._queries: dict[str, QueryCounters] = {}
+
+    def record(
+        self,
+        query: str,
+        elapsed: float,
+        wait: float,
+        rows: int = 0,
+        error: bool = False,
+        args: tuple = (),
+        replica: bool = False,
+    ):
+        # elapsed и wait в секундах
+        key = fingerprint(query)
+        if replica:
+            key = f"[replica] {key}"
+        counters = self._queries.get(key)
+        if counters is None:
+            counters = self._queries[key] = QueryCounters()
+        ms = elapsed * 1000
+        counters.calls += 1
+        counters.errors += error
+        counters.rows += rows
+        counters.total += ms
+        counters.max = max(counters.max, ms)
+        counters.wait += wait * 1000
+        counters.max_wait = max(counters.max_wait, wait * 1000)
+        counters.buckets[bisect_left(BUCKETS, ms)] += 1
+
+        if self.log and self.slow_threshold and ms >= self.slow_threshold:
+            self.log.warning(
+                "Slow query %.1f ms (pool wait %.1f ms, %d rows): %s %s",
+                ms,
+                wait * 1000,
+                rows,
+                key,
+                Truncated(args),
+            )
+
+    def snapshot(self) -> dict[str, dict]:
+        return {
+            key: {
+                "calls": c.calls,
+                "errors": c.errors,
+                "rows": c.rows,
+                "total_ms": c.total,
+                "avg_ms": c.total / c.calls,
+                "p50_ms": c.percentile(0.5),
+                "p95_ms": c.percentile(0.95),
+                "p99_ms": c.percentile(0.99),
+                "max_ms": c.max,
+                "avg_wait_ms": c.wait / c.calls,
+                "max_wait_ms": c.max_wait,
+            }
+            for key, c in self._queries.items()
+        }
+
+    def dump(self, limit: int = 30) -> str:
+        # самые дорогие по суммарному времени запросы сверху
+        rows = sorted(self.snapshot().items(), key=lambda kv: kv[1]["total_ms"], reverse=True)
+        lines = [
+            "%8s %6s %9s %9s %8s %8s %8s %9s  query"
+            % ("calls", "errors", "rows", "total_ms", "avg_ms", "p95_ms", "max_ms", "wait_ms")
+        ]
+        for key, s in rows[:limit]:
+            lines.append(
+                "%8d %6d %9d %9.1f %8.2f %8.0f %8.1f %9.2f  %s"
+                % (
+                    s["calls"],
+                    s["errors"],
+                    s["rows"],
+                    s["total_ms"],
+                    s["avg_ms"],
+                    s["p95_ms"],
+                    s["max_ms"],
+                    s["avg_wait_ms"],
+                    key[:160],
+                )
+            )
+        return "\n".join(lines)
+
+    def reset(self):
+        self._queries = {}
+
+
+class Truncated:
+    """Аргументы запроса для лога, строка собирается только при выводе"""
+
+    __slots__ = ("args", "limit")
+
+    def __init__(self, args: tuple, limit: int = 600):
+        self.args = args
+        self.limit = limit
+
+    def __str__(self) -> str:
+        return str(self.args)[: self.limit]
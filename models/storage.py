@@ -0,0 +1,157 @@
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from .cache import TTLCache
+from typing import Any, Optional
+from redis.asyncio import Redis
+import json
+
+# (состояние, данные) диалога
+Entry = tuple[Optional[str], dict[str, Any]]
+
+
+class RedisHashStorage(BaseStorage):
+    """
+    Хранилище стейтов aiogram: состояние и данные диалога лежат в одном
+    хеше Redis, поэтому читаются одним HGETALL, а записываются вместе с
+    продлением TTL одним запросом.
+
+    Брошенный диалог удаляется через `ttl` секунд после последней записи.
+    Прочитанное и записанное запоминается в памяти процесса на
+    `local_ttl` секунд: проверка состояния в middleware aiogram и
+    get_state/get_data в обработчике того же апдейта обходятся одним
+    запросом. Запись проходит через этот кэш, так что сам процесс всегда
+    видит свои изменения. Другая реплика бота может видеть старое
+    состояние не дольше `local_ttl`, 0 отключает кэш.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        prefix: str = "fsm",
+        ttl: Optional[int] = 24 * 3600,
+        local_ttl: float = 1,
+        local_size: int = 10000,
+    ):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+        self._local = TTLCache(local_size, local_ttl) if local_ttl > 0 else None
+
+    def _key(self, key: StorageKey) -> str:
+        parts = [self.prefix, str(key.bot_id), str(key.chat_id)]
+        if key.thread_id:
+            parts.append(str(key.thread_id))
+        parts.append(str(key.user_id))
+        if key.business_connection_id:
+            parts.append(key.business_connection_id)
+        parts.append(key.destiny)
+        return ":".join(parts)
+
+    @staticmethod
+    def _state(state: StateType) -> Optional[str]:
+        return state.state if isinstance(state, State) else state
+
+    @staticmethod
+    def _dumps(data: dict[str, Any]) -> str:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+    def _remember(self, name: str, entry: Entry):
+        if self._local is not None:
+            # копия: обработчик может менять полученный словарь
+            self._local.set(name, (entry[0], dict(entry[1])))
+
+    async def _load(self, key: StorageKey) -> Entry:
+        name = self._key(key)
+        if self._local is not None:
+            entry = self._local.get(name)
+            if entry is not None:
+                return entry
+        raw = {
+            k.decode("utf-8") if isinstance(k, bytes) else k: v
+            for k, v in (await self.redis.hgetall(name)).items()
+        }
+        state = raw.get("state")
+        data = raw.get("data")
+        entry = (
+            state.decode("utf-8") if isinstance(state, bytes) else state,
+            json.loads(data) if data else {},
+        )
+        self._remember(name, entry)
+        return entry
+
+    async def set(self, key: StorageKey, state: StateType, data: dict[str, Any]):
+        """Записывает состояние и данные одним запросом"""
+        name = self._key(key)
+        state = self._state(state)
+        if state is None and not data:
+            await self.redis.delete(name)
+        else:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                fields = {"data": self._dumps(data)} if data else {}
+                if state is not None:
+                    fields["state"] = state
+                pipe.hset(name, mapping=fields)
+                if state is None:
+                    pipe.hdel(name, "state")
+                if not data:
+                    pipe.hdel(name, "data")
+                if self.ttl:
+                    pipe.expire(name, self.ttl)
+                await pipe.execute()
+        self._remember(name, (state, data))
+
+    async def _set_field(self, key: StorageKey, field: str, value: Optional[str]) -> str:
+        name = self._key(key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if value is None:
+                pipe.hdel(name, field)
+            else:
+                pipe.hset(name, field, value)
+                if self.ttl:
+                    pipe.expire(name, self.ttl)
+            await pipe.execute()
+        return name
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = self._state(state)
+        name = await self._set_field(key, "state", state)
+        if self._local is not None:
+            entry = self._local.get(name)
+            if entry is not None:
+                self._remember(name, (state, entry[1]))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(key))[0]
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        name = await self._set_field(key, "data", self._dumps(data) if data else None)
+        if self._local is not None:
+            entry = self._local.get(name)
+            if entry is not None:
+                self._remember(name, (entry[0], data))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return dict((await self._load(key))[1])
+
+    async def update_data(self, key: StorageKey, data: dict[str, Any]) -> dict[str, Any]:
+        current = {**(await self._load(key))[1], **data}
+        await self.set_data(key, current)
+        return dict(current)
+
+    async def close(self) -> None:
+        await self.redis.aclose(close_connection_pool=True)
+
+
+async def set_dialog(context: FSMContext, state: StateType, data: dict[str, Any]):
+    """Переводит диалог в `state` с данными `data` одной записью в хранилище"""
+    if isinstance(context.storage, RedisHashStorage):
+        await context.storage.set(context.key, state, data)
+    else:
+        await context.set_state(state)
+        await context.set_data(data)
+
+
+async def clear_dialog(context: FSMContext):
+    """Завершает диалог одним запросом вместо двух в FSMContext.clear()"""
+    await set_dialog(context, None, {})
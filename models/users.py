@@ -1,8 +1,10 @@
-from asyncio import get_event_loop
 from .basemodel import BaseModel
-from .postgres import PostgresInterface
-from typing import Callable, Optional
-import asyncpg
+from .postgres import PostgresInterface, escape_like, prefix_range
+from .cache import TTLCache
+from .migrations import SchemaMigrator
+from typing import Callable, ClassVar, Optional
+from redis.asyncio import Redis
+import asyncio
 import json
 
 
@@ -11,10 +13,22 @@ class UserAnonymous:
 
 
 class User:
+    """
+    Пользователь из таблицы users.
 
-    def __init__(self, sql: PostgresInterface, data: dict, user_manager: "UserManager"):
-        super().__init__()
-        self.sql = sql
+    Присваивание username/name/email только запоминает изменение, в базу
+    оно попадает через `await user.save()` одним UPDATE по id. Несколько
+    пользователей сохраняются одним запросом через UserManager.save_many.
+    """
+
+    __slots__ = ("_id", "_telegram_id", "_username", "_name", "_email", "_dirty")
+
+    # колонки, которые можно менять через атрибуты
+    COLUMNS: ClassVar[tuple[str, ...]] = ("username", "name", "email")
+    # через него сохраняются изменения, назначается в UserManager
+    manager: ClassVar[Optional["UserManager"]] = None
+
+    def __init__(self, data: dict):
         # id отвечает id записи в базе данных
         self._id = data["id"]
         # telegram_id соответствует id пользователя в телеграме
@@ -22,26 +36,35 @@ class User:
         self._username = data["username"]
         self._name = data["name"].strip() if data["name"] else ""
         self._email = data["email"]
-        self.user_manager = user_manager
-
-    def set_column(self, col, value):
-        get_event_loop().run_until_complete(
-            self.sql.exec(
-                f"""
-            UPDATE users SET {col} = $1
-        """,
-                value,
-            )
-        )
+        self._dirty: set[str] = set()
 
     def __repr__(self):
-        self.__str__()
+        return self.__str__()
 
     def __str__(self):
         return str(
             ["Instance of User", self.id, self.telegram_id, self.username, self.email]
         )
 
+    def as_dict(self) -> dict:
+        return {
+            "id": self._id,
+            "telegram_id": self._telegram_id,
+            "username": self._username,
+            "name": self._name,
+            "email": self._email,
+        }
+
+    def changes(self) -> dict:
+        return {col: getattr(self, col) for col in self.COLUMNS if col in self._dirty}
+
+    async def save(self):
+        if not self._dirty:
+            return
+        if self.manager is None:
+            raise RuntimeError("User.manager is not set")
+        await self.manager.save_many([self])
+
     @property
     def id(self):
         return self._id
@@ -56,7 +79,8 @@ class User:
 
     @username.setter
     def username(self, value):
-        self.set_column("username", value)
+        self._username = value
+        self._dirty.add("username")
 
     @property
     def name(self):
@@ -64,7 +88,8 @@ class User:
 
     @name.setter
     def name(self, value):
-        self.set_column("name", value)
+        self._name = value
+        self._dirty.add("name")
 
     @property
     def email(self):
@@ -72,65 +97,144 @@ class User:
 
     @email.setter
     def email(self, value):
-        self.set_column("email", value)
+        self._email = value
+        self._dirty.add("email")
+
+
+class UserUpsertBatcher:
+    """
+    Склеивает upsert'ы пользователей, пришедшие за `delay` секунд (или до
+    `max_batch` штук), в один запрос INSERT ... SELECT FROM unnest(...)
+    и раздает вернувшиеся строки ожидающим вызовам.
+    """
+
+    def __init__(self, sql: PostgresInterface, delay: float = 0.005, max_batch: int = 500):
+        self.sql = sql
+        self.delay = delay
+        self.max_batch = max_batch
+        # telegram_id -> (username, ожидающие future). Один telegram_id
+        # попадает в запрос один раз: ON CONFLICT не может обновить строку дважды
+        self._pending: dict[int, tuple[Optional[str], list[asyncio.Future]]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writes: set[asyncio.Task] = set()
+
+    async def upsert(self, telegram_id: int, username: Optional[str]) -> Optional[dict]:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        waiters = self._pending[telegram_id][1] if telegram_id in self._pending else []
+        waiters.append(fut)
+        # последний username побеждает, как и при последовательных upsert'ах
+        self._pending[telegram_id] = (username, waiters)
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.delay, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        task = asyncio.create_task(self._write(batch))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, batch: dict[int, tuple[Optional[str], list[asyncio.Future]]]):
+        try:
+            rows = await self.sql.fetch(
+                """
+                INSERT INTO users(telegram_id, username)
+                SELECT * FROM unnest($1::bigint[], $2::text[])
+                ON CONFLICT (telegram_id) DO UPDATE SET
+                username = EXCLUDED.username
+                RETURNING id, telegram_id, username, name, email
+            """,
+                list(batch.keys()),
+                [username for username, _ in batch.values()],
+            )
+        except Exception as e:
+            for _, waiters in batch.values():
+                for fut in waiters:
+                    if not fut.done():
+                        fut.set_exception(e)
+            return
+
+        by_id = {row["telegram_id"]: dict(row) for row in rows}
+        for telegram_id, (_, waiters) in batch.items():
+            for fut in waiters:
+                if not fut.done():
+                    fut.set_result(by_id.get(telegram_id))
 
 
 class UserManager(BaseModel):
+    """
+    Пользователи кэшируются в два уровня: LRU в памяти процесса и Redis.
+    Для известного telegram_id с тем же username база не трогается вовсе,
+    в Postgres пишутся только новые пользователи и смена username.
+    """
 
-    def __init__(self, sql: PostgresInterface, debug: Callable):
+    def __init__(
+        self,
+        sql: PostgresInterface,
+        debug: Callable,
+        redis: Optional[Redis] = None,
+        local_ttl: float = 30,
+        local_size: int = 10000,
+        redis_ttl: int = 3600,
+    ):
         super().__init__()
         self.sql = sql
         self.debug = debug
+        self.redis = redis
+        self.redis_ttl = redis_ttl
+        # короткий TTL: другие реплики узнают об изменениях через Redis
+        self._local = TTLCache(local_size, local_ttl)
+        # промахи кэша пишутся в базу пачками
+        self._upserts = UserUpsertBatcher(sql)
+        User.manager = self
 
     async def _init_table(self):
-        await self.sql.exec(
-            """
-        CREATE TABLE IF NOT EXISTS users (
-            id                  SERIAL PRIMARY KEY,
-            telegram_id         BIGINT NOT NULL UNIQUE,
-            username            VARCHAR DEFAULT '',
-            name                VARCHAR(255),
-            email               VARCHAR(255)
-        );
-
-        CREATE TABLE IF NOT EXISTS notes (
-            id                  SERIAL PRIMARY KEY,
-            user_id             INTEGER NOT NULL,
-            text                TEXT,
-            processed           BOOL DEFAULT false,
-            reminder_time       TIMESTAMP WITH TIME ZONE NOT NULL,
-            CONSTRAINT notes_user_fk
-                FOREIGN KEY(user_id)
-                REFERENCES users(id)
-        );
-
-        CREATE INDEX IF NOT EXISTS i_users
-        ON users(telegram_id, name, email);
-
-        CREATE INDEX IF NOT EXISTS i_notes
-        ON notes(user_id, reminder_time);
-        """
-        )
+        # схема всех таблиц описана в models/migrations.py
+        await SchemaMigrator(self.sql, self.debug).migrate()
+
+    @staticmethod
+    def _cache_key(telegram_id: int) -> str:
+        return f"user:{telegram_id}"
+
+    async def _cached(self, telegram_id: int) -> Optional[dict]:
+        data = self._local.get(telegram_id)
+        if data is not None or not self.redis:
+            return data
+        raw = await self.redis.get(self._cache_key(telegram_id))
+        if not raw:
+            return None
+        data = json.loads(raw)
+        self._local.set(telegram_id, data)
+        return data
+
+    async def _remember(self, data: dict):
+        self._local.set(data["telegram_id"], data)
+        if self.redis:
+            await self.redis.set(
+                self._cache_key(data["telegram_id"]),
+                json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+                ex=self.redis_ttl,
+            )
 
     async def user_entry(
         self,
         username: Optional[str],
         telegram_id: int,
     ) -> User | UserAnonymous:
-        res = await self.sql.fetch(
-            """
-            WITH ins1 AS (
-                INSERT INTO users(telegram_id, username)
-                VALUES ($1, $2)
-                ON CONFLICT (telegram_id) DO UPDATE SET
-                username = $2
-                RETURNING id, telegram_id, username, name, email
-            )
-            SELECT * from ins1
-        """,
-            telegram_id,
-            username,
-        )
+        cached = await self._cached(telegram_id)
+        if cached is not None and cached["username"] == username:
+            return User(cached)
+
+        data = await self._upserts.upsert(telegram_id, username)
 
         d = {
             'uid': telegram_id,
@@ -144,35 +248,116 @@ class UserManager(BaseModel):
             ).decode("utf-8")
         )
 
-        if len(res) > 0:
-            return User(self.sql, dict(res[0]), self)
+        if data is not None:
+            await self._remember(data)
+            return User(data)
         else:
             return UserAnonymous()
 
-    async def get_user(self, telegram_id: int) -> User | UserAnonymous:
-        user = None
-        conn: asyncpg.pool.Pool
-        async with self.sql.pool.acquire() as conn:  # type: ignore
-            user = await conn.fetchrow(
-                """
-                SELECT *  
-                FROM users WHERE telegram_id = $1
+    async def save_many(self, users: list[User]):
+        dirty = [u for u in users if u._dirty]
+        if not dirty:
+            return
+        if len(dirty) == 1:
+            # один пользователь: обновляем только измененные колонки
+            user = dirty[0]
+            changes = user.changes()
+            assignments = ", ".join(
+                f"{col} = ${i}" for i, col in enumerate(changes, start=1)
+            )
+            await self.sql.exec(
+                f"UPDATE users SET {assignments} WHERE id = ${len(changes) + 1}",
+                *changes.values(),
+                user.id,
+            )
+        else:
+            # несколько пользователей одним запросом: для каждой колонки
+            # передается флаг, менялась ли она у этого пользователя
+            columns = ", ".join(
+                f"{col} = CASE WHEN c.set_{col} THEN c.{col} ELSE u.{col} END"
+                for col in User.COLUMNS
+            )
+            names = ", ".join(f"set_{col}, {col}" for col in User.COLUMNS)
+            types = ", ".join(
+                f"${i * 2 + 2}::bool[], ${i * 2 + 3}::text[]"
+                for i in range(len(User.COLUMNS))
+            )
+            args = []
+            for col in User.COLUMNS:
+                args.append([col in u._dirty for u in dirty])
+                args.append([getattr(u, col) if col in u._dirty else None for u in dirty])
+            await self.sql.exec(
+                f"""
+                UPDATE users u SET {columns}
+                FROM unnest($1::int[], {types}) AS c(id, {names})
+                WHERE u.id = c.id
             """,
-                telegram_id,
+                [u.id for u in dirty],
+                *args,
             )
+
+        for user in dirty:
+            user._dirty.clear()
+            await self._remember(user.as_dict())
+
+    async def get_user(self, telegram_id: int) -> User | UserAnonymous:
+        user = await self.sql.fetchrow(
+            "SELECT * FROM users WHERE telegram_id = $1", telegram_id, replica=True
+        )
         if not user:
             return UserAnonymous()
-        return User(self.sql, dict(user), self)
+        return User(dict(user))
 
-    async def find_user_by_username(self, username: str) -> User | UserAnonymous:
-        conn: asyncpg.pool.Pool
-        async with self.sql.pool.acquire() as conn:  # type: ignore
-            user = await conn.fetchrow(
+    @staticmethod
+    def normalize_username(username: str) -> str:
+        # username в телеграме не зависит от регистра и пишется с '@'
+        return username.strip().lstrip("@").lower()
+
+    async def search_users(self, username: str, limit: int = 10) -> list[User]:
+        """
+        Пользователи, чей username начинается с `username` или содержит его.
+
+        Сначала идут совпадения по началу в порядке индекса i_users_username,
+        поэтому точное совпадение всегда первое. Если их меньше `limit`,
+        добавляются совпадения по подстроке через триграммный индекс,
+        самые похожие первыми. Подстрока короче трех символов не ищется:
+        для нее триграммный индекс бесполезен.
+        """
+        name = self.normalize_username(username)
+        if not name or limit < 1:
+            return []
+        start, end = prefix_range(name)
+        rows = list(
+            await self.sql.fetch(
+                """
+                SELECT * FROM users
+                WHERE lower(username) ~>=~ $1 AND lower(username) ~<~ $2
+                ORDER BY lower(username) USING ~<~ LIMIT $3
+            """,
+                start,
+                end,
+                limit,
+                replica=True,
+            )
+        )
+        if len(rows) < limit and len(name) >= 3:
+            prefix = escape_like(name) + "%"
+            rows += await self.sql.fetch(
                 """
-                SELECT * FROM users WHERE username LIKE $1
+                SELECT * FROM users
+                WHERE lower(username) LIKE $1 AND lower(username) NOT LIKE $2
+                ORDER BY similarity(lower(username), $3) DESC, lower(username)
+                LIMIT $4
             """,
-                f"%{username}%",
+                "%" + prefix,
+                prefix,
+                name,
+                limit - len(rows),
+                replica=True,
             )
-            if not user:
-                return UserAnonymous()
-            return User(self.sql, dict(user), self)
+        return [User(dict(row)) for row in rows]
+
+    async def find_user_by_username(self, username: str) -> User | UserAnonymous:
+        # точное совпадение, а если его нет - самое подходящее
+        found = await self.search_users(username, limit=1)
+        return found[0] if found else UserAnonymous()
@@ -1,12 +1,16 @@
 from .register_user import Register
 from .notes import Notes
+from .inline import InlineNotes
+from .transfer import NotesTransfer
 
 
 def init_plugins(payload):
     pl = [
         # Порядок регистрации плагинов имеет значение
         Register,
-        Notes
+        Notes,
+        InlineNotes,
+        NotesTransfer,
     ]
     for i, plugin in enumerate(pl):
         pl[i] = plugin(**payload) # type: ignore
@@ -0,0 +1,122 @@
+from aiogram import types, Dispatcher
+from models.postgres import PostgresInterface, prefix_range
+from models.users import User
+from models.cache import PageCache, TTLCache
+from typing import Any, Callable
+from datetime import datetime
+from pytz import timezone
+import asyncio
+
+
+class InlineNotes:
+    """
+    Поиск предстоящих заметок в inline режиме (@bot текст).
+
+    Telegram присылает запрос на каждое нажатие клавиши, поэтому:
+    - запрос пользователя ждет `debounce` секунд и считается только
+      если за это время не пришел более новый;
+    - готовые ответы живут в памяти `local_ttl` секунд под версией
+      заметок пользователя, так что новая заметка сразу видна в выдаче;
+    - ответ помечается is_personal и кэшируется самим Telegram на
+      `cache_time` секунд.
+    """
+
+    # Telegram отдает в выдаче не больше 50 результатов
+    limit = 20
+    cache_time = 10
+    debounce = 0.3
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        sql: PostgresInterface,
+        debug: Callable,
+        note_pages: PageCache,
+        local_ttl: float = 10,
+        local_size: int = 10000,
+        **_,
+    ):
+        self.dp = dp
+        self.sql = sql
+        self.debug = debug
+        self.pages = note_pages
+        self._results = TTLCache(local_size, local_ttl)
+        # id последнего запроса каждого пользователя
+        self._latest: dict[int, str] = {}
+
+        self.dp.inline_query.register(self.inline_query)
+
+    async def fetch(self, user_id: int, prefix: str, replica: bool = True) -> list[Any]:
+        # Обе ветки читают индекс: без текста i_notes(user_id, reminder_time),
+        # с текстом частичный i_notes_prefix по lower(text) диапазоном префикса.
+        if not prefix:
+            query = """
+            SELECT id, text, reminder_time FROM notes
+            WHERE user_id = $1 AND processed = false AND reminder_time > now()
+            ORDER BY reminder_time LIMIT $2
+            """
+            return await self.sql.fetch(query, user_id, self.limit, replica=replica)
+        query = """
+        SELECT id, text, reminder_time FROM notes
+        WHERE user_id = $1 AND processed = false
+          AND lower(text) ~>=~ $2 AND lower(text) ~<~ $3 AND reminder_time > now()
+        ORDER BY reminder_time LIMIT $4
+        """
+        start, end = prefix_range(prefix.lower())
+        return await self.sql.fetch(query, user_id, start, end, self.limit, replica=replica)
+
+    @staticmethod
+    def build_results(records: list[Any]) -> list[types.InlineQueryResultArticle]:
+        results = []
+        for item in records:
+            txt = item["text"] or ""
+            d = item["reminder_time"].astimezone(timezone("Europe/Moscow"))
+            d = datetime.strftime(d, '%d-%m-%Y %H:%M')
+            results.append(
+                types.InlineQueryResultArticle(
+                    id=str(item["id"]),
+                    title=txt[:64] or "Без текста",
+                    description=d,
+                    input_message_content=types.InputTextMessageContent(
+                        message_text=f"{d}\n{txt}"[:4096],
+                        parse_mode=None,
+                    ),
+                )
+            )
+        return results
+
+    async def answer(self, query: types.InlineQuery, results: list):
+        await query.answer(results, cache_time=self.cache_time, is_personal=True)
+
+    async def inline_query(self, query: types.InlineQuery, user: User):
+        if not user.email:
+            return await query.answer(
+                [],
+                cache_time=self.cache_time,
+                is_personal=True,
+                button=types.InlineQueryResultsButton(
+                    text="Пройдите регистрацию", start_parameter="register"
+                ),
+            )
+
+        owner_id = query.from_user.id
+        prefix = query.query.strip()[:256]
+        version = await self.pages.version(owner_id)
+        key = (owner_id, version, prefix)
+        results = self._results.get(key)
+        if results is not None:
+            return await self.answer(query, results)
+
+        # Ждем, не напечатает ли пользователь что-то еще. Устаревшие
+        # запросы остаются без ответа, Telegram их просто отбросит.
+        self._latest[owner_id] = query.id
+        await asyncio.sleep(self.debounce)
+        if self._latest.get(owner_id) != query.id:
+            return
+        del self._latest[owner_id]
+
+        # сразу после изменения заметок реплика может отставать
+        replica = not await self.pages.recently_changed(owner_id)
+        results = self.build_results(await self.fetch(user.id, prefix, replica))
+        self._results.set(key, results)
+        await self.answer(query, results)
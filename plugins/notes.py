@@ -1,16 +1,35 @@
 from aiogram import F, types, Dispatcher, Bot, filters
 from models.postgres import PostgresInterface
-from typing import Callable, cast, Iterable, NamedTuple
+from typing import Awaitable, Callable, cast, Iterable, NamedTuple
 from models.users import User
+from models.notes import NOTES_CHANNEL
+from models.cache import PageCache
+from models.storage import clear_dialog, set_dialog
+from reminders import recurrence
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.exceptions import TelegramBadRequest
 from traceback import format_exc
-from datetime import datetime, timedelta
-import json
+from datetime import datetime, timedelta, timezone as dt_timezone
 from redis.asyncio import Redis
 from pytz import timezone
-import math
+import hashlib
+import html
+import struct
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def to_base36(value: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        value, rem = divmod(value, 36)
+        out = digits[rem] + out
+        if not value:
+            return out
 
 
 class Duration(NamedTuple):
@@ -29,6 +48,7 @@ kb = [
         types.KeyboardButton(text="15м"),
     ],
     [types.KeyboardButton(text="30м"), types.KeyboardButton(text="1ч"), types.KeyboardButton(text="1д")],
+    [types.KeyboardButton(text="ежедневно"), types.KeyboardButton(text="по будням")],
 ]
 DATES_KB = types.ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
@@ -36,6 +56,8 @@ DATES_KB = types.ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 class Notes:
     command = "addnote"
     items_per_page = 5
+    # листать /mynotes правкой сообщения, а не удалением и новой отправкой
+    edit_in_place = True
 
     def __init__(
         self,
@@ -45,6 +67,7 @@ class Notes:
         debug: Callable,
         prefix: str,
         redis: Redis,
+        note_pages: PageCache,
         **_,
     ):
         self.dp = dp
@@ -53,6 +76,7 @@ class Notes:
         self.debug = debug
         self.prefix = prefix
         self.redis = redis
+        self.pages = note_pages
 
         self.dp.message.register(
             self.note_entry,
@@ -63,6 +87,9 @@ class Notes:
         self.dp.message.register(self.my_notes, filters.Command(commands=['mynotes'], prefix=self.prefix))
         self.dp.callback_query.register(self.next_page, F.data.startswith("nextpage_"))
         self.dp.callback_query.register(self.prev_page, F.data.startswith("prevpage_"))
+        self.dp.message.register(self.search, filters.Command(commands=['search'], prefix=self.prefix))
+        self.dp.callback_query.register(self.turn_search_page, F.data.startswith("snext_"))
+        self.dp.callback_query.register(self.turn_search_page, F.data.startswith("sprev_"))
 
     def get_duration(self, arg: str) -> Duration:
         units = {
@@ -89,190 +116,371 @@ class Notes:
         if not key:
             return Duration(None)
 
-        date = datetime.now() + timedelta(**{key[0]: length})
+        date = datetime.now(recurrence.TZ) + timedelta(**{key[0]: length})
         return Duration(duration=date)
 
-    async def my_notes(self, message: types.Message, user: User, state: FSMContext):
-        if not message.from_user:
-            return
-        if not user.email:
-            return await message.reply(
-                "Вы не зарегистрированы! Пройдите регистрацию через команду /start"
-            )
+    @staticmethod
+    def encode_cursor(reminder_time: datetime, note_id: int) -> str:
+        # ключ (reminder_time, id) в base36, чтобы уложиться в 64 байта callback_data
+        us = (reminder_time - EPOCH) // timedelta(microseconds=1)
+        return f"{to_base36(us)}_{to_base36(note_id)}"
 
-        chat_id = message.chat.id
-        user_id = message.from_user.id
+    @staticmethod
+    def decode_cursor(ts: str, note_id: str) -> tuple[datetime, int]:
+        return EPOCH + timedelta(microseconds=int(ts, 36)), int(note_id, 36)
 
-        query = "SELECT * FROM notes WHERE user_id = $1 ORDER BY reminder_time DESC"
-        records = await self.sql.fetch(query, user.id)
-        if not records:
-            await message.reply("Заметок нет.")
+    @staticmethod
+    def encode_rank_cursor(rank: float, note_id: int) -> str:
+        # ранг хранится как float4 в hex, чтобы сравнение в базе было точным
+        return f"{struct.pack('>f', rank).hex()}_{to_base36(note_id)}"
 
-        records = [dict(i) for i in records]
-        for rec in records:
-            for key in rec.keys():
-                # сериализация дат
-                if key == "reminder_time":
-                    d = rec[key].astimezone(timezone("Europe/Moscow"))
-                    rec[key] = datetime.strftime(d, '%d-%m-%Y %H:%M')
-
-        kb = InlineKeyboardBuilder()
-        total_items = len(records)
-        page = 1
-        pages = math.ceil(total_items / self.items_per_page)
-
-        offset = (page - 1) * self.items_per_page
-        current = records[offset : offset + self.items_per_page]
+    @staticmethod
+    def decode_rank_cursor(rank: str, note_id: str) -> tuple[float, int]:
+        return struct.unpack('>f', bytes.fromhex(rank))[0], int(note_id, 36)
 
+    async def fetch_page(
+        self,
+        user_id: int,
+        cursor: tuple[datetime, int] | None = None,
+        backward: bool = False,
+        replica: bool = True,
+    ) -> tuple[list, bool]:
+        # Keyset пагинация по (reminder_time, id): страница читается по
+        # индексу i_notes и стоит items_per_page + 1 строку, лишняя строка
+        # говорит о том, есть ли что-то дальше. Списки читаются с реплики,
+        # если заметки пользователя не менялись только что.
+        limit = self.items_per_page + 1
+        if cursor is None:
+            query = """
+            SELECT id, text, reminder_time, recurrence FROM notes WHERE user_id = $1
+            ORDER BY reminder_time DESC, id DESC LIMIT $2
+            """
+            records = await self.sql.fetch(query, user_id, limit, replica=replica)
+        elif not backward:
+            query = """
+            SELECT id, text, reminder_time, recurrence FROM notes
+            WHERE user_id = $1 AND (reminder_time, id) < ($2, $3)
+            ORDER BY reminder_time DESC, id DESC LIMIT $4
+            """
+            records = await self.sql.fetch(query, user_id, *cursor, limit, replica=replica)
+        else:
+            query = """
+            SELECT id, text, reminder_time, recurrence FROM notes
+            WHERE user_id = $1 AND (reminder_time, id) > ($2, $3)
+            ORDER BY reminder_time ASC, id ASC LIMIT $4
+            """
+            records = await self.sql.fetch(query, user_id, *cursor, limit, replica=replica)
+        return self._trim(records, backward)
+
+    async def fetch_search(
+        self,
+        user_id: int,
+        search: str,
+        cursor: tuple[float, int] | None = None,
+        backward: bool = False,
+        replica: bool = True,
+    ) -> tuple[list, bool]:
+        # Полнотекстовый поиск по GIN индексу на notes.text_tsv, результаты
+        # упорядочены по рангу и листаются по ключу (rank, id).
+        found = """
+            SELECT * FROM (
+                SELECT id, text, reminder_time, recurrence, ts_rank(text_tsv, query.q)::real AS rank
+                FROM notes, (
+                    SELECT websearch_to_tsquery('russian', $2)
+                        || websearch_to_tsquery('simple', $2) AS q
+                ) query
+                WHERE user_id = $1 AND text_tsv @@ query.q
+            ) found
+        """
+        limit = self.items_per_page + 1
+        if cursor is None:
+            query = found + "ORDER BY rank DESC, id DESC LIMIT $3"
+            records = await self.sql.fetch(query, user_id, search, limit, replica=replica)
+        elif not backward:
+            query = found + """
+            WHERE (rank, id) < ($3::real, $4) ORDER BY rank DESC, id DESC LIMIT $5
+            """
+            records = await self.sql.fetch(query, user_id, search, *cursor, limit, replica=replica)
+        else:
+            query = found + """
+            WHERE (rank, id) > ($3::real, $4) ORDER BY rank ASC, id ASC LIMIT $5
+            """
+            records = await self.sql.fetch(query, user_id, search, *cursor, limit, replica=replica)
+        return self._trim(records, backward)
+
+    def _trim(self, records: list, backward: bool) -> tuple[list, bool]:
+        has_more = len(records) > self.items_per_page
+        records = records[: self.items_per_page]
+        if backward:
+            records.reverse()
+        return records, has_more
+
+    def render_page(
+        self,
+        records: list,
+        page: int,
+        prev_data: str | None,
+        next_data: str | None,
+    ) -> tuple[str, list[tuple[str, str]]]:
+        # возвращает текст страницы и кнопки (текст, callback_data)
         text = ""
-        for i, item in enumerate(current, start=1):
-            txt = item["text"]
-            d = item["reminder_time"]
+        offset = (page - 1) * self.items_per_page
+        for i, item in enumerate(records, start=offset + 1):
+            txt = item["text"] or ""
+            d = item["reminder_time"].astimezone(timezone("Europe/Moscow"))
+            d = datetime.strftime(d, '%d-%m-%Y %H:%M')
             if len(txt) > 200:
                 txt = txt[:200] + "..."
-            k = f"{i}. <b>{d}</b>\n{txt}\n"
+            repeat = " (повторяется)" if item.get("recurrence") else ""
+            k = f"{i}. <b>{d}</b>{repeat}\n{html.escape(txt)}\n"
             text += k
 
-        if pages > 1:
+        buttons = []
+        if prev_data:
+            buttons.append(("Назад", prev_data))
+        if next_data:
+            buttons.append((f"Далее ({page})", next_data))
+        return text, buttons
+
+    @staticmethod
+    def build_markup(buttons: list) -> types.InlineKeyboardMarkup:
+        kb = InlineKeyboardBuilder()
+        if buttons:
             kb.row(
-                types.InlineKeyboardButton(
-                    text=f"Далее (1/{pages})",
-                    callback_data=f"nextpage_{chat_id}_{user_id}_{page+1}_{message.message_id}",
-                ),
+                *(
+                    types.InlineKeyboardButton(text=text, callback_data=data)
+                    for text, data in buttons
+                )
             )
+        return kb.as_markup()
 
-        await self.redis.set(f"{chat_id}_{user_id}", json.dumps(records))
-        await message.reply(text, reply_markup=kb.as_markup(), parse_mode="HTML")
+    async def cached_page(
+        self,
+        owner_id: int,
+        version: int,
+        key: str,
+        render: Callable[[], Awaitable[tuple[str, list] | None]],
+    ) -> tuple[str, types.InlineKeyboardMarkup] | None:
+        # Готовая страница берется из кэша одним GET. Версия пользователя
+        # меняется при добавлении и рассылке заметок, так что кэш не устаревает.
+        cached = await self.pages.get(owner_id, version, key)
+        if cached:
+            text, buttons = cached
+            return text, self.build_markup(buttons)
+
+        rendered = await render()
+        if not rendered:
+            return None
+        text, buttons = rendered
+        await self.pages.set(owner_id, version, key, [text, buttons])
+        return text, self.build_markup(buttons)
+
+    async def get_page(
+        self,
+        owner_id: int,
+        user_id: int,
+        page: int = 1,
+        version: int | None = None,
+        cursor: tuple[datetime, int] | None = None,
+        backward: bool = False,
+        key: str = "first",
+    ) -> tuple[str, types.InlineKeyboardMarkup] | None:
+        if version is None:
+            version = await self.pages.version(owner_id)
+
+        async def render():
+            replica = not await self.pages.recently_changed(owner_id)
+            records, has_more = await self.fetch_page(user_id, cursor, backward, replica)
+            if not records:
+                return None
+            has_prev, has_next = (has_more, True) if backward else (cursor is not None, has_more)
+            stem = f"{owner_id}_{{}}_{version}"
+            prev_data = next_data = None
+            if has_prev:
+                first = self.encode_cursor(records[0]["reminder_time"], records[0]["id"])
+                prev_data = f"prevpage_{stem.format(page - 1)}_{first}"
+            if has_next:
+                last = self.encode_cursor(records[-1]["reminder_time"], records[-1]["id"])
+                next_data = f"nextpage_{stem.format(page + 1)}_{last}"
+            return self.render_page(records, page, prev_data, next_data)
+
+        return await self.cached_page(owner_id, version, key, render)
+
+    async def get_search_page(
+        self,
+        owner_id: int,
+        user_id: int,
+        digest: str,
+        search: str | None,
+        page: int = 1,
+        version: int | None = None,
+        cursor: tuple[float, int] | None = None,
+        backward: bool = False,
+        key: str | None = None,
+    ) -> tuple[str, types.InlineKeyboardMarkup] | None:
+        if version is None:
+            version = await self.pages.version(owner_id)
+
+        async def render():
+            # текст запроса нужен только если страницы нет в кэше
+            query = search or await self.redis.get(f"notes_search:{owner_id}:{digest}")
+            if not query:
+                return None
+            query = query if isinstance(query, str) else query.decode()
+            replica = not await self.pages.recently_changed(owner_id)
+            records, has_more = await self.fetch_search(
+                user_id, query, cursor, backward, replica
+            )
+            if not records:
+                return None
+            has_prev, has_next = (has_more, True) if backward else (cursor is not None, has_more)
+            stem = f"{owner_id}_{{}}_{version}_{digest}"
+            prev_data = next_data = None
+            if has_prev:
+                first = self.encode_rank_cursor(records[0]["rank"], records[0]["id"])
+                prev_data = f"sprev_{stem.format(page - 1)}_{first}"
+            if has_next:
+                last = self.encode_rank_cursor(records[-1]["rank"], records[-1]["id"])
+                next_data = f"snext_{stem.format(page + 1)}_{last}"
+            return self.render_page(records, page, prev_data, next_data)
+
+        return await self.cached_page(owner_id, version, key or f"search_{digest}", render)
 
-    async def next_page(self, cb: types.CallbackQuery):
-        data = cb.data
-        if not data:
+    async def my_notes(self, message: types.Message, user: User, state: FSMContext):
+        if not message.from_user:
             return
-        data = data.split("_")
-        # str, chat_id, user_id, page, message_id
-        chat_id = int(data[1])
-        user_id = int(data[2])
-        page = int(data[3])
-        m_id = int(data[4])
-
-        if cb.from_user.id != user_id:
-            return await cb.answer("Это не для вас")
+        if not user.email:
+            return await message.reply(
+                "Вы не зарегистрированы! Пройдите регистрацию через команду /start"
+            )
 
-        parsed = await self.redis.get(f"{chat_id}_{user_id}")
-        if not parsed:
-            return await cb.answer("Нет данных")
-        parsed = json.loads(parsed)
+        rendered = await self.get_page(message.from_user.id, user.id)
+        if not rendered:
+            return await message.reply("Заметок нет.")
 
-        kb = InlineKeyboardBuilder()
-        total_items = len(parsed)
-        pages = math.ceil(total_items / self.items_per_page)
+        text, markup = rendered
+        await message.reply(text, reply_markup=markup, parse_mode="HTML")
 
-        offset = (page - 1) * self.items_per_page
-        current = parsed[offset : offset + self.items_per_page]
+    async def search(self, message: types.Message, user: User, command: filters.CommandObject):
+        if not message.from_user:
+            return
+        if not user.email:
+            return await message.reply(
+                "Вы не зарегистрированы! Пройдите регистрацию через команду /start"
+            )
+        search = (command.args or "").strip()[:256]
+        if not search:
+            return await message.reply("Введите запрос: /search текст")
 
-        text = ""
-        for i, item in enumerate(current, start=1):
-            txt = item["text"]
-            d = item["reminder_time"]
-            if len(txt) > 200:
-                txt = txt[:200] + "..."
-            k = f"{i}. <b>{d}</b>\n{txt}\n"
-            text += k
+        owner_id = message.from_user.id
+        # в callback_data помещается только короткий хэш запроса,
+        # сам текст запроса лежит в Redis
+        digest = hashlib.sha1(search.encode()).hexdigest()[:8]
+        await self.redis.set(f"notes_search:{owner_id}:{digest}", search, ex=self.pages.ttl)
 
-        if page + 1 <= pages:
-            kb.row(
-                types.InlineKeyboardButton(
-                    text="Назад",
-                    callback_data=f"prevpage_{chat_id}_{user_id}_{page-1}_{m_id}",
-                ),
-                types.InlineKeyboardButton(
-                    text=f"Далее ({page}/{pages})",
-                    callback_data=f"nextpage_{chat_id}_{user_id}_{page+1}_{m_id}",
-                ),
-            )
-        else:
-            kb.row(
-                types.InlineKeyboardButton(
-                    text="Назад",
-                    callback_data=f"prevpage_{chat_id}_{user_id}_{page-1}_{m_id}",
-                ),
-            )
+        rendered = await self.get_search_page(owner_id, user.id, digest, search)
+        if not rendered:
+            return await message.reply("Ничего не найдено.")
 
-        if cb.message:
-            await self.bot.delete_message(
-                chat_id=chat_id, message_id=cb.message.message_id
-            )
-        await self.bot.send_message(
-            chat_id=chat_id,
-            reply_to_message_id=m_id,
-            text=text,
-            reply_markup=kb.as_markup(),
-            parse_mode="HTML",
-        )
+        text, markup = rendered
+        await message.reply(text, reply_markup=markup, parse_mode="HTML")
+
+    async def next_page(self, cb: types.CallbackQuery, user: User):
+        await self.turn_page(cb, user, backward=False)
+
+    async def prev_page(self, cb: types.CallbackQuery, user: User):
+        await self.turn_page(cb, user, backward=True)
 
-    async def prev_page(self, cb: types.CallbackQuery):
+    async def turn_page(self, cb: types.CallbackQuery, user: User, backward: bool):
         data = cb.data
-        if not data:
+        if not data or not cb.message:
             return
-        data = data.split("_")
-        # str, chat_id, user_id, page, message_id
-        chat_id = int(data[1])
-        user_id = int(data[2])
-        page = int(data[3])
-        m_id = int(data[4])
-
-        if cb.from_user.id != user_id:
-            return await cb.answer("Nuh-uh")
+        parts = data.split("_")
+        try:
+            # str, user_id, page, version, reminder_time, id
+            owner_id = int(parts[1])
+            page = int(parts[2])
+            version = int(parts[3])
+            cursor = self.decode_cursor(parts[4], parts[5])
+        except (IndexError, ValueError, OverflowError):
+            # кнопка старого формата, отправленная до обновления бота
+            return await cb.answer("устарело")
+
+        if cb.from_user.id != owner_id:
+            return await cb.answer("Это не для вас")
+        # сразу убираем "часики" на кнопке
+        await cb.answer()
 
-        parsed = await self.redis.get(f"{chat_id}_{user_id}")
-        if not parsed:
-            return await cb.answer("Uh-oh")
-        parsed = json.loads(parsed)
+        rendered = await self.get_page(
+            owner_id, user.id, page, version, cursor, backward, key=data
+        )
+        await self.show_page(cb, rendered)
 
-        kb = InlineKeyboardBuilder()
-        total_items = len(parsed)
-        pages = math.ceil(total_items / self.items_per_page)
+    async def turn_search_page(self, cb: types.CallbackQuery, user: User):
+        data = cb.data
+        if not data or not cb.message:
+            return
+        parts = data.split("_")
+        try:
+            # str, user_id, page, version, digest, rank, id
+            owner_id = int(parts[1])
+            page = int(parts[2])
+            version = int(parts[3])
+            digest = parts[4]
+            cursor = self.decode_rank_cursor(parts[5], parts[6])
+        except (IndexError, ValueError, struct.error):
+            return await cb.answer("устарело")
+
+        if cb.from_user.id != owner_id:
+            return await cb.answer("Это не для вас")
+        await cb.answer()
 
-        offset = (page - 1) * self.items_per_page
-        current = parsed[offset : offset + self.items_per_page]
+        rendered = await self.get_search_page(
+            owner_id, user.id, digest, None, page, version, cursor,
+            backward=parts[0] == "sprev", key=data,
+        )
+        await self.show_page(cb, rendered)
 
-        text = ""
-        for i, item in enumerate(current, start=1):
-            txt = item["text"]
-            d = item["reminder_time"]
-            if len(txt) > 200:
-                txt = txt[:200] + "..."
-            k = f"{i}. <b>{d}</b>\n{txt}\n"
-            text += k
+    async def show_page(
+        self,
+        cb: types.CallbackQuery,
+        rendered: tuple[str, types.InlineKeyboardMarkup] | None,
+    ):
+        if not rendered or not cb.message:
+            return
+        text, markup = rendered
 
-        if page >= 2:
-            kb.row(
-                types.InlineKeyboardButton(
-                    text="Назад",
-                    callback_data=f"prevpage_{chat_id}_{user_id}_{page-1}_{m_id}",
-                ),
-                types.InlineKeyboardButton(
-                    text=f"Далее ({page}/{pages})",
-                    callback_data=f"nextpage_{chat_id}_{user_id}_{page+1}_{m_id}",
-                ),
-            )
-        else:
-            kb.row(
-                types.InlineKeyboardButton(
-                    text=f"Далее ({page}/{pages})",
-                    callback_data=f"nextpage_{chat_id}_{user_id}_{page+1}_{m_id}",
-                ),
-            )
+        chat_id = cb.message.chat.id
+        if self.edit_in_place and isinstance(cb.message, types.Message):
+            # одна правка сообщения вместо удаления и повторной отправки
+            try:
+                await self.bot.edit_message_text(
+                    text=text,
+                    chat_id=chat_id,
+                    message_id=cb.message.message_id,
+                    reply_markup=markup,
+                    parse_mode="HTML",
+                )
+                return
+            except TelegramBadRequest as e:
+                if "message is not modified" in e.message:
+                    return
+                # сообщение не редактируется: отправляем страницу заново
+                self.debug(format_exc())
 
-        if cb.message:
+        # сообщение со страницей отвечает на команду /mynotes
+        reply_to = getattr(cb.message, "reply_to_message", None)
+        try:
             await self.bot.delete_message(
                 chat_id=chat_id, message_id=cb.message.message_id
             )
+        except TelegramBadRequest:
+            self.debug(format_exc())
         await self.bot.send_message(
             chat_id=chat_id,
-            reply_to_message_id=m_id,
+            reply_to_message_id=reply_to.message_id if reply_to else None,
             text=text,
-            reply_markup=kb.as_markup(),
+            reply_markup=markup,
             parse_mode="HTML",
         )
 
@@ -289,7 +497,8 @@ class Notes:
 
         await self.bot.send_message(
             chat_id,
-            text="На какую дату Вы хотите установить заметку? Вы можете выбрать одно из значений ниже или ввести произвольную дату типа ДД-ММ-ГГГГ Ч:М.",
+            text="На какую дату Вы хотите установить заметку? Вы можете выбрать одно из значений ниже или ввести произвольную дату типа ДД-ММ-ГГГГ Ч:М. "
+            "Для повторяющейся заметки введите правило: ежедневно 9:00, по будням 9:00, каждый пн 10:00, каждые 2ч или cron 0 9 * * 1-5.",
             reply_markup=DATES_KB,
         )
 
@@ -303,11 +512,30 @@ class Notes:
         if not message.from_user:
             return
 
-        err_msg = "Введите дату вида ДД-ММ-ГГГ Ч:М (01-08-2024 12:00) или выберите одно из значений ниже."
+        err_msg = (
+            "Введите дату вида ДД-ММ-ГГГ Ч:М (01-08-2024 12:00), правило повтора "
+            "(ежедневно 9:00, каждый пн 10:00, каждые 2ч) или выберите одно из значений ниже."
+        )
 
         date = message.text.strip()
         final = None
+        now = datetime.now(dt_timezone.utc)
         check = date.split('-')
+        rule = recurrence.parse(date, now)
+        if rule:
+            # в базу пишется только первый повтор, следующие считаются
+            # по правилу при срабатывании. В данных диалога время, как и
+            # для остальных дат, хранится по Москве без зоны
+            first = rule.next_occurrence(now, now).astimezone(recurrence.TZ)
+            await set_dialog(state, Form.text_set, {
+                "final": datetime.strftime(first, '%d-%m-%Y %H:%M'),
+                "recurrence": rule.rule,
+            })
+            return await self.bot.send_message(
+                message.chat.id,
+                text="Отлично! Введите текст Вашей повторяющейся заметки.",
+                reply_markup=types.ReplyKeyboardRemove()
+            )
         if len(check) == 3:
             # произвольная дата
             try:
@@ -332,8 +560,9 @@ class Notes:
                 )
             final = md.duration
 
-        await state.set_state(Form.text_set)
-        await state.set_data({"final": datetime.strftime(final, '%d-%m-%Y %H:%M')})
+        await set_dialog(
+            state, Form.text_set, {"final": datetime.strftime(final, '%d-%m-%Y %H:%M')}
+        )
 
         await self.bot.send_message(
             message.chat.id,
@@ -357,20 +586,30 @@ class Notes:
         final = data.get('final')
         if not final:
             return
-        final = datetime.strptime(final, '%d-%m-%Y %H:%M')
+        final = recurrence.localize(datetime.strptime(final, '%d-%m-%Y %H:%M'))
 
-        query = "INSERT INTO notes(user_id, text, reminder_time) VALUES ($1, $2, $3);"
+        # планировщик узнает о новой заметке через NOTIFY сразу после коммита
+        query = f"""
+        WITH ins AS (
+            INSERT INTO notes(user_id, text, reminder_time, recurrence) VALUES ($1, $2, $3, $4)
+            RETURNING id, reminder_time
+        )
+        SELECT pg_notify('{NOTES_CHANNEL}', id || ' ' || extract(epoch FROM reminder_time))
+        FROM ins;
+        """
         try:
-            await self.sql.exec(query, user.id, message.text, final)
+            await self.sql.exec(query, user.id, message.text, final, data.get('recurrence'))
         except Exception:
             self.debug(format_exc())
             return await self.bot.send_message(
                 message.chat.id, "Не удалось сохранить заметку."
             )
+        # закэшированные страницы /mynotes больше не актуальны
+        await self.pages.bump(message.from_user.id)
 
         await self.bot.send_message(
             message.chat.id,
-            text="Заметка сохранена. Я пришлю напоминание о заметке за 10 минут или ранее до установленной даты.",
+            text="Заметка сохранена. Я пришлю напоминание о заметке в установленное время.",
             reply_markup=types.ReplyKeyboardRemove(),
         )
-        await state.clear()
+        await clear_dialog(state)
@@ -2,6 +2,7 @@ from aiogram import F, types, Dispatcher, Bot, filters
 from models.postgres import PostgresInterface
 from typing import Callable
 from models.users import User
+from models.storage import clear_dialog, set_dialog
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 import re
@@ -76,8 +77,7 @@ class Register:
             await state.set_state(Form.email)
             return await message.reply("Введенный email адрес не является валидным. Проверьте свой адрес на ошибки и повторите еще раз.")
 
-        await state.set_data({'email': email})
-        await state.set_state(Form.name)
+        await set_dialog(state, Form.name, {'email': email})
 
         await self.bot.send_message(
             message.chat.id,
@@ -97,11 +97,13 @@ class Register:
         data = await state.get_data()
         email = data['email']
 
-        await state.clear()
+        await clear_dialog(state)
 
-        query = "UPDATE users SET email = $1, name = $2 WHERE telegram_id = $3"
+        user.email = email
+        user.name = message.text.strip()
         try:
-            await self.sql.exec(query, email, message.text.strip(), message.from_user.id)
+            # save() обновляет и кэш пользователя
+            await user.save()
         except Exception:
             self.debug(format_exc())
             return await self.bot.send_message(
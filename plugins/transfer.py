@@ -0,0 +1,272 @@
+from aiogram import F, types, Dispatcher, Bot, filters
+from aiogram.fsm.state import StatesGroup, State
+from aiogram.fsm.context import FSMContext
+from models.notes import NoteManager
+from models.cache import PageCache
+from models.storage import clear_dialog
+from models.users import User
+from reminders import recurrence
+from typing import IO, Any, AsyncGenerator, Callable, Iterator, Optional
+from traceback import format_exc
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+import asyncio
+import codecs
+import csv
+import io
+import json
+
+
+class Form(StatesGroup):
+    import_file = State()
+
+
+class TransferError(ValueError):
+    pass
+
+
+class SpooledInputFile(types.InputFile):
+    """Отдает в aiogram уже записанный файл кусками, не читая его целиком"""
+
+    def __init__(self, file: IO[bytes], filename: str, **kwargs):
+        super().__init__(filename=filename, **kwargs)
+        self.file = file
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+
+class NotesTransfer:
+    """
+    Выгрузка и загрузка заметок файлом.
+
+    /export [csv|json] читает заметки серверным курсором и пишет их во
+    временный файл, который держится в памяти до `spool_size` байт, а
+    дальше уходит на диск. /import принимает такой же файл и грузит его
+    через COPY одной транзакцией.
+    """
+
+    formats = ("csv", "json")
+    fields = ("text", "reminder_time", "processed", "recurrence")
+    spool_size = 1024 * 1024
+    # Bot API не дает скачивать файлы больше 20 МБ
+    max_file_size = 20 * 1024 * 1024
+    max_notes = 100_000
+    max_text = 4096
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        debug: Callable,
+        prefix: str,
+        note_manager: NoteManager,
+        note_pages: PageCache,
+        **_,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.debug = debug
+        self.prefix = prefix
+        self.nm = note_manager
+        self.pages = note_pages
+
+        self.dp.message.register(
+            self.export, filters.Command(commands=["export"], prefix=self.prefix)
+        )
+        self.dp.message.register(
+            self.import_entry, filters.Command(commands=["import"], prefix=self.prefix)
+        )
+        self.dp.message.register(self.file_sent, Form.import_file, F.document)
+        self.dp.message.register(self.import_cancelled, Form.import_file)
+
+    async def write_export(self, user_id: int, fmt: str, out: IO[bytes]) -> int:
+        writer = codecs.getwriter("utf-8")(out)
+        count = 0
+        if fmt == "csv":
+            rows = csv.writer(writer)
+            rows.writerow(self.fields)
+            async for rec in self.nm.stream_user_notes(user_id):
+                rows.writerow(
+                    (
+                        rec["text"],
+                        rec["reminder_time"].isoformat(),
+                        rec["processed"],
+                        rec["recurrence"] or "",
+                    )
+                )
+                count += 1
+        else:
+            # массив пишется по одному элементу, без списка в памяти
+            writer.write("[")
+            async for rec in self.nm.stream_user_notes(user_id):
+                item = {
+                    "text": rec["text"],
+                    "reminder_time": rec["reminder_time"].isoformat(),
+                    "processed": rec["processed"],
+                    "recurrence": rec["recurrence"],
+                }
+                writer.write(("," if count else "") + "\n" + json.dumps(item, ensure_ascii=False))
+                count += 1
+            writer.write("\n]\n")
+        return count
+
+    async def export(self, message: types.Message, user: User, command: filters.CommandObject):
+        if not message.from_user:
+            return
+        if not user.email:
+            return await message.reply(
+                "Вы не зарегистрированы! Пройдите регистрацию через команду /start"
+            )
+        fmt = (command.args or "csv").strip().lower()
+        if fmt not in self.formats:
+            return await message.reply("Формат выгрузки: /export csv или /export json")
+
+        with SpooledTemporaryFile(max_size=self.spool_size) as out:
+            try:
+                count = await self.write_export(user.id, fmt, out)
+            except Exception:
+                self.debug(format_exc())
+                return await message.reply("Не удалось выгрузить заметки.")
+            if not count:
+                return await message.reply("Заметок нет.")
+            await self.bot.send_document(
+                message.chat.id,
+                SpooledInputFile(out, f"notes.{fmt}"),
+                caption=f"Заметок: {count}",
+                reply_to_message_id=message.message_id,
+            )
+
+    async def import_entry(self, message: types.Message, user: User, state: FSMContext):
+        if not message.from_user:
+            return
+        if not user.email:
+            return await message.reply(
+                "Вы не зарегистрированы! Пройдите регистрацию через команду /start"
+            )
+        await state.set_state(Form.import_file)
+        await message.reply(
+            "Отправьте файл .csv или .json с колонками text, reminder_time, processed, recurrence "
+            "(как в /export)."
+        )
+
+    async def import_cancelled(self, message: types.Message, state: FSMContext):
+        await clear_dialog(state)
+        await message.reply("Импорт отменен.")
+
+    def parse_time(self, value: Any) -> datetime:
+        # время без зоны вводится по Москве, как и в /addnote
+        return recurrence.localize(datetime.fromisoformat(str(value).strip()))
+
+    @staticmethod
+    def parse_bool(value: Any) -> bool:
+        if isinstance(value, bool):
+            return value
+        value = str(value or "").strip().lower()
+        if value in ("true", "t", "1", "yes"):
+            return True
+        if value in ("false", "f", "0", "no", ""):
+            return False
+        raise ValueError(f"ожидалось true/false, получено {value!r}")
+
+    @staticmethod
+    def parse_rule(value: Any) -> Optional[str]:
+        if not value:
+            return None
+        return recurrence.load(str(value).strip()).rule
+
+    def read_items(self, text: IO[str], fmt: str) -> Iterator[dict]:
+        if fmt == "csv":
+            reader = csv.DictReader(text)
+            missing = {"text", "reminder_time"} - set(reader.fieldnames or ())
+            if missing:
+                raise TransferError(f"в файле нет колонок: {', '.join(sorted(missing))}")
+            yield from reader
+            return
+        items = json.load(text)
+        if not isinstance(items, list):
+            raise TransferError("ожидался JSON массив заметок")
+        for item in items:
+            if not isinstance(item, dict):
+                raise TransferError("каждая заметка должна быть JSON объектом")
+            yield item
+
+    def parse(self, file: IO[bytes], fmt: str, user_id: int) -> tuple[list[tuple], list[str]]:
+        # строки сразу складываются кортежами в порядке IMPORT_COLUMNS
+        records: list[tuple] = []
+        errors: list[str] = []
+        text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+        try:
+            self._parse_items(text, fmt, user_id, records, errors)
+        finally:
+            # обертка не должна закрывать временный файл
+            text.detach()
+        return records, errors
+
+    def _parse_items(
+        self, text: IO[str], fmt: str, user_id: int, records: list, errors: list
+    ):
+        for i, item in enumerate(self.read_items(text, fmt), start=1):
+            if i > self.max_notes:
+                raise TransferError(f"больше {self.max_notes} заметок в одном файле")
+            try:
+                body = item.get("text")
+                if not isinstance(body, str) or not body.strip():
+                    raise ValueError("пустой текст")
+                if len(body) > self.max_text:
+                    raise ValueError(f"текст длиннее {self.max_text} символов")
+                when = self.parse_time(item.get("reminder_time"))
+                processed = self.parse_bool(item.get("processed"))
+                rule = self.parse_rule(item.get("recurrence"))
+            except ValueError as e:
+                errors.append(f"{i}: {e}")
+                continue
+            records.append((user_id, body, processed, when, rule))
+
+    async def file_sent(self, message: types.Message, user: User, state: FSMContext):
+        if not message.from_user or not message.document:
+            return
+        document = message.document
+        name = (document.file_name or "").lower()
+        fmt = name.rsplit(".", 1)[-1] if "." in name else ""
+        if fmt not in self.formats:
+            return await message.reply("Нужен файл с расширением .csv или .json")
+        if (document.file_size or 0) > self.max_file_size:
+            await clear_dialog(state)
+            return await message.reply("Файл больше 20 МБ.")
+
+        with SpooledTemporaryFile(max_size=self.spool_size) as file:
+            await self.bot.download(document, destination=file)
+            file.seek(0)
+            try:
+                # разбор большого файла не должен блокировать event loop
+                records, errors = await asyncio.to_thread(
+                    self.parse, file, fmt, user.id
+                )
+            except (ValueError, csv.Error, UnicodeDecodeError) as e:
+                await clear_dialog(state)
+                return await message.reply(f"Файл не загружен: {e}")
+
+        if errors:
+            await clear_dialog(state)
+            shown = "\n".join(errors[:10])
+            more = f"\n... и еще {len(errors) - 10}" if len(errors) > 10 else ""
+            return await message.reply(
+                f"Файл не загружен, ошибки в строках ({len(errors)}):\n{shown}{more}",
+                parse_mode=None,
+            )
+        if not records:
+            await clear_dialog(state)
+            return await message.reply("В файле нет заметок.")
+
+        try:
+            count = await self.nm.import_notes(records)
+        except Exception:
+            self.debug(format_exc())
+            await clear_dialog(state)
+            return await message.reply("Не удалось загрузить заметки.")
+        await self.pages.bump(message.from_user.id)
+        await clear_dialog(state)
+        await message.reply(f"Загружено заметок: {count}")
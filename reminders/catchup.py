@@ -0,0 +1,60 @@
+from models.notes import NoteManager
+from datetime import datetime, timedelta, timezone
+from logging import Logger
+from typing import Any, Awaitable, Callable
+from .formatting import format_missed
+
+
+class CatchUp:
+    """
+    Разбор хвоста напоминаний, накопившегося пока бот был выключен.
+
+    Хвост читается серверным курсором пачками по `chunk`, самые свежие
+    напоминания уходят первыми. Напоминания старше `stale_after` (если
+    задано) не рассылаются по одному, а сворачиваются в одну сводку на
+    пользователя.
+    """
+
+    def __init__(
+        self,
+        note_manager: NoteManager,
+        deliver: Callable[[list[Any]], Awaitable[None]],
+        send_summary: Callable[[int, str], Awaitable[None]],
+        log: Logger,
+        owner: str,
+        lease_ttl: timedelta,
+        chunk: int = 100,
+        stale_after: timedelta = timedelta(0),
+    ):
+        self.nm = note_manager
+        self.deliver = deliver
+        self.send_summary = send_summary
+        self.log = log
+        self.owner = owner
+        self.lease_ttl = lease_ttl
+        self.chunk = chunk
+        self.stale_after = stale_after
+
+    async def run(self, until: datetime):
+        try:
+            await self._run(until)
+        except Exception:
+            # недоразобранный хвост подберет периодический sweep планировщика
+            self.log.exception("Reminder catch-up failed")
+
+    async def _run(self, until: datetime):
+        since = datetime.min.replace(tzinfo=timezone.utc)
+        if self.stale_after:
+            since = until - self.stale_after
+            for record in await self.nm.collapse_stale(since):
+                await self.send_summary(record["telegram_id"], format_missed(record))
+
+        total = 0
+        async for ids in self.nm.stream_overdue(since, until, self.chunk):
+            records = await self.nm.claim(ids, self.owner, self.lease_ttl)
+            if records:
+                total += len(records)
+                # пачка сразу уходит в outbox, в памяти ничего не копится
+                await self.deliver(records)
+        if total:
+            self.log.info("Caught up on %d overdue reminders" % total)
@@ -0,0 +1,251 @@
+from aiogram.exceptions import TelegramRetryAfter
+from telethon.errors import FloodWaitError
+from collections import deque
+from logging import Logger
+from typing import Awaitable, Callable, NamedTuple, Optional
+import asyncio
+import time
+
+
+class Job(NamedTuple):
+    chat_id: int
+    text: str
+    enqueued_at: float
+    # строка reminder_outbox, из которой взято сообщение
+    outbox_id: Optional[int] = None
+    attempts: int = 0
+
+
+class DeliveryDeferred(Exception):
+    """Чат недоступен дольше `max_delay`: задача возвращается владельцу"""
+
+    def __init__(self, seconds: float):
+        super().__init__(f"chat is paused for {seconds:.0f}s")
+        self.seconds = seconds
+
+
+class TokenBucket:
+    """Глобальный лимит отправки: `rate` сообщений в секунду, всплеск до `capacity`"""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # под локом, чтобы ожидающие получали токены по очереди
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class DeliveryEngine:
+    """
+    Конкурентная отправка напоминаний.
+
+    Пул из `workers` корутин разбирает очередь. Отправка идет через общий
+    TokenBucket (~30 сообщений/с у Telegram) и не чаще одного сообщения в
+    `per_chat_interval` секунд в один чат. Задачи чата, который еще нельзя
+    писать (пауза между сообщениями или FloodWait/RetryAfter), не держат
+    воркеры: они встают в очередь этого чата, и ее по порядку отправляет
+    одна корутина. В движке, включая отложенные, не больше `max_queue`
+    задач, put() ждет освобождения места.
+
+    Задача, которую пришлось бы держать дольше `max_delay` секунд, не
+    откладывается, а завершается с DeliveryDeferred через on_failed:
+    владелец сам решает, когда ее повторить.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[int, str], Awaitable],
+        log: Logger,
+        workers: int = 16,
+        rate: float = 30,
+        per_chat_interval: float = 1.0,
+        max_queue: int = 1000,
+        max_delay: Optional[float] = None,
+        on_sent: Optional[Callable[[Job], None]] = None,
+        on_failed: Optional[Callable[[Job, Exception], None]] = None,
+    ):
+        self.send = send
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self.log = log
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(rate)
+
+        self._queue: asyncio.Queue[Job] = asyncio.Queue()
+        # места в движке: занимаются в put(), освобождаются после отправки
+        self._slots = asyncio.Semaphore(max_queue)
+        # chat_id -> monotonic время, раньше которого в чат писать нельзя
+        self._chat_ready: dict[int, float] = {}
+        # chat_id -> отложенные задачи чата в порядке отправки
+        self._backlog: dict[int, deque[Job]] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._drains: set[asyncio.Task] = set()
+        self._delayed = 0
+        self._sent = 0
+        self._failed = 0
+        self._flood_waits = 0
+        self._latencies: deque[float] = deque(maxlen=1000)
+        self._send_times: deque[float] = deque(maxlen=1000)
+
+    def start(self, report_interval: float = 60):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+        self._tasks.append(asyncio.create_task(self._report(report_interval)))
+
+    async def _report(self, interval: float):
+        last_sent = -1
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.stats()
+            if stats["sent"] != last_sent or stats["queue"]:
+                self.log.info("Reminder delivery: %s" % stats)
+                last_sent = stats["sent"]
+
+    async def stop(self):
+        tasks = self._tasks + list(self._drains)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def put(
+        self, chat_id: int, text: str, outbox_id: Optional[int] = None, attempts: int = 0
+    ):
+        # ожидание свободного места и есть backpressure для планировщика
+        await self._slots.acquire()
+        self._queue.put_nowait(Job(chat_id, text, time.monotonic(), outbox_id, attempts))
+
+    def stats(self) -> dict:
+        def summary(values: deque[float]) -> dict:
+            if not values:
+                return {"avg": 0.0, "p95": 0.0, "max": 0.0}
+            ordered = sorted(values)
+            return {
+                "avg": sum(ordered) / len(ordered),
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+            }
+
+        return {
+            "queue": self._queue.qsize(),
+            "delayed": self._delayed,
+            "sent": self._sent,
+            "failed": self._failed,
+            "flood_waits": self._flood_waits,
+            # от постановки в очередь до отправки
+            "latency": summary(self._latencies),
+            # длительность самого вызова send
+            "send_time": summary(self._send_times),
+        }
+
+    def _delay(self, job: Job, front: bool = True):
+        wait = self._chat_ready.get(job.chat_id, 0) - time.monotonic()
+        backlog = self._backlog.get(job.chat_id)
+        if self.max_delay is not None and wait > self.max_delay:
+            # столько ждать нельзя: отдаем владельцу и задачу, и очередь чата.
+            # Спящая корутина очереди проснется с пустой очередью и выйдет
+            deferred = [job]
+            self._backlog.pop(job.chat_id, None)
+            while backlog:
+                deferred.append(backlog.popleft())
+                self._delayed -= 1
+            for item in deferred:
+                self._fail(item, DeliveryDeferred(wait))
+            return
+        if backlog is None:
+            backlog = self._backlog[job.chat_id] = deque()
+            task = asyncio.create_task(self._drain(job.chat_id, backlog))
+            self._drains.add(task)
+            task.add_done_callback(self._drains.discard)
+        # отложенная после отправки задача старше уже ждущих в очереди чата
+        if front:
+            backlog.appendleft(job)
+        else:
+            backlog.append(job)
+        self._delayed += 1
+
+    async def _drain(self, chat_id: int, backlog: deque[Job]):
+        # единственная корутина, которая пишет в чат с отложенными задачами
+        try:
+            while backlog:
+                wait = self._chat_ready.get(chat_id, 0) - time.monotonic()
+                if wait > 0:
+                    # пока спим, чужая отправка в этот чат могла поймать
+                    # FloodWait: перечитываем и время, и очередь
+                    await asyncio.sleep(wait)
+                    continue
+                job = backlog.popleft()
+                self._delayed -= 1
+                await self._send(job)
+        finally:
+            if self._backlog.get(chat_id) is backlog:
+                del self._backlog[chat_id]
+
+    def _pace(self, chat_id: int, until: float):
+        self._chat_ready[chat_id] = max(self._chat_ready.get(chat_id, 0), until)
+        if len(self._chat_ready) > 10000:
+            now = time.monotonic()
+            self._chat_ready = {k: v for k, v in self._chat_ready.items() if v > now}
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job: Job):
+        if job.chat_id in self._backlog:
+            # у чата уже есть отложенные задачи: встаем за ними
+            return self._delay(job, front=False)
+        if self._chat_ready.get(job.chat_id, 0) > time.monotonic():
+            # чат еще не готов: не держим воркер, а откладываем задачу
+            return self._delay(job)
+        await self._send(job)
+
+    def _fail(self, job: Job, error: Exception):
+        self._slots.release()
+        self._failed += 1
+        if self.on_failed:
+            self.on_failed(job, error)
+
+    async def _send(self, job: Job):
+        self._pace(job.chat_id, time.monotonic() + self.per_chat_interval)
+
+        await self.bucket.acquire()
+        started = time.monotonic()
+        try:
+            await self.send(job.chat_id, job.text)
+        except (FloodWaitError, TelegramRetryAfter) as e:
+            seconds = e.seconds if isinstance(e, FloodWaitError) else e.retry_after
+            self._flood_waits += 1
+            self.log.warning("Flood wait %ss for chat %s" % (seconds, job.chat_id))
+            self._pace(job.chat_id, time.monotonic() + seconds)
+            return self._delay(job)
+        except Exception as e:
+            self.log.error("Unable to deliver reminder to %s: %s" % (job.chat_id, e))
+            return self._fail(job, e)
+        self._slots.release()
+        finished = time.monotonic()
+        self._sent += 1
+        self._send_times.append(finished - started)
+        self._latencies.append(finished - job.enqueued_at)
+        if self.on_sent:
+            self.on_sent(job)
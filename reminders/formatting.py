@@ -0,0 +1,53 @@
+from datetime import datetime
+from pytz import timezone
+from typing import Any
+
+# максимальная длина текста сообщения в Telegram
+MESSAGE_LIMIT = 4096
+
+
+def format_reminder(record: Any) -> str:
+    reminder_time: datetime = record["reminder_time"]
+    to_timezone = reminder_time.astimezone(timezone("Europe/Moscow"))
+    text: str = record["text"]
+    return f"Напоминание о заметке назначенной на {to_timezone}. Текст Вашей заметки: {text}"
+
+
+def format_missed(record: Any) -> str:
+    # сводка по напоминаниям, которые устарели пока бот был недоступен
+    tz = timezone("Europe/Moscow")
+    first = datetime.strftime(record["first"].astimezone(tz), "%d-%m-%Y %H:%M")
+    last = datetime.strftime(record["last"].astimezone(tz), "%d-%m-%Y %H:%M")
+    return (
+        f"Пока бот был недоступен, Вы пропустили напоминания о заметках ({record['missed']}) "
+        f"за период с {first} по {last}. Список заметок: /mynotes"
+    )
+
+
+def format_digest(
+    records: list[Any], limit: int = MESSAGE_LIMIT
+) -> list[tuple[str, tuple[int, ...]]]:
+    """
+    Собирает напоминания одного пользователя в как можно меньшее число
+    сообщений. Возвращает пары (текст, id заметок в этом сообщении).
+    Одна заметка форматируется так же, как без дайджеста.
+    """
+    messages: list[tuple[str, tuple[int, ...]]] = []
+    if len(records) == 1:
+        text, ids = "", []
+    else:
+        text, ids = f"Напоминания о заметках ({len(records)}):", []
+    for record in records:
+        part = format_reminder(record)
+        if len(text) + 2 + len(part) > limit and ids:
+            messages.append((text, tuple(ids)))
+            text, ids = "", []
+        text = f"{text}\n\n{part}" if text else part
+        ids.append(record["id"])
+        # заметка длиннее лимита режется на несколько сообщений, остаток
+        # после первого куска относится только к ней
+        while len(text) > limit:
+            messages.append((text[:limit], tuple(ids)))
+            text, ids = text[limit:], [record["id"]]
+    messages.append((text, tuple(ids)))
+    return messages
@@ -0,0 +1,7 @@
+from os import getenv, getpid
+import socket
+
+
+def worker_id() -> str:
+    # идентификатор реплики, которой принадлежат арендованные строки
+    return getenv("WORKER_ID") or f"{socket.gethostname()}:{getpid()}"
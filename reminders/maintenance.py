@@ -0,0 +1,42 @@
+from models.partitions import NotePartitions
+from datetime import datetime, timedelta, timezone
+from logging import Logger
+import asyncio
+
+
+class PartitionMaintenance:
+    """
+    Периодически создает секции notes на `ahead` месяцев вперед и уносит
+    в архив секции старше `retention` месяцев, где все заметки отправлены.
+    """
+
+    def __init__(
+        self,
+        partitions: NotePartitions,
+        log: Logger,
+        ahead: int = 2,
+        retention: int = 3,
+        interval: timedelta = timedelta(hours=1),
+    ):
+        self.partitions = partitions
+        self.log = log
+        self.ahead = ahead
+        self.retention = retention
+        self.interval = interval
+
+    async def maintain(self):
+        now = datetime.now(timezone.utc)
+        created = await self.partitions.create(now, self.ahead)
+        if created:
+            self.log.info("Created notes partitions: %s" % ", ".join(created))
+        archived = await self.partitions.archive(now, self.retention)
+        if archived:
+            self.log.info("Archived notes partitions: %s" % ", ".join(archived))
+
+    async def run(self):
+        while True:
+            try:
+                await self.maintain()
+            except Exception:
+                self.log.exception("Notes partition maintenance failed")
+            await asyncio.sleep(self.interval.total_seconds())
@@ -0,0 +1,166 @@
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from telethon.errors import BadRequestError, ForbiddenError
+from models.outbox import OutboxManager
+from datetime import datetime, timedelta, timezone
+from logging import Logger
+from .delivery import DeliveryDeferred, DeliveryEngine, Job
+import asyncio
+import random
+import time
+
+# ошибки, после которых повторять отправку бессмысленно:
+# бот заблокирован, чат удален и т.п.
+PERMANENT_ERRORS = (
+    BadRequestError,
+    ForbiddenError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+)
+
+
+class OutboxRelay:
+    """
+    Перекладывает сообщения из reminder_outbox в DeliveryEngine и
+    подтверждает результат отправки.
+
+    Успешно отправленные удаляются из outbox пачками. При ошибке
+    следующая попытка откладывается экспоненциально с джиттером, после
+    `max_attempts` попыток или при постоянной ошибке сообщение уходит в
+    reminder_outbox_dead и больше не мешает очереди.
+
+    Пока сообщение ждет отправки в DeliveryEngine, его аренда
+    продлевается, а повторно выданная lease() строка, которая уже в
+    движке, пропускается: иначе долгая пауза чата привела бы к двойной
+    отправке.
+    """
+
+    def __init__(
+        self,
+        outbox: OutboxManager,
+        log: Logger,
+        owner: str,
+        lease_ttl: timedelta = timedelta(minutes=5),
+        batch_size: int = 100,
+        max_attempts: int = 8,
+        base_delay: float = 5,
+        max_delay: float = 3600,
+        poll_interval: float = 30,
+        flush_interval: float = 0.5,
+    ):
+        self.outbox = outbox
+        self.log = log
+        self.owner = owner
+        self.lease_ttl = lease_ttl
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+
+        self._wakeup = asyncio.Event()
+        self._sent: list[int] = []
+        self._retry: list[tuple[int, str, float]] = []
+        self._dead: list[tuple[int, str]] = []
+        # outbox id, отданные в DeliveryEngine и еще не отправленные
+        self._in_flight: set[int] = set()
+
+    def wake(self):
+        # в outbox добавились сообщения
+        self._wakeup.set()
+
+    def backoff(self, attempts: int) -> float:
+        # экспоненциальная задержка с "полным" джиттером
+        delay = min(self.max_delay, self.base_delay * 2**attempts)
+        return random.uniform(delay / 2, delay)
+
+    def on_sent(self, job: Job):
+        if job.outbox_id is not None:
+            self._in_flight.discard(job.outbox_id)
+            self._sent.append(job.outbox_id)
+
+    def on_failed(self, job: Job, error: Exception):
+        if job.outbox_id is None:
+            return
+        self._in_flight.discard(job.outbox_id)
+        message = f"{type(error).__name__}: {error}"[:1000]
+        if isinstance(error, DeliveryDeferred):
+            # чат на паузе: повторяем, когда она закончится
+            self._retry.append((job.outbox_id, message, error.seconds))
+        elif isinstance(error, PERMANENT_ERRORS) or job.attempts + 1 >= self.max_attempts:
+            self._dead.append((job.outbox_id, message))
+        else:
+            self._retry.append((job.outbox_id, message, self.backoff(job.attempts)))
+
+    async def flush(self):
+        sent, self._sent = self._sent, []
+        retry, self._retry = self._retry, []
+        dead, self._dead = self._dead, []
+        try:
+            if sent:
+                await self.outbox.ack(sent, self.owner)
+            if retry:
+                ids, errors, delays = zip(*retry)
+                await self.outbox.retry(list(ids), list(errors), list(delays), self.owner)
+                self.wake()
+            if dead:
+                ids, errors = zip(*dead)
+                await self.outbox.bury(list(ids), list(errors), self.owner)
+                self.log.warning("Moved %d reminders to the dead letter table" % len(dead))
+        except Exception as e:
+            # не подтвердили: аренда истечет и сообщение отправится повторно
+            self.log.error("Unable to update the reminder outbox: %s" % e)
+
+    async def renew(self):
+        if not self._in_flight:
+            return
+        try:
+            await self.outbox.renew(list(self._in_flight), self.owner, self.lease_ttl)
+        except Exception as e:
+            self.log.error("Unable to renew reminder outbox leases: %s" % e)
+
+    async def _flush_loop(self):
+        # аренда продлевается трижды за lease_ttl
+        renew_every = self.lease_ttl.total_seconds() / 3
+        renewed = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.monotonic() - renewed >= renew_every:
+                renewed = time.monotonic()
+                await self.renew()
+
+    async def _wait(self):
+        timeout = self.poll_interval
+        nearest = await self.outbox.next_attempt()
+        if nearest is not None:
+            until = (nearest - datetime.now(timezone.utc)).total_seconds()
+            # не крутимся вхолостую, если строку держит чужая транзакция
+            timeout = min(max(until, 0.5), timeout)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self, engine: DeliveryEngine):
+        flusher = asyncio.create_task(self._flush_loop())
+        try:
+            while True:
+                self._wakeup.clear()
+                try:
+                    records = await self.outbox.lease(
+                        self.owner, self.lease_ttl, self.batch_size
+                    )
+                    for r in records:
+                        if r["id"] in self._in_flight:
+                            # аренда истекла, но сообщение еще в движке
+                            continue
+                        self._in_flight.add(r["id"])
+                        await engine.put(r["chat_id"], r["text"], r["id"], r["attempts"])
+                    if len(records) < self.batch_size:
+                        await self._wait()
+                except Exception:
+                    self.log.exception("Reminder outbox relay failed")
+                    await asyncio.sleep(self.poll_interval)
+        finally:
+            flusher.cancel()
@@ -0,0 +1,210 @@
+"""
+Повторяющиеся напоминания.
+
+Правило хранится в notes.recurrence одной строкой, будущие повторы в
+таблицу не пишутся: когда заметка срабатывает, вычисляется только
+следующий повтор и reminder_time этой же строки сдвигается на него.
+
+Правило в базе имеет один из двух видов:
+- "every <секунды>" - с фиксированным интервалом от предыдущего раза;
+- "cron <мин> <час> <день месяца> <месяц> <день недели>" - по календарю,
+  время считается по Москве.
+"""
+
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import NamedTuple, Optional, Union
+from pytz import timezone as pytz_timezone
+import re
+
+TZ = pytz_timezone("Europe/Moscow")
+# дальше этого cron правило считается невыполнимым (например 31 февраля)
+CRON_SEARCH_DAYS = 366 * 5
+MIN_INTERVAL = timedelta(minutes=1)
+
+WEEKDAYS = {"пн": 1, "вт": 2, "ср": 3, "чт": 4, "пт": 5, "сб": 6, "вс": 0}
+UNITS = {"м": "minutes", "ч": "hours", "д": "days", "н": "weeks"}
+
+_TIME = r"(?:\s+(?:в\s+)?(\d{1,2}):(\d{2}))?"
+_DAY = "|".join(WEEKDAYS)
+DAILY = re.compile(rf"^(?:ежедневно|каждый день){_TIME}$")
+WORKDAYS = re.compile(rf"^(?:по будням|в будни){_TIME}$")
+WEEKLY = re.compile(rf"^(?:еженедельно|каждую неделю|каждый|каждую|каждое)(?:\s+({_DAY}))?{_TIME}$")
+INTERVAL = re.compile(r"^кажд(?:ый|ую|ое|ые)\s+(\d+)\s*([мчдн])$")
+CRON = re.compile(r"^cron\s+(.+)$")
+
+
+class Interval(NamedTuple):
+    step: timedelta
+
+    @property
+    def rule(self) -> str:
+        return f"every {int(self.step.total_seconds())}"
+
+    def next_occurrence(self, previous: datetime, now: datetime) -> datetime:
+        # пропущенные за время простоя повторы не наверстываются
+        skipped = max(0, (now - previous) // self.step)
+        return previous + self.step * (skipped + 1)
+
+
+class Cron(NamedTuple):
+    minutes: frozenset[int]
+    hours: frozenset[int]
+    days: frozenset[int]
+    months: frozenset[int]
+    weekdays: frozenset[int]
+    # в cron ограничение по дню месяца и дню недели объединяется через ИЛИ,
+    # если заданы оба
+    any_day: bool
+    source: str
+
+    @property
+    def rule(self) -> str:
+        return f"cron {self.source}"
+
+    def day_matches(self, day: date) -> bool:
+        if day.month not in self.months:
+            return False
+        by_day = day.day in self.days
+        by_weekday = (day.weekday() + 1) % 7 in self.weekdays
+        return (by_day or by_weekday) if self.any_day else (by_day and by_weekday)
+
+    def next_after(self, after: datetime) -> datetime:
+        start = after.astimezone(TZ).replace(second=0, microsecond=0, tzinfo=None)
+        start += timedelta(minutes=1)
+        hours, minutes = sorted(self.hours), sorted(self.minutes)
+        for offset in range(CRON_SEARCH_DAYS):
+            day = start.date() + timedelta(days=offset)
+            if not self.day_matches(day):
+                continue
+            for hour in hours:
+                if offset == 0 and hour < start.hour:
+                    continue
+                for minute in minutes:
+                    if offset == 0 and hour == start.hour and minute < start.minute:
+                        continue
+                    local = datetime(day.year, day.month, day.day, hour, minute)
+                    return TZ.normalize(TZ.localize(local)).astimezone(timezone.utc)
+        raise ValueError(f"cron rule never fires: {self.source}")
+
+    def next_occurrence(self, previous: datetime, now: datetime) -> datetime:
+        return self.next_after(max(previous, now))
+
+
+Recurrence = Union[Interval, Cron]
+
+
+def _cron_field(field: str, low: int, high: int) -> frozenset[int]:
+    values: set[int] = set()
+    for part in field.split(","):
+        part, _, step_text = part.partition("/")
+        step = int(step_text) if step_text else 1
+        if part == "*":
+            first, last = low, high
+        elif "-" in part:
+            first, last = map(int, part.split("-", 1))
+        else:
+            first = last = int(part)
+            if step_text:
+                last = high
+        if step < 1 or first < low or last > high or first > last:
+            raise ValueError(f"bad cron field: {field}")
+        values.update(range(first, last + 1, step))
+    return frozenset(values)
+
+
+def cron(source: str) -> Cron:
+    fields = source.split()
+    if len(fields) != 5:
+        raise ValueError("cron rule needs 5 fields")
+    minute, hour, day, month, weekday = fields
+    weekdays = _cron_field(weekday, 0, 7)
+    if 7 in weekdays:
+        # 7 это тоже воскресенье
+        weekdays = weekdays - {7} | {0}
+    rule = Cron(
+        minutes=_cron_field(minute, 0, 59),
+        hours=_cron_field(hour, 0, 23),
+        days=_cron_field(day, 1, 31),
+        months=_cron_field(month, 1, 12),
+        weekdays=weekdays,
+        any_day=day != "*" and weekday != "*",
+        source=" ".join(fields),
+    )
+    # правило вроде "31 февраля" отбрасываем сразу, а не при срабатывании
+    rule.next_after(datetime(2000, 1, 1, tzinfo=timezone.utc))
+    return rule
+
+
+@lru_cache(maxsize=1024)
+def load(rule: str) -> Recurrence:
+    """Правило из колонки notes.recurrence"""
+    kind, _, value = rule.partition(" ")
+    if kind == "every":
+        step = timedelta(seconds=int(value))
+        if step < MIN_INTERVAL:
+            raise ValueError(f"interval is too short: {rule}")
+        return Interval(step)
+    if kind == "cron":
+        return cron(value)
+    raise ValueError(f"unknown recurrence rule: {rule}")
+
+
+def next_occurrence(rule: str, previous: datetime, now: datetime) -> Optional[datetime]:
+    # None: правило испорчено, заметка больше не повторяется
+    try:
+        return load(rule).next_occurrence(previous, now)
+    except ValueError:
+        return None
+
+
+def localize(when: datetime) -> datetime:
+    """Время, введенное пользователем без зоны, считается московским"""
+    if when.tzinfo is not None:
+        return when
+    return TZ.localize(when)
+
+
+def _time(match: re.Match, now: datetime, group: int) -> tuple[int, int]:
+    if match.group(group) is None:
+        # время не указано: повторяем в то же время, что и сейчас
+        local = now.astimezone(TZ)
+        return local.hour, local.minute
+    hour, minute = int(match.group(group)), int(match.group(group + 1))
+    if hour > 23 or minute > 59:
+        raise ValueError("bad time")
+    return hour, minute
+
+
+def parse(text: str, now: datetime) -> Optional[Recurrence]:
+    """
+    Разбирает повтор, введенный пользователем:
+    "ежедневно 9:00", "по будням 9:00", "каждый пн 10:30",
+    "еженедельно", "каждые 2ч", "каждые 3д", "cron 0 9 * * 1-5".
+    None, если текст не похож на правило повтора.
+    """
+    text = " ".join(text.lower().split())
+    try:
+        if match := DAILY.match(text):
+            hour, minute = _time(match, now, 1)
+            return cron(f"{minute} {hour} * * *")
+        if match := WORKDAYS.match(text):
+            hour, minute = _time(match, now, 1)
+            return cron(f"{minute} {hour} * * 1-5")
+        if match := WEEKLY.match(text):
+            if match.group(1):
+                weekday = WEEKDAYS[match.group(1)]
+            elif text.startswith(("еженедельно", "каждую неделю")):
+                weekday = (now.astimezone(TZ).weekday() + 1) % 7
+            else:
+                return None
+            hour, minute = _time(match, now, 2)
+            return cron(f"{minute} {hour} * * {weekday}")
+        if match := INTERVAL.match(text):
+            step = timedelta(**{UNITS[match.group(2)]: int(match.group(1))})
+            return load(f"every {int(step.total_seconds())}")
+        if match := CRON.match(text):
+            return cron(match.group(1))
+    except ValueError:
+        return None
+    return None
@@ -0,0 +1,204 @@
+from models.postgres import PostgresInterface
+from models.notes import NoteManager, NOTES_CHANNEL, NOTES_RELOAD
+from datetime import datetime, timedelta, timezone
+from logging import Logger
+from typing import Any, Awaitable, Callable, Optional
+from .catchup import CatchUp
+import asyncio
+import heapq
+import random
+
+
+class ReminderScheduler:
+    """
+    Планировщик напоминаний.
+
+    Держит в памяти min-heap (время срабатывания, id заметки) только на
+    ближайшие `horizon` часов и спит до ближайшего напоминания. Новые заметки
+    приходят через LISTEN/NOTIFY, поэтому база не опрашивается впустую.
+
+    Несколько реплик могут работать одновременно: каждая держит свою кучу,
+    но отправляет только арендованные ею заметки. Раз в `lease_ttl` реплика
+    подбирает заметки с истекшей арендой, оставшиеся после упавших соседей.
+    """
+
+    def __init__(
+        self,
+        sql: PostgresInterface,
+        note_manager: NoteManager,
+        deliver: Callable[[list[Any]], Awaitable[None]],
+        log: Logger,
+        owner: str,
+        lead: timedelta = timedelta(0),
+        horizon: timedelta = timedelta(hours=6),
+        batch_size: int = 100,
+        lease_ttl: timedelta = timedelta(minutes=5),
+        digest_window: timedelta = timedelta(0),
+        catch_up: Optional[CatchUp] = None,
+    ):
+        self.sql = sql
+        self.nm = note_manager
+        self.deliver = deliver
+        self.log = log
+        self.lead = lead
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.owner = owner
+        self.lease_ttl = lease_ttl
+        # в режиме дайджеста вместе со сработавшей заметкой забираются
+        # все, что должны сработать в ближайшие digest_window
+        self.digest_window = digest_window
+        self.catch_up = catch_up
+
+        self._heap: list[tuple[datetime, int]] = []
+        # id -> время срабатывания, чтобы не класть одну заметку дважды
+        self._scheduled: dict[int, datetime] = {}
+        self._horizon_end = datetime.min.replace(tzinfo=timezone.utc)
+        self._wakeup = asyncio.Event()
+        self._listener: Any = None
+        self._next_sweep = self.now()
+        self._catch_up_task: Optional[asyncio.Task] = None
+        self._started = False
+
+    @staticmethod
+    def now() -> datetime:
+        return datetime.now(timezone.utc)
+
+    def push(self, note_id: int, reminder_time: datetime):
+        # заметки за горизонтом подтянутся при следующей загрузке окна
+        if reminder_time - self.lead > self._horizon_end:
+            return
+        if self._scheduled.get(note_id) == reminder_time:
+            return
+        self._scheduled[note_id] = reminder_time
+        heapq.heappush(self._heap, (reminder_time - self.lead, note_id))
+        self._wakeup.set()
+
+    def _on_notify(self, conn, pid, channel, payload: str):
+        if payload == NOTES_RELOAD:
+            # массовое изменение: перечитываем окно и сразу подбираем
+            # заметки, которые уже должны были сработать
+            self._horizon_end = datetime.min.replace(tzinfo=timezone.utc)
+            self._next_sweep = self.now()
+            self._wakeup.set()
+            return
+        try:
+            note_id, ts = payload.split()
+            self.push(int(note_id), datetime.fromtimestamp(float(ts), timezone.utc))
+        except ValueError:
+            self.log.warning("Bad %s payload: %s" % (channel, payload))
+
+    def _on_listener_lost(self, conn):
+        # соединение LISTEN оборвалось: уведомления могли потеряться,
+        # поэтому переподписываемся и перечитываем окно целиком
+        if conn is not self._listener:
+            return
+        self.log.warning("Notes listener connection lost")
+        # reset() пула колбэк не снимает: иначе закрытие этого соединения
+        # в пуле позже сбросило бы уже новый слушатель
+        conn.remove_termination_listener(self._on_listener_lost)
+        asyncio.ensure_future(self.sql.unlisten(conn, NOTES_CHANNEL, self._on_notify))
+        self._listener = None
+        self._horizon_end = datetime.min.replace(tzinfo=timezone.utc)
+        self._wakeup.set()
+
+    async def _listen(self):
+        self._listener = await self.sql.listen(NOTES_CHANNEL, self._on_notify)
+        self._listener.add_termination_listener(self._on_listener_lost)
+
+    async def _load_window(self, since: Optional[datetime] = None):
+        # все что старше since уже в куче или подбирается разбором хвоста
+        since = since or self.now()
+        self._horizon_end = self.now() + self.horizon
+        for rec in await self.nm.upcoming(since, self._horizon_end + self.lead):
+            self.push(rec["id"], rec["reminder_time"])
+        self.log.debug("Scheduled %d reminders" % len(self._scheduled))
+
+    def _pop_due(self) -> list[int]:
+        if not self._heap or self._heap[0][0] > self.now():
+            return []
+        now = self.now() + self.digest_window
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, note_id = heapq.heappop(self._heap)
+            # запись устарела, если время заметки с тех пор поменялось
+            if self._scheduled.get(note_id) != fire_at + self.lead:
+                continue
+            del self._scheduled[note_id]
+            due.append(note_id)
+        return due
+
+    async def _fire(self, ids: list[int]):
+        batches = [ids[i : i + self.batch_size] for i in range(0, len(ids), self.batch_size)]
+        # реплики разбирают пачки в разном порядке, чтобы не толкаться
+        # на одних и тех же строках
+        random.shuffle(batches)
+        for batch in batches:
+            records = await self.nm.claim(batch, self.owner, self.lease_ttl)
+            if records:
+                await self.deliver(records)
+
+    async def _sweep(self):
+        self._next_sweep = self.now() + self.lease_ttl
+        while True:
+            records = await self.nm.claim_due(
+                self.lead + self.digest_window, self.batch_size, self.owner, self.lease_ttl
+            )
+            if records:
+                self.log.info("Picked up %d expired reminders" % len(records))
+                await self.deliver(records)
+            if len(records) < self.batch_size:
+                break
+
+    async def _start(self):
+        if self._listener is None:
+            await self._listen()
+        started = self.now()
+        await self._load_window(started)
+        if self.catch_up:
+            # хвост разбирается параллельно, чтобы не задерживать
+            # свежие напоминания
+            self._next_sweep = started + self.lease_ttl
+            self._catch_up_task = asyncio.create_task(self.catch_up.run(started))
+        # только теперь: если база упала раньше, run() повторит запуск
+        # вместе с разбором пропущенных напоминаний
+        self._started = True
+
+    async def run(self):
+        while True:
+            try:
+                await self._run()
+            except Exception:
+                # ошибка базы не должна останавливать рассылку навсегда
+                self.log.exception("Reminder scheduler failed")
+                if self._listener is not None:
+                    self._on_listener_lost(self._listener)
+                self._horizon_end = datetime.min.replace(tzinfo=timezone.utc)
+                await asyncio.sleep(5)
+
+    async def _run(self):
+        if not self._started:
+            await self._start()
+        while True:
+            if self._listener is None:
+                await self._listen()
+            if self.now() >= self._horizon_end:
+                await self._load_window()
+            if self.now() >= self._next_sweep:
+                await self._sweep()
+
+            due = self._pop_due()
+            if due:
+                await self._fire(due)
+                continue
+
+            # спим до ближайшего напоминания или до конца окна
+            wake_at = min(self._horizon_end, self._next_sweep)
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+            timeout = max((wake_at - self.now()).total_seconds(), 0)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
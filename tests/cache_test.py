@@ -0,0 +1,42 @@
+import time
+import pytest
+
+from unittest.mock import AsyncMock, MagicMock
+from models.cache import PageCache, TTLCache
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.get(1)
+    cache.set(3, "c")
+    assert cache.get(2) is None
+    assert cache.get(1) == "a" and cache.get(3) == "c"
+
+
+def test_expires_entries():
+    cache = TTLCache(maxsize=10, ttl=0.01)
+    cache.set(1, "a")
+    time.sleep(0.02)
+    assert cache.get(1) is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_bump_sets_expiring_unique_versions():
+    pipe = MagicMock()
+    pipe.__aenter__ = AsyncMock(return_value=pipe)
+    pipe.__aexit__ = AsyncMock(return_value=False)
+    pipe.execute = AsyncMock()
+    redis = MagicMock()
+    redis.pipeline.return_value = pipe
+    cache = PageCache(redis, "notes", ttl=600)
+
+    await cache.bump(1)
+    await cache.bump(1)
+    first, second = [c for c in pipe.set.call_args_list if c.args[0] == "notes_ver:1"]
+    # ключ версии не вечный, а новая версия не совпадает с прежней
+    assert first.kwargs["ex"] == second.kwargs["ex"] == 1200
+    assert first.args[1] != second.args[1]
+    pipe.persist.assert_not_called()
@@ -0,0 +1,51 @@
+import logging
+import pytest
+
+from unittest.mock import AsyncMock, MagicMock
+from datetime import datetime, timedelta, timezone
+from reminders.catchup import CatchUp
+from reminders.formatting import format_missed
+
+
+@pytest.mark.asyncio
+async def test_catch_up_sends_recent_newest_first_and_collapses_stale():
+    until = datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+    # хвост: id 1..5, чем больше id, тем свежее заметка
+    overdue = [5, 4, 3, 2, 1]
+    summary = {
+        "telegram_id": 42,
+        "missed": 7,
+        "first": until - timedelta(days=3),
+        "last": until - timedelta(days=2),
+    }
+
+    async def stream_overdue(since, until, chunk):
+        for i in range(0, len(overdue), chunk):
+            yield overdue[i : i + chunk]
+
+    nm = MagicMock()
+    nm.stream_overdue = MagicMock(side_effect=stream_overdue)
+    nm.collapse_stale = AsyncMock(return_value=[summary])
+    nm.claim = AsyncMock(side_effect=lambda ids, owner, ttl: [{"id": i} for i in ids])
+    deliver = AsyncMock()
+    send_summary = AsyncMock()
+
+    catch_up = CatchUp(
+        nm,
+        deliver,
+        send_summary,
+        logging.getLogger(),
+        "me",
+        timedelta(minutes=5),
+        chunk=2,
+        stale_after=timedelta(days=1),
+    )
+    await catch_up.run(until)
+
+    # устаревшие свернуты в одну сводку, а не разосланы по одной
+    nm.collapse_stale.assert_called_once_with(until - timedelta(days=1))
+    send_summary.assert_called_once_with(42, format_missed(summary))
+    assert nm.stream_overdue.call_args.args == (until - timedelta(days=1), until, 2)
+
+    delivered = [[r["id"] for r in call.args[0]] for call in deliver.call_args_list]
+    assert delivered == [[5, 4], [3, 2], [1]]
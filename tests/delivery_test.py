@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+import pytest
+
+from telethon.errors import FloodWaitError
+from reminders.delivery import DeliveryEngine, TokenBucket
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=5)
+    started = time.monotonic()
+    for _ in range(15):
+        await bucket.acquire()
+    # 5 токенов сразу, остальные 10 со скоростью 50/с
+    assert time.monotonic() - started >= 0.18
+
+
+@pytest.mark.asyncio
+async def test_flood_wait_requeues_without_blocking_other_chats():
+    sent = []
+    flooded = False
+
+    async def send(chat_id, text):
+        nonlocal flooded
+        if chat_id == 1 and not flooded:
+            flooded = True
+            e = FloodWaitError(request=None, capture=0)
+            e.seconds = 0.2
+            raise e
+        sent.append((chat_id, text))
+
+    engine = DeliveryEngine(
+        send, logging.getLogger(), workers=2, rate=1000, per_chat_interval=0.05
+    )
+    engine.start()
+    await engine.put(1, "a")
+    await engine.put(2, "b")
+    await asyncio.sleep(0.05)
+    assert sent == [(2, "b")]
+    assert engine.stats()["delayed"] == 1
+
+    await asyncio.sleep(0.3)
+    assert (1, "a") in sent
+    assert engine.stats()["flood_waits"] == 1
+    await engine.stop()
+
+
+@pytest.mark.asyncio
+async def test_paced_chat_is_drained_in_order_by_one_task():
+    sent = []
+
+    async def send(chat_id, text):
+        sent.append(text)
+
+    engine = DeliveryEngine(
+        send, logging.getLogger(), workers=4, rate=1000, per_chat_interval=0.02, max_queue=30
+    )
+    engine.start()
+    for i in range(20):
+        await engine.put(1, str(i))
+    await asyncio.sleep(0.05)
+    assert len(engine._drains) == 1
+    # отложенные задачи занимают места в движке
+    assert engine._slots._value == 30 - (20 - len(sent))
+
+    await asyncio.sleep(0.5)
+    assert sent == [str(i) for i in range(20)]
+    assert engine.stats()["delayed"] == 0 and not engine._drains
+    await engine.stop()
+
+
+@pytest.mark.asyncio
+async def test_flood_wait_during_sleeping_drain_defers_backlog_and_frees_chat():
+    sent = []
+    failed = []
+    flood = asyncio.Event()
+
+    async def send(chat_id, text):
+        if text == "slow":
+            # отправка начата до появления очереди чата, FloodWait приходит,
+            # пока корутина очереди спит
+            await flood.wait()
+            e = FloodWaitError(request=None, capture=0)
+            e.seconds = 60
+            raise e
+        sent.append(text)
+
+    engine = DeliveryEngine(
+        send,
+        logging.getLogger(),
+        workers=2,
+        rate=1000,
+        per_chat_interval=0.1,
+        max_delay=1,
+        max_queue=10,
+        on_failed=lambda job, e: failed.append(job.text),
+    )
+    engine.start()
+    await engine.put(1, "slow")
+    await engine.put(1, "a")
+    await asyncio.sleep(0.02)
+    assert len(engine._drains) == 1
+
+    flood.set()
+    await asyncio.sleep(0.15)
+    assert failed == ["slow", "a"]
+    assert not engine._drains and 1 not in engine._backlog
+    assert engine.stats()["delayed"] == 0 and engine._slots._value == 10
+
+    # чат не завис: новая задача не встает в брошенную очередь
+    await engine.put(1, "b")
+    await asyncio.sleep(0.02)
+    assert failed == ["slow", "a", "b"]
+    await engine.stop()
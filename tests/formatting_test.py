@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+
+from reminders.formatting import format_digest, format_reminder
+
+
+def note(i, text="текст"):
+    return {"id": i, "text": text, "reminder_time": datetime(2024, 8, 1, 9, tzinfo=timezone.utc)}
+
+
+def test_single_note_digest_matches_plain_reminder():
+    assert format_digest([note(1)]) == [(format_reminder(note(1)), (1,))]
+
+
+def test_digest_groups_notes_into_one_message():
+    messages = format_digest([note(1), note(2), note(3)])
+    assert len(messages) == 1
+    text, ids = messages[0]
+    assert ids == (1, 2, 3)
+    assert text.startswith("Напоминания о заметках (3):")
+
+
+def test_digest_splits_at_limit():
+    records = [note(i, "x" * 1500) for i in range(5)]
+    messages = format_digest(records)
+    assert all(len(text) <= 4096 for text, _ in messages)
+    assert sum((ids for _, ids in messages), ()) == (0, 1, 2, 3, 4)
+    assert len(messages) == 3
+
+
+def test_oversized_note_is_split_and_attributed_to_itself():
+    messages = format_digest([note(2, "y" * 5000), note(1)])
+    assert all(len(text) <= 4096 for text, _ in messages)
+    # хвост длинной заметки и следующая заметка в одном сообщении
+    assert [ids for _, ids in messages] == [(2,), (2, 1)]
+
+
+def test_oversized_single_note_is_split_not_truncated():
+    messages = format_digest([note(7, "z" * 9000)])
+    assert [ids for _, ids in messages] == [(7,), (7,), (7,)]
+    assert "".join(text for text, _ in messages) == format_reminder(note(7, "z" * 9000))
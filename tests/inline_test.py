@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+from plugins.inline import InlineNotes
+
+
+def make_inline():
+    dp = MagicMock()
+    sql = AsyncMock()
+    sql.fetch.return_value = [
+        {"id": 1, "text": "купить молоко", "reminder_time": datetime.now(timezone.utc)}
+    ]
+    pages = AsyncMock()
+    pages.version.return_value = 0
+    pages.recently_changed.return_value = False
+    inline = InlineNotes(dp, sql, lambda *_: None, pages)
+    inline.debounce = 0.05
+    return inline
+
+
+def make_query(query_id, text):
+    return AsyncMock(id=query_id, query=text, from_user=MagicMock(id=1))
+
+
+@pytest.mark.asyncio
+async def test_only_newest_query_is_computed():
+    inline = make_inline()
+    user = MagicMock(id=5, email="a@b.c")
+    first, second = make_query("1", "ку"), make_query("2", "куп")
+
+    await asyncio.gather(
+        inline.inline_query(first, user), inline.inline_query(second, user)
+    )
+
+    first.answer.assert_not_called()
+    second.answer.assert_called_once()
+    inline.sql.fetch.assert_called_once()
+    assert inline.sql.fetch.call_args.args[2:4] == ("куп", "кур")
+    assert second.answer.call_args.kwargs["is_personal"] is True
+
+
+@pytest.mark.asyncio
+async def test_repeated_query_is_served_from_memory():
+    inline = make_inline()
+    user = MagicMock(id=5, email="a@b.c")
+
+    await inline.inline_query(make_query("1", "100%_"), user)
+    repeat = make_query("2", "100%_")
+    await inline.inline_query(repeat, user)
+
+    inline.sql.fetch.assert_called_once()
+    # спецсимволы LIKE не нужны: префикс ищется диапазоном
+    assert inline.sql.fetch.call_args.args[2:4] == ("100%_", "100%`")
+    assert repeat.answer.call_args.args[0][0].id == "1"
+
+
+@pytest.mark.asyncio
+async def test_fresh_changes_are_read_from_primary():
+    inline = make_inline()
+    user = MagicMock(id=5, email="a@b.c")
+
+    await inline.inline_query(make_query("1", "ку"), user)
+    assert inline.sql.fetch.call_args.kwargs == {"replica": True}
+
+    # заметку только что добавили: реплика может ее еще не видеть
+    inline.pages.version.return_value = 1
+    inline.pages.recently_changed.return_value = True
+    await inline.inline_query(make_query("2", "ку"), user)
+    assert inline.sql.fetch.call_args.kwargs == {"replica": False}
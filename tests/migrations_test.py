@@ -0,0 +1,85 @@
+import asyncpg
+import pytest
+
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock
+from models.migrations import MIGRATIONS, Migration, SchemaMigrator
+from models.postgres import PostgresInterface
+
+
+class FakeConnection:
+    def __init__(self, version=0, lock_free_after=0):
+        self.version = version
+        self.lock_attempts = lock_free_after
+        self.log: list[str] = []
+        self.in_transaction = False
+
+    async def fetchval(self, query, *args):
+        if "pg_try_advisory_lock" in query:
+            self.lock_attempts -= 1
+            return self.lock_attempts < 0
+        return self.version
+
+    async def execute(self, query, *args):
+        if "INSERT INTO schema_version" in query:
+            self.version = args[0]
+        self.log.append(f"{'tx ' if self.in_transaction else ''}{query.strip()}")
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.in_transaction = True
+        try:
+            yield
+        finally:
+            self.in_transaction = False
+
+
+def make_migrator(conn, version, migrations=MIGRATIONS):
+    sql = PostgresInterface(lambda *_: None)
+    sql.fetchrow = AsyncMock(return_value=[version])
+
+    @asynccontextmanager
+    async def acquire():
+        yield conn
+
+    sql.pool = MagicMock(acquire=acquire)
+    return SchemaMigrator(sql, lambda *_: None, migrations, lock_poll=0)
+
+
+@pytest.mark.asyncio
+async def test_up_to_date_schema_costs_one_select():
+    conn = FakeConnection()
+    migrator = make_migrator(conn, max(m.version for m in MIGRATIONS))
+
+    assert await migrator.migrate() == 0
+    migrator.sql.fetchrow.assert_called_once()
+    assert conn.log == []
+
+
+@pytest.mark.asyncio
+async def test_missing_version_table_means_fresh_database():
+    migrator = make_migrator(FakeConnection(), 0)
+    migrator.sql.fetchrow.side_effect = asyncpg.UndefinedTableError("no table")
+    assert await migrator.version() == 0
+
+
+@pytest.mark.asyncio
+async def test_applies_pending_migrations_under_lock():
+    migrations = (
+        Migration(1, "one", ("SELECT 1",)),
+        Migration(3, "three", ("CREATE INDEX CONCURRENTLY i ON t(x)",), transactional=False),
+        Migration(2, "two", ("SELECT 2",)),
+    )
+    # другая реплика держит блокировку первые две попытки
+    conn = FakeConnection(version=1, lock_free_after=2)
+    migrator = make_migrator(conn, 1, migrations)
+
+    assert await migrator.migrate() == 2
+
+    statements = [q for q in conn.log if "schema_version" not in q]
+    assert statements == [
+        "tx SELECT 2",
+        "CREATE INDEX CONCURRENTLY i ON t(x)",
+        "SELECT pg_advisory_unlock($1)",
+    ]
+    assert conn.version == 3
@@ -0,0 +1,114 @@
+import pytest
+
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Chat, Message
+from plugins.notes import Notes
+
+
+def make_notes():
+    # хендлеры не нужны, только рендер страниц
+    return object.__new__(Notes)
+
+
+def test_cursor_round_trip_keeps_microseconds():
+    when = datetime(2024, 8, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    ts, note_id = Notes.encode_cursor(when, 987654).split("_")
+    assert Notes.decode_cursor(ts, note_id) == (when, 987654)
+
+
+def test_page_buttons_fit_callback_limit():
+    notes = make_notes()
+    when = datetime(2099, 12, 31, 23, 59, 59, 999999, tzinfo=timezone.utc)
+    records = [{"id": 2**31 - 1, "text": "<b>x</b>", "reminder_time": when}]
+    cursor = Notes.encode_cursor(when, 2**31 - 1)
+    text, buttons = notes.render_page(
+        records,
+        9999,
+        f"prevpage_9999999999_9998_999_{cursor}",
+        f"nextpage_9999999999_10000_999_{cursor}",
+    )
+    markup = notes.build_markup(buttons)
+
+    assert "&lt;b&gt;" in text
+    assert text.startswith(f"{9998 * Notes.items_per_page + 1}.")
+    buttons = markup.inline_keyboard[0]
+    assert [b.text for b in buttons] == ["Назад", "Далее (9999)"]
+    assert all(len(b.callback_data.encode()) <= 64 for b in buttons)
+
+
+def test_search_cursor_round_trip_and_fits_callback_limit():
+    rank, note_id = Notes.encode_rank_cursor(0.0607927, 2**31 - 1).split("_")
+    decoded = Notes.decode_rank_cursor(rank, note_id)
+    assert decoded[1] == 2**31 - 1
+    assert abs(decoded[0] - 0.0607927) < 1e-7
+    data = f"snext_9999999999_10000_999_0123abcd_{rank}_{note_id}"
+    assert len(data.encode()) <= 64
+
+
+def make_callback(data):
+    chat = Chat(id=1, type="private")
+    message = Message(message_id=7, date=datetime.now(timezone.utc), chat=chat)
+    return AsyncMock(data=data, message=message, from_user=AsyncMock(id=1))
+
+
+@pytest.mark.asyncio
+async def test_turn_page_edits_message_in_place():
+    notes = make_notes()
+    notes.bot = AsyncMock()
+    notes.debug = lambda *_: None
+    notes.get_page = AsyncMock(return_value=("text", None))
+    cb = make_callback("nextpage_1_2_0_a_b")
+
+    await notes.turn_page(cb, AsyncMock(id=5), backward=False)
+
+    cb.answer.assert_called_once_with()
+    notes.bot.edit_message_text.assert_called_once()
+    notes.bot.delete_message.assert_not_called()
+    notes.bot.send_message.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_turn_page_ignores_not_modified():
+    notes = make_notes()
+    notes.bot = AsyncMock()
+    notes.bot.edit_message_text.side_effect = TelegramBadRequest(
+        method=AsyncMock(), message="Bad Request: message is not modified"
+    )
+    notes.debug = lambda *_: None
+    notes.get_page = AsyncMock(return_value=("text", None))
+
+    await notes.turn_page(make_callback("prevpage_1_1_0_a_b"), AsyncMock(id=5), backward=True)
+
+    notes.bot.send_message.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_turn_page_answers_buttons_of_old_format():
+    notes = make_notes()
+    notes.get_page = AsyncMock()
+    # nextpage_{chat}_{user}_{page}_{mid} до перехода на курсоры
+    cb = make_callback("nextpage_1_1_2_345")
+
+    await notes.turn_page(cb, AsyncMock(id=5), backward=False)
+
+    cb.answer.assert_called_once_with("устарело")
+    notes.get_page.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_search_page_uses_shared_renderer():
+    notes = make_notes()
+    notes.bot = AsyncMock()
+    notes.debug = lambda *_: None
+    notes.get_search_page = AsyncMock(return_value=("text", None))
+    rank, note_id = Notes.encode_rank_cursor(0.5, 10).split("_")
+    cb = make_callback(f"sprev_1_1_0_0123abcd_{rank}_{note_id}")
+
+    await notes.turn_search_page(cb, AsyncMock(id=5))
+
+    args, kwargs = notes.get_search_page.call_args
+    assert args[2] == "0123abcd" and args[6] == (0.5, 10)
+    assert kwargs["backward"] is True
+    notes.bot.edit_message_text.assert_called_once()
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import pytest
+
+from unittest.mock import AsyncMock
+from telethon.errors import UserIsBlockedError
+from datetime import timedelta
+from reminders.delivery import DeliveryDeferred, DeliveryEngine, Job
+from reminders.outbox import OutboxRelay
+
+
+@pytest.mark.asyncio
+async def test_relay_acks_retries_and_buries():
+    outbox = AsyncMock()
+    relay = OutboxRelay(outbox, logging.getLogger(), "me", max_attempts=3)
+
+    relay.on_sent(Job(1, "a", 0, outbox_id=10))
+    relay.on_failed(Job(2, "b", 0, outbox_id=11, attempts=0), TimeoutError())
+    relay.on_failed(Job(3, "c", 0, outbox_id=12, attempts=2), TimeoutError())
+    relay.on_failed(Job(4, "d", 0, outbox_id=13), UserIsBlockedError(request=None))
+    await relay.flush()
+
+    outbox.ack.assert_called_once_with([10], "me")
+    ids, _, delays, _ = outbox.retry.call_args.args
+    assert ids == [11] and 2.5 <= delays[0] <= 5
+    ids, _, _ = outbox.bury.call_args.args
+    assert ids == [12, 13]
+
+
+@pytest.mark.asyncio
+async def test_relay_skips_in_flight_rows_and_renews_their_leases():
+    outbox = AsyncMock()
+    relay = OutboxRelay(outbox, logging.getLogger(), "me", lease_ttl=timedelta(minutes=5))
+    relay._in_flight = {10, 11}
+
+    relay.on_sent(Job(1, "a", 0, outbox_id=10))
+    await relay.renew()
+    outbox.renew.assert_called_once_with([11], "me", timedelta(minutes=5))
+
+    relay.on_failed(Job(2, "b", 0, outbox_id=11), DeliveryDeferred(120))
+    await relay.flush()
+    ids, _, delays, _ = outbox.retry.call_args.args
+    assert ids == [11] and delays == [120]
+    assert not relay._in_flight
+
+
+@pytest.mark.asyncio
+async def test_engine_defers_jobs_paused_longer_than_max_delay():
+    failed = []
+    engine = DeliveryEngine(
+        AsyncMock(),
+        logging.getLogger(),
+        per_chat_interval=10,
+        max_delay=1,
+        on_failed=lambda job, e: failed.append((job.text, type(e))),
+    )
+    engine.start()
+    await engine.put(1, "a")
+    await engine.put(1, "b")
+    await asyncio.sleep(0.05)
+    assert failed == [("b", DeliveryDeferred)]
+    await engine.stop()
@@ -0,0 +1,91 @@
+import asyncpg
+import pytest
+
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock
+from models.partitions import NotePartitions, month_start, partition_month
+
+
+def test_month_start_shifts_across_years():
+    now = datetime(2024, 11, 20, tzinfo=timezone.utc)
+    assert month_start(now) == datetime(2024, 11, 1)
+    assert month_start(now, 3) == datetime(2025, 2, 1)
+    assert month_start(now, -11) == datetime(2023, 12, 1)
+    assert partition_month("notes_p202402") == datetime(2024, 2, 1)
+
+
+@pytest.mark.asyncio
+async def test_create_covers_ahead_and_stray_months():
+    sql = AsyncMock()
+    sql.fetch.return_value = [{"month": datetime(2023, 5, 1)}]
+    sql.fetchrow.side_effect = lambda query, month: [month != datetime(2024, 8, 1)]
+    partitions = NotePartitions(sql, lambda *_: None)
+
+    created = await partitions.create(datetime(2024, 8, 15, tzinfo=timezone.utc), 2)
+
+    assert created == ["notes_p202305", "notes_p202409", "notes_p202410"]
+
+
+def archive_sql(archived=()):
+    sql = AsyncMock()
+    session = AsyncMock()
+    session.fetchval.side_effect = lambda query, name: (
+        name if name.split(".")[1] in archived else None
+    )
+
+    @asynccontextmanager
+    async def transaction():
+        yield session
+
+    sql.transaction = transaction
+    return sql, session
+
+
+@pytest.mark.asyncio
+async def test_archive_skips_recent_and_pending_partitions():
+    sql, session = archive_sql()
+    sql.fetch.return_value = [
+        {"relname": "notes_p202401"},
+        {"relname": "notes_p202402"},
+        {"relname": "notes_p202405"},
+    ]
+    # в notes_p202402 осталась неотправленная заметка
+    sql.fetchrow.side_effect = lambda query: ['"notes_p202402"' in query]
+    partitions = NotePartitions(sql, lambda *_: None)
+
+    archived = await partitions.archive(datetime(2024, 8, 15, tzinfo=timezone.utc), 3)
+
+    assert archived == ["notes_p202401"]
+    statements = [c.args[0] for c in session.exec.call_args_list]
+    assert statements == [
+        "SET LOCAL lock_timeout = '2s'",
+        'ALTER TABLE notes DETACH PARTITION "notes_p202401"',
+        'ALTER TABLE "notes_p202401" SET SCHEMA notes_archive',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_recreated_partition_is_merged_into_archive():
+    sql, session = archive_sql(archived={"notes_p202401"})
+    sql.fetch.return_value = [{"relname": "notes_p202401"}]
+    sql.fetchrow.return_value = [False]
+    partitions = NotePartitions(sql, lambda *_: None)
+
+    assert await partitions.archive(datetime(2024, 8, 15, tzinfo=timezone.utc), 3) == [
+        "notes_p202401"
+    ]
+    insert, drop = [c.args[0] for c in session.exec.call_args_list][2:]
+    assert 'INSERT INTO notes_archive."notes_p202401"' in insert
+    assert drop == 'DROP TABLE "notes_p202401"'
+
+
+@pytest.mark.asyncio
+async def test_archive_gives_up_on_lock_timeout():
+    sql, session = archive_sql()
+    sql.fetch.return_value = [{"relname": "notes_p202401"}]
+    sql.fetchrow.return_value = [False]
+    session.exec.side_effect = [None, asyncpg.LockNotAvailableError("timeout")]
+    partitions = NotePartitions(sql, lambda *_: None)
+
+    assert await partitions.archive(datetime(2024, 8, 15, tzinfo=timezone.utc), 3) == []
@@ -0,0 +1,93 @@
+import pytest
+
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock
+from models.postgres import PostgresInterface, escape_like, prefix_range
+
+
+def make_sql():
+    conn = MagicMock()
+    conn.execute = AsyncMock(return_value="INSERT 0 1")
+    conn.executemany = AsyncMock(return_value=None)
+    conn.fetchval = AsyncMock(return_value=7)
+    conn.copy_records_to_table = AsyncMock(return_value="COPY 3")
+    events = []
+
+    @asynccontextmanager
+    async def transaction(**options):
+        events.append(("begin", options))
+        yield
+        events.append(("commit",))
+
+    conn.transaction = transaction
+    acquires = []
+
+    @asynccontextmanager
+    async def acquire():
+        acquires.append(1)
+        yield conn
+
+    sql = PostgresInterface(lambda *_: None)
+    sql.pool = MagicMock(acquire=acquire)
+    return sql, conn, events, acquires
+
+
+@pytest.mark.asyncio
+async def test_transaction_pins_one_connection():
+    sql, conn, events, acquires = make_sql()
+
+    async with sql.transaction(isolation="serializable") as session:
+        await session.exec("INSERT INTO t VALUES ($1)", 1)
+        assert await session.fetchval("SELECT count(*) FROM t") == 7
+        assert await session.copy("t", [(1,), (2,), (3,)], ["x"]) == 3
+
+    assert len(acquires) == 1
+    assert events == [("begin", {"isolation": "serializable"}), ("commit",)]
+    conn.copy_records_to_table.assert_called_once_with(
+        "t", records=[(1,), (2,), (3,)], columns=["x"]
+    )
+    assert sql.stats.snapshot()["COPY t"]["rows"] == 3
+
+
+@pytest.mark.asyncio
+async def test_pipeline_batches_repeated_statements():
+    sql, conn, events, acquires = make_sql()
+
+    async with sql.pipeline() as p:
+        p.add("INSERT INTO t VALUES ($1)", 1)
+        p.add("INSERT INTO t VALUES ($1)", 2)
+        p.add("UPDATE t SET x = $1", 3)
+        p.add("INSERT INTO t VALUES ($1)", 4)
+
+    assert len(acquires) == 1 and events[0][0] == "begin"
+    conn.executemany.assert_called_once_with("INSERT INTO t VALUES ($1)", [(1,), (2,)])
+    assert [c.args for c in conn.execute.call_args_list] == [
+        ("UPDATE t SET x = $1", 3),
+        ("INSERT INTO t VALUES ($1)", 4),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_is_dropped_on_error():
+    sql, conn, events, acquires = make_sql()
+
+    with pytest.raises(RuntimeError):
+        async with sql.pipeline() as p:
+            p.add("INSERT INTO t VALUES ($1)", 1)
+            raise RuntimeError
+
+    assert acquires == []
+
+
+def test_escape_like_makes_wildcards_literal():
+    assert escape_like("100%_a\\b") == "100\\%\\_a\\\\b"
+
+
+def test_prefix_range_bounds_every_string_with_the_prefix():
+    assert prefix_range("abc") == ("abc", "abd")
+    assert prefix_range("я") == ("я", "ѐ")
+    assert prefix_range("a\U0010ffff") == ("a\U0010ffff", "b")
+    start, end = prefix_range("ab")
+    for text in ["ab", "abz", "ab\U0010ffff"]:
+        assert start.encode() <= text.encode() < end.encode()
+    assert not start.encode() <= "ac".encode() < end.encode()
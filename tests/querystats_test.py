@@ -0,0 +1,110 @@
+import logging
+import pytest
+
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock
+from models.postgres import PostgresInterface
+from models.querystats import QueryStats, fingerprint
+
+
+def test_fingerprint_collapses_literals_and_whitespace():
+    a = fingerprint("SELECT 1 FROM t\n   WHERE x = 'a' AND y = $1 LIMIT 10")
+    b = fingerprint("SELECT 2 FROM t WHERE x = 'it''s' AND y = $1 LIMIT 20")
+    assert a == b == "SELECT ? FROM t WHERE x = ? AND y = $1 LIMIT ?"
+
+
+def test_histogram_and_slow_log(caplog):
+    stats = QueryStats(logging.getLogger("test"), slow_threshold=100)
+    for ms in (0.5, 3, 3, 40, 150):
+        stats.record("SELECT $1", ms / 1000, 0.001, rows=2, args=(ms,))
+
+    s = stats.snapshot()["SELECT $1"]
+    assert s["calls"] == 5 and s["rows"] == 10
+    assert s["p50_ms"] == 5 and s["p99_ms"] == 200
+    assert s["max_ms"] == pytest.approx(150)
+    assert [r.getMessage() for r in caplog.records if "Slow query" in r.getMessage()] == [
+        "Slow query 150.0 ms (pool wait 1.0 ms, 2 rows): SELECT $1 (150,)"
+    ]
+    assert "SELECT $1" in stats.dump()
+    stats.reset()
+    assert stats.snapshot() == {}
+
+
+@pytest.mark.asyncio
+async def test_query_args_are_formatted_only_for_slow_query_log(caplog):
+    calls = []
+
+    class Arg:
+        def __repr__(self):
+            calls.append(1)
+            return "arg"
+
+    conn = MagicMock()
+    conn.execute = AsyncMock(return_value="UPDATE 1")
+
+    @asynccontextmanager
+    async def acquire():
+        yield conn
+
+    # DEBUG выключен: отладочная строка не собирается
+    log = logging.getLogger("test.lazy")
+    log.setLevel(logging.INFO)
+    stats = QueryStats(log, slow_threshold=10_000)
+    sql = PostgresInterface(log.debug, stats)
+    sql.pool = MagicMock(acquire=acquire)
+
+    await sql.exec("UPDATE t SET x = $1", Arg())
+    assert calls == []
+
+    stats.slow_threshold = 1e-9
+    await sql.exec("UPDATE t SET x = $1", Arg())
+    assert calls
+    assert "Slow query" in caplog.text and "(arg,)" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_calls_are_recorded_with_row_counts():
+    conn = MagicMock()
+    conn.execute = AsyncMock(return_value="UPDATE 3")
+    conn.fetch = AsyncMock(return_value=[1, 2])
+    conn.fetchrow = AsyncMock(side_effect=RuntimeError("boom"))
+    sql = PostgresInterface(lambda *_: None)
+
+    @asynccontextmanager
+    async def acquire():
+        yield conn
+
+    sql.pool = MagicMock(acquire=acquire)
+    await sql.exec("UPDATE t SET x = 1")
+    await sql.fetch("SELECT x FROM t")
+    with pytest.raises(RuntimeError):
+        await sql.fetchrow("SELECT x FROM t LIMIT 1")
+
+    s = sql.stats.snapshot()
+    assert s["UPDATE t SET x = ?"]["rows"] == 3
+    assert s["SELECT x FROM t"]["rows"] == 2
+    assert s["SELECT x FROM t LIMIT ?"]["errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_replica_reads_use_read_pool():
+    primary, replica = MagicMock(), MagicMock()
+    primary.fetchrow = AsyncMock(return_value={"id": 1})
+    replica.fetchrow = AsyncMock(return_value={"id": 2})
+
+    def pool(conn):
+        @asynccontextmanager
+        async def acquire():
+            yield conn
+
+        return MagicMock(acquire=acquire)
+
+    sql = PostgresInterface(lambda *_: None)
+    sql.pool = pool(primary)
+    # без реплики чтения идут в основную базу
+    assert (await sql.fetchrow("SELECT 1", replica=True))["id"] == 1
+
+    sql._read_pool = pool(replica)
+    assert (await sql.fetchrow("SELECT 1", replica=True))["id"] == 2
+    assert (await sql.fetchrow("SELECT 1"))["id"] == 1
+    assert set(sql.stats.snapshot()) == {"SELECT ?", "[replica] SELECT ?"}
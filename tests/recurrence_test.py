@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+from reminders import recurrence
+
+# понедельник, 12:00 по Москве
+NOW = datetime(2024, 8, 5, 9, 0, tzinfo=timezone.utc)
+
+
+def msk(*args):
+    return recurrence.TZ.localize(datetime(*args)).astimezone(timezone.utc)
+
+
+def test_parse_user_syntax_to_stored_rules():
+    cases = {
+        "ежедневно 9:00": "cron 0 9 * * *",
+        "Каждый день в 21:30": "cron 30 21 * * *",
+        "по будням 8:15": "cron 15 8 * * 1-5",
+        "каждый пт 18:00": "cron 0 18 * * 5",
+        "еженедельно": "cron 0 12 * * 1",
+        "каждые 2ч": "every 7200",
+        "каждые 3 д": "every 259200",
+        "cron */15 9-18 * * 1-5": "cron */15 9-18 * * 1-5",
+    }
+    for text, rule in cases.items():
+        assert recurrence.parse(text, NOW).rule == rule, text
+
+
+def test_parse_rejects_dates_and_bad_rules():
+    for text in ("01-08-2024 12:00", "10м", "ежедневно 25:00", "cron 0 0 31 2 *", "каждые 0м"):
+        assert recurrence.parse(text, NOW) is None, text
+
+
+def test_cron_next_occurrence():
+    workdays = recurrence.load("cron 0 9 * * 1-5")
+    # пятница 09:00 -> понедельник 09:00
+    assert workdays.next_occurrence(msk(2024, 8, 9, 9, 0), msk(2024, 8, 9, 9, 0)) == msk(2024, 8, 12, 9, 0)
+    # день месяца ИЛИ день недели, если заданы оба
+    either = recurrence.load("cron 0 0 1 * 0")
+    assert either.next_after(msk(2024, 8, 5, 12, 0)) == msk(2024, 8, 11, 0, 0)
+    assert either.next_after(msk(2024, 8, 25, 12, 0)) == msk(2024, 9, 1, 0, 0)
+
+
+def test_interval_skips_missed_occurrences():
+    rule = recurrence.load("every 3600")
+    previous = NOW - timedelta(hours=5, minutes=30)
+    assert rule.next_occurrence(previous, NOW) == NOW + timedelta(minutes=30)
+    assert rule.next_occurrence(NOW, NOW) == NOW + timedelta(hours=1)
+
+
+def test_broken_rule_stops_repeating():
+    assert recurrence.next_occurrence("weekly", NOW, NOW) is None
+
+
+def test_localize_reads_naive_time_as_moscow():
+    when = recurrence.localize(datetime(2024, 8, 1, 9, 0))
+    assert when.astimezone(timezone.utc) == datetime(2024, 8, 1, 6, 0, tzinfo=timezone.utc)
+    aware = datetime(2024, 8, 1, 9, 0, tzinfo=timezone.utc)
+    assert recurrence.localize(aware) is aware
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import pytest
+
+from unittest.mock import AsyncMock, MagicMock
+from datetime import datetime, timedelta, timezone
+from models.notes import NOTES_CHANNEL, NOTES_RELOAD
+from reminders.scheduler import ReminderScheduler
+
+
+def make_scheduler(upcoming=(), claim_due=(), **kwargs):
+    sql = MagicMock()
+    sql.listen = AsyncMock(side_effect=lambda *args: MagicMock())
+    sql.unlisten = AsyncMock()
+    nm = MagicMock()
+    nm.upcoming = AsyncMock(return_value=list(upcoming))
+    nm.claim = AsyncMock(side_effect=lambda ids, owner, ttl: [{"id": i} for i in ids])
+    sweeps = list(claim_due)
+    nm.claim_due = AsyncMock(side_effect=lambda *args: sweeps.pop(0) if sweeps else [])
+    deliver = AsyncMock()
+    scheduler = ReminderScheduler(sql, nm, deliver, logging.getLogger(), "me", **kwargs)
+    return scheduler, nm, deliver
+
+
+@pytest.mark.asyncio
+async def test_load_window_keeps_only_the_horizon():
+    now = datetime.now(timezone.utc)
+    scheduler, nm, _ = make_scheduler(
+        upcoming=[{"id": 1, "reminder_time": now + timedelta(minutes=5)}],
+        horizon=timedelta(hours=1),
+        lead=timedelta(minutes=1),
+    )
+    await scheduler._load_window(now)
+
+    since, until = nm.upcoming.call_args.args
+    assert since == now
+    assert until == scheduler._horizon_end + timedelta(minutes=1)
+    assert scheduler._heap == [(now + timedelta(minutes=4), 1)]
+
+    # заметки за горизонтом подтянутся при следующей загрузке окна
+    scheduler.push(2, now + timedelta(hours=2))
+    assert 2 not in scheduler._scheduled
+
+
+@pytest.mark.asyncio
+async def test_pop_due_takes_notes_within_digest_window():
+    now = datetime.now(timezone.utc)
+    scheduler, _, _ = make_scheduler(digest_window=timedelta(minutes=1))
+    scheduler._horizon_end = now + timedelta(hours=1)
+    scheduler.push(1, now + timedelta(seconds=30))
+    assert scheduler._pop_due() == []
+
+    scheduler.push(2, now - timedelta(seconds=1))
+    scheduler.push(3, now + timedelta(minutes=5))
+    assert scheduler._pop_due() == [2, 1]
+    assert list(scheduler._scheduled) == [3]
+
+
+@pytest.mark.asyncio
+async def test_rescheduled_note_skips_stale_heap_entry():
+    now = datetime.now(timezone.utc)
+    scheduler, _, _ = make_scheduler()
+    scheduler._horizon_end = now + timedelta(hours=1)
+    scheduler.push(1, now - timedelta(seconds=1))
+    scheduler.push(1, now + timedelta(minutes=10))
+    assert len(scheduler._heap) == 2
+    assert scheduler._pop_due() == []
+    assert scheduler._scheduled == {1: now + timedelta(minutes=10)}
+
+    scheduler.push(2, now + timedelta(minutes=10))
+    scheduler.push(2, now - timedelta(seconds=2))
+    assert scheduler._pop_due() == [2]
+
+
+@pytest.mark.asyncio
+async def test_on_notify_parses_payloads():
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    scheduler, _, _ = make_scheduler()
+    scheduler._horizon_end = now + timedelta(hours=1)
+
+    scheduler._on_notify(None, 0, NOTES_CHANNEL, "7 %d" % now.timestamp())
+    assert scheduler._scheduled == {7: now}
+    assert scheduler._wakeup.is_set()
+
+    scheduler._on_notify(None, 0, NOTES_CHANNEL, "garbage")
+    assert scheduler._scheduled == {7: now}
+
+    scheduler._next_sweep = now + timedelta(hours=1)
+    scheduler._wakeup.clear()
+    scheduler._on_notify(None, 0, NOTES_CHANNEL, NOTES_RELOAD)
+    # окно перечитывается, просроченные подбираются сразу
+    assert scheduler._horizon_end < now
+    assert scheduler._next_sweep <= datetime.now(timezone.utc)
+    assert scheduler._wakeup.is_set()
+
+
+@pytest.mark.asyncio
+async def test_run_fires_due_notes_and_sweeps_expired_leases():
+    now = datetime.now(timezone.utc)
+    full = [{"id": 100 + i} for i in range(2)]
+    scheduler, nm, deliver = make_scheduler(
+        upcoming=[{"id": 1, "reminder_time": now + timedelta(seconds=0.05)}],
+        claim_due=[full, [{"id": 200}]],
+        batch_size=2,
+        lease_ttl=timedelta(seconds=0.1),
+    )
+    task = asyncio.create_task(scheduler.run())
+    await asyncio.sleep(0.25)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    nm.claim.assert_called_once_with([1], "me", timedelta(seconds=0.1))
+    delivered = [call.args[0] for call in deliver.call_args_list]
+    # полная пачка просроченных дочитывается сразу, следующая проверка
+    # только через lease_ttl
+    assert delivered[:2] == [full, [{"id": 200}]]
+    assert [{"id": 1}] in delivered
+    assert 3 <= nm.claim_due.call_count <= 5
+
+
+@pytest.mark.asyncio
+async def test_lost_listener_drops_its_termination_callback():
+    scheduler, _, _ = make_scheduler()
+    await scheduler._listen()
+    old = scheduler._listener
+    scheduler._on_listener_lost(old)
+    await asyncio.sleep(0)
+    old.remove_termination_listener.assert_called_once_with(scheduler._on_listener_lost)
+    scheduler.sql.unlisten.assert_called_once()
+
+    # поздний колбэк от соединения, вернувшегося в пул, не трогает новый слушатель
+    await scheduler._listen()
+    scheduler._on_listener_lost(old)
+    assert scheduler._listener is not None
@@ -0,0 +1,106 @@
+import pytest
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StorageKey
+from models.storage import RedisHashStorage, clear_dialog, set_dialog
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    async def execute(self):
+        self.redis.calls += 1
+        for name, args, kwargs in self.commands:
+            getattr(self.redis, f"_{name}")(*args, **kwargs)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes: dict[str, dict[bytes, bytes]] = {}
+        self.ttl: dict[str, int] = {}
+        self.calls = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def hgetall(self, name):
+        self.calls += 1
+        return dict(self.hashes.get(name, {}))
+
+    async def delete(self, name):
+        self.calls += 1
+        self.hashes.pop(name, None)
+
+    def _hset(self, name, key=None, value=None, mapping=None):
+        fields = dict(mapping or {})
+        if key is not None:
+            fields[key] = value
+        self.hashes.setdefault(name, {}).update(
+            {k.encode(): v.encode() for k, v in fields.items()}
+        )
+
+    def _hdel(self, name, *keys):
+        for key in keys:
+            self.hashes.get(name, {}).pop(key.encode(), None)
+
+    def _expire(self, name, ttl):
+        self.ttl[name] = ttl
+
+
+KEY = StorageKey(bot_id=1, chat_id=2, user_id=3)
+STEP = State("step", "Form")
+
+
+@pytest.mark.asyncio
+async def test_dialog_step_costs_one_redis_call():
+    redis = FakeRedis()
+    context = FSMContext(RedisHashStorage(redis, ttl=60), KEY)
+
+    await set_dialog(context, STEP, {"final": "01-01-2030 10:00"})
+    assert redis.calls == 1
+    assert redis.hashes["fsm:1:2:3:default"] == {
+        b"data": b'{"final":"01-01-2030 10:00"}',
+        b"state": b"Form:step",
+    }
+    assert redis.ttl["fsm:1:2:3:default"] == 60
+
+    # запись прошла через кэш: чтение в следующем шаге не идет в Redis
+    assert await context.get_state() == "Form:step"
+    assert await context.get_data() == {"final": "01-01-2030 10:00"}
+    assert redis.calls == 1
+
+    await clear_dialog(context)
+    assert redis.calls == 2
+    assert "fsm:1:2:3:default" not in redis.hashes
+
+
+@pytest.mark.asyncio
+async def test_state_and_data_are_read_with_one_call():
+    redis = FakeRedis()
+    writer = RedisHashStorage(redis, local_ttl=0)
+    await writer.set_data(KEY, {"email": "a@b.ru"})
+    await writer.set_state(KEY, STEP)
+
+    redis.calls = 0
+    reader = RedisHashStorage(redis)
+    assert await reader.get_state(KEY) == "Form:step"
+    data = await reader.get_data(KEY)
+    data["email"] = "changed"
+    assert await reader.get_data(KEY) == {"email": "a@b.ru"}
+    assert redis.calls == 1
+
+    # без кэша каждое чтение идет в Redis
+    assert await writer.get_state(KEY) == "Form:step"
+    assert redis.calls == 2
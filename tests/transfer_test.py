@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+import pytest
+
+from datetime import datetime, timezone
+from tempfile import SpooledTemporaryFile
+from unittest.mock import MagicMock
+from plugins.transfer import NotesTransfer, SpooledInputFile
+
+
+def make_transfer(notes=()):
+    async def stream_user_notes(user_id):
+        for rec in notes:
+            yield rec
+
+    transfer = object.__new__(NotesTransfer)
+    transfer.nm = MagicMock(stream_user_notes=stream_user_notes)
+    return transfer
+
+
+NOTES = [
+    {
+        "text": 'с "кавычками", и запятой',
+        "reminder_time": datetime(2024, 8, 1, 9, 0, tzinfo=timezone.utc),
+        "processed": False,
+        "recurrence": "cron 0 9 * * 1-5",
+    },
+    {
+        "text": "вторая\nстрока",
+        "reminder_time": datetime(2024, 8, 2, 9, 0, tzinfo=timezone.utc),
+        "processed": True,
+        "recurrence": None,
+    },
+]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fmt", ["csv", "json"])
+async def test_export_round_trips_through_import(fmt):
+    transfer = make_transfer(NOTES)
+    with SpooledTemporaryFile(max_size=10) as out:
+        assert await transfer.write_export(1, fmt, out) == 2
+        # выгрузка отдается кусками того же файла
+        uploaded = b"".join([c async for c in SpooledInputFile(out, "x", chunk_size=7).read(None)])
+        out.seek(0)
+        records, errors = transfer.parse(out, fmt, 42)
+        assert not out.closed
+
+    assert errors == []
+    assert records == [
+        (42, n["text"], n["processed"], n["reminder_time"], n["recurrence"])
+        for n in NOTES
+    ]
+    if fmt == "json":
+        assert len(json.loads(uploaded)) == 2
+
+
+def test_import_reports_invalid_rows():
+    transfer = make_transfer()
+    buf = io.StringIO()
+    rows = csv.writer(buf)
+    rows.writerow(["text", "reminder_time"])
+    rows.writerow(["ok", "2024-08-01 12:00"])
+    rows.writerow(["", "2024-08-01 12:00"])
+    rows.writerow(["bad date", "завтра"])
+
+    records, errors = transfer.parse(io.BytesIO(buf.getvalue().encode()), "csv", 1)
+
+    assert [r[1] for r in records] == ["ok"]
+    # время без зоны считается московским
+    assert records[0][3].utcoffset().total_seconds() == 3 * 3600
+    assert [e.split(":")[0] for e in errors] == ["2", "3"]
@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+
+from unittest.mock import AsyncMock
+from models.users import User, UserAnonymous, UserManager, UserUpsertBatcher
+
+
+@pytest.mark.asyncio
+async def test_batcher_coalesces_upserts_into_one_query():
+    sql = AsyncMock()
+
+    async def fetch(query, telegram_ids, usernames):
+        return [
+            {"id": i, "telegram_id": t, "username": u, "name": None, "email": None}
+            for i, (t, u) in enumerate(zip(telegram_ids, usernames))
+        ]
+
+    sql.fetch.side_effect = fetch
+    batcher = UserUpsertBatcher(sql)
+    results = await asyncio.gather(
+        batcher.upsert(1, "a"),
+        batcher.upsert(2, "b"),
+        batcher.upsert(1, "a2"),
+    )
+
+    sql.fetch.assert_called_once()
+    _, telegram_ids, usernames = sql.fetch.call_args.args
+    assert telegram_ids == [1, 2] and usernames == ["a2", "b"]
+    assert [r["telegram_id"] for r in results] == [1, 2, 1]
+    assert results[0]["username"] == "a2"
+
+
+def make_user(i):
+    return User({"id": i, "telegram_id": 100 + i, "username": "u", "name": None, "email": None})
+
+
+@pytest.mark.asyncio
+async def test_save_updates_only_dirty_columns_of_one_user():
+    manager = UserManager(AsyncMock(), lambda *_: None)
+    user = make_user(1)
+    user.email = "a@b.ru"
+    await user.save()
+
+    query, *args = manager.sql.exec.call_args.args
+    assert "SET email = $1 WHERE id = $2" in query
+    assert args == ["a@b.ru", 1]
+    assert user.changes() == {}
+
+
+@pytest.mark.asyncio
+async def test_save_many_batches_users_into_one_query():
+    manager = UserManager(AsyncMock(), lambda *_: None)
+    first, second = make_user(1), make_user(2)
+    first.name = "Иван"
+    second.email = "c@d.ru"
+    await manager.save_many([first, second])
+
+    manager.sql.exec.assert_called_once()
+    args = manager.sql.exec.call_args.args[1:]
+    # id, затем (флаг, значение) для username, name, email
+    assert args[0] == [1, 2]
+    assert args[3] == [True, False] and args[4] == ["Иван", None]
+    assert args[5] == [False, True] and args[6] == [None, "c@d.ru"]
+
+
+def user_row(i, username):
+    return {"id": i, "telegram_id": 100 + i, "username": username, "name": None, "email": None}
+
+
+@pytest.mark.asyncio
+async def test_search_users_tops_up_prefix_matches_with_substring_matches():
+    manager = UserManager(AsyncMock(), lambda *_: None)
+    manager.sql.fetch.side_effect = [[user_row(1, "Ivan")], [user_row(2, "big_ivan")]]
+
+    found = await manager.search_users(" @IVAN ", limit=5)
+
+    assert [u.username for u in found] == ["Ivan", "big_ivan"]
+    prefix_call, substring_call = manager.sql.fetch.call_args_list
+    assert prefix_call.args[1:] == ("ivan", "ivao", 5)
+    assert substring_call.args[1:] == ("%ivan%", "ivan%", "ivan", 4)
+    assert prefix_call.kwargs == substring_call.kwargs == {"replica": True}
+
+
+@pytest.mark.asyncio
+async def test_short_username_is_searched_by_prefix_only():
+    manager = UserManager(AsyncMock(), lambda *_: None)
+    manager.sql.fetch.return_value = []
+
+    assert isinstance(await manager.find_user_by_username("a_"), UserAnonymous)
+    manager.sql.fetch.assert_called_once()
+    assert manager.sql.fetch.call_args.args[1:] == ("a_", "a`", 1)
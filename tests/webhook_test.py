@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import pytest
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp.test_utils import TestClient, TestServer
+from webhook import BoundedRequestHandler, webhook_app
+
+SECRET = "test-secret"
+
+
+def make_update(update_id: int, text: str = "/start") -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+async def make_client(handler_fn, **options):
+    dp = Dispatcher()
+    dp.message.register(handler_fn)
+    handler = BoundedRequestHandler(
+        dp, Bot("42:TEST"), logging.getLogger("test"), secret_token=SECRET, **options
+    )
+    client = TestClient(TestServer(webhook_app(handler, "/webhook")))
+    await client.start_server()
+    return client, handler
+
+
+@pytest.mark.asyncio
+async def test_update_is_acknowledged_before_it_is_handled():
+    release = asyncio.Event()
+    seen = []
+
+    async def on_message(message: types.Message):
+        await release.wait()
+        seen.append(message.text)
+
+    client, handler = await make_client(on_message)
+    try:
+        resp = await client.post(
+            "/webhook",
+            json=make_update(1, "hello"),
+            headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+        )
+        assert resp.status == 200
+        assert seen == [] and handler.pending == 1
+
+        release.set()
+        await asyncio.sleep(0.05)
+        assert seen == ["hello"] and handler.pending == 0
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_wrong_secret_is_rejected():
+    async def on_message(message: types.Message):
+        pass
+
+    client, handler = await make_client(on_message)
+    try:
+        resp = await client.post(
+            "/webhook",
+            json=make_update(1),
+            headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"},
+        )
+        assert resp.status == 401
+        resp = await client.post("/webhook", json=make_update(2))
+        assert resp.status == 401
+        assert handler.pending == 0
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_full_backlog_asks_telegram_to_retry():
+    release = asyncio.Event()
+    running = []
+
+    async def on_message(message: types.Message):
+        running.append(message.message_id)
+        await release.wait()
+
+    client, handler = await make_client(on_message, workers=1, backlog=2)
+    try:
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        statuses = [
+            (await client.post("/webhook", json=make_update(i), headers=headers)).status
+            for i in range(3)
+        ]
+        await asyncio.sleep(0.05)
+        assert statuses == [200, 200, 503]
+        # второй апдейт ждет свободного воркера
+        assert running == [0]
+
+        release.set()
+        await asyncio.sleep(0.05)
+        assert running == [0, 1] and handler.pending == 0
+    finally:
+        await client.close()
@@ -0,0 +1,86 @@
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from logging import Logger
+from typing import Any, Optional
+import asyncio
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Прием апдейтов вебхуком.
+
+    Запрос с неверным X-Telegram-Bot-Api-Secret-Token отклоняется с 401.
+    На верный запрос Telegram сразу получает 200, а апдейт обрабатывается
+    в фоне, не больше `workers` одновременно. Если в обработке или в
+    очереди уже `backlog` апдейтов, запрос отклоняется с 503: Telegram
+    повторит его позже, и нагрузка не копится в памяти процесса.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        log: Logger,
+        secret_token: Optional[str] = None,
+        workers: int = 64,
+        backlog: int = 1000,
+        retry_after: int = 1,
+        **data: Any,
+    ):
+        super().__init__(
+            dispatcher=dispatcher,
+            bot=bot,
+            handle_in_background=True,
+            secret_token=secret_token,
+            **data,
+        )
+        self.log = log
+        self.backlog = backlog
+        self.retry_after = retry_after
+        self._slots = asyncio.Semaphore(workers)
+
+    @property
+    def pending(self) -> int:
+        # апдейты в обработке и ждущие свободного воркера
+        return len(self._background_feed_update_tasks)
+
+    async def _background_feed_update(self, bot: Bot, update: dict[str, Any]) -> None:
+        async with self._slots:
+            try:
+                await super()._background_feed_update(bot, update)
+            except Exception:
+                # 200 уже отдан, повторно Telegram этот апдейт не пришлет
+                self.log.exception("Unable to process update %s", update.get("update_id"))
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if self.pending >= self.backlog:
+            self.log.warning("Webhook backlog is full (%d updates), rejecting", self.pending)
+            return web.Response(
+                status=503, headers={"Retry-After": str(self.retry_after)}
+            )
+        try:
+            update = await request.json(loads=bot.session.json_loads)
+        except ValueError:
+            return web.Response(body="Bad Request", status=400)
+        if not isinstance(update, dict):
+            return web.Response(body="Bad Request", status=400)
+
+        task = asyncio.create_task(self._background_feed_update(bot, update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        # при остановке дорабатываем уже принятые апдейты
+        if self._background_feed_update_tasks:
+            await asyncio.gather(*self._background_feed_update_tasks, return_exceptions=True)
+        await super().close()
+
+
+def webhook_app(handler: BoundedRequestHandler, path: str, **kwargs: Any) -> web.Application:
+    app = web.Application()
+    handler.register(app, path=path)
+    # startup/shutdown диспетчера вызываются вместе с приложением
+    setup_application(app, handler.dispatcher, bot=handler.bot, **kwargs)
+    return app